@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# grissom - FOSS compliance tools
+#
+# Copyright (c) 2013 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Measure the time taken to scan, inspect and identify the binary executable
+files of a synthetic root file system, generated by rootfs.py.
+
+For each operation, the number of calls and the percentiles of the time of
+a call are reported. The results can be saved as JSON, along with the
+parameters of the root file system, and compared with those of a previous
+run, to tell whether a change makes an operation slower.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from rootfs import generate
+from grissom import __version__
+from grissom.binfmt.core import BinfmtFinder
+from grissom.binfmt.elf import ElfInspector
+from grissom.common import topological_sort
+from grissom.formatters import create_graph_formatter
+from grissom.misc import SourceCodeFinder
+
+FORMATTERS = ('simple', 'pretty', 'dot')
+
+def scan(ctx):
+    return BinfmtFinder(True, True).scan(ctx['root'])
+
+def find_dependencies(ctx, recursive):
+    graph = []
+    for filename in ctx['binaries']:
+        inspector = ElfInspector(filename)
+        for path in ctx['lib_paths']:
+            inspector.add_library_path(path)
+        graph += inspector.find_dependencies(recursive)
+    return graph
+
+def format_graph(ctx, name):
+    formatter = create_graph_formatter(name)
+    with open(os.devnull, 'w') as f, contextlib.redirect_stdout(f):
+        formatter.format(ctx['graph'])
+
+def find_origins(ctx):
+    finder = SourceCodeFinder()
+    finder.add_search_path(ctx['sources'])
+    for filename in ctx['origin_files']:
+        finder.find_origin_of(filename)
+
+OPERATIONS = [
+    ('scan', scan),
+    ('deps', lambda c: find_dependencies(c, False)),
+    ('deps-deep', lambda c: find_dependencies(c, True)),
+    ('topological_sort', lambda c: topological_sort(dict(c['graph']))),
+] + [('format-' + name, lambda c, n=name: format_graph(c, n))
+     for name in FORMATTERS] + [
+    ('origin', find_origins),
+]
+
+def percentile(values, p):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))
+    return values[index]
+
+def measure(func, ctx, duration, min_calls):
+    func(ctx)
+    times = []
+    start = time.perf_counter()
+    elapsed = 0
+    while elapsed < duration or len(times) < min_calls:
+        t = time.perf_counter()
+        func(ctx)
+        times.append(time.perf_counter() - t)
+        elapsed = time.perf_counter() - start
+    return {
+        'calls': len(times),
+        'min_ms': min(times) * 1000,
+        'p50_ms': percentile(times, 50) * 1000,
+        'p90_ms': percentile(times, 90) * 1000,
+    }
+
+def create_context(tree, n_origin_files):
+    root = tree.root
+    ctx = {
+        'root': root,
+        'sources': tree.sources,
+        'lib_paths': [os.path.join(root, 'lib'),
+                      os.path.join(root, 'usr', 'lib')],
+        'binaries': tree.executables + tree.libraries,
+        'origin_files': tree.executables[:n_origin_files],
+    }
+    ctx['graph'] = find_dependencies(ctx, True)
+    return ctx
+
+def print_results(results, baseline):
+    header = "{0:<18} {1:>7} {2:>10} {3:>10} {4:>10}".format(
+        'operation', 'calls', 'min ms', 'p50 ms', 'p90 ms')
+    if baseline:
+        header += " {0:>10} {1:>8}".format('base p50', 'change')
+    print(header)
+    for name, func in OPERATIONS:
+        if name not in results:
+            continue
+        r = results[name]
+        line = "{0:<18} {1:>7} {2:>10.3f} {3:>10.3f} {4:>10.3f}".format(
+            name, r['calls'], r['min_ms'], r['p50_ms'], r['p90_ms'])
+        base = baseline.get(name) if baseline else None
+        if base:
+            change = (r['p50_ms'] / base['p50_ms'] - 1) * 100
+            line += " {0:>10.3f} {1:>+7.1f}%".format(base['p50_ms'], change)
+        print(line)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--duration', '-d',
+                        type=float,
+                        default=1.0,
+                        metavar='SECS',
+                        help='set measurement duration per operation')
+    parser.add_argument('--executables', '-e',
+                        type=int,
+                        default=64,
+                        help='set number of executables')
+    parser.add_argument('--libraries', '-l',
+                        type=int,
+                        default=32,
+                        help='set number of shared libraries')
+    parser.add_argument('--layers', '-L',
+                        type=int,
+                        default=4,
+                        help='set depth of the chains of dependencies')
+    parser.add_argument('--fanout', '-f',
+                        type=int,
+                        default=2,
+                        help='set number of libraries needed by each file')
+    parser.add_argument('--noise', '-n',
+                        type=int,
+                        default=64,
+                        help='set number of files which are not ELF files')
+    parser.add_argument('--origin-files', '-O',
+                        type=int,
+                        default=4,
+                        metavar='N',
+                        help='set number of files identified by origin')
+    parser.add_argument('--seed',
+                        type=int,
+                        default=0,
+                        help='set seed of the random generator')
+    parser.add_argument('--output', '-o',
+                        metavar='FILE',
+                        help='save results as JSON to FILE')
+    parser.add_argument('--compare', '-c',
+                        metavar='FILE',
+                        help='compare with results saved to FILE')
+    parser.add_argument('--json',
+                        action='store_true',
+                        help='print results as JSON')
+    parser.add_argument('operations',
+                        nargs='*',
+                        metavar='OPERATION',
+                        help='operation to measure (default: all)')
+    args = parser.parse_args()
+
+    names = [name for name, _ in OPERATIONS]
+    for name in args.operations:
+        if name not in names:
+            parser.error("unknown operation '{0}'".format(name))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            saved = json.load(f)
+        baseline = saved['results']
+
+    params = {
+        'executables': args.executables,
+        'libraries': args.libraries,
+        'layers': args.layers,
+        'fanout': args.fanout,
+        'noise': args.noise,
+        'origin_files': args.origin_files,
+        'seed': args.seed,
+    }
+    if baseline and saved['params'] != params:
+        print("Warning: comparing results of different root file systems",
+              file=sys.stderr)
+
+    tmpdir = tempfile.mkdtemp(prefix='grissom-bench-')
+    results = {}
+    try:
+        tree = generate(tmpdir,
+                        args.executables,
+                        args.libraries,
+                        args.layers,
+                        args.fanout,
+                        args.noise,
+                        seed=args.seed)
+        ctx = create_context(tree, args.origin_files)
+        for name, func in OPERATIONS:
+            if args.operations and name not in args.operations:
+                continue
+            if name == 'origin' and not ctx['sources']:
+                print("Skipping origin: 'strip' not found", file=sys.stderr)
+                continue
+            results[name] = measure(func, ctx, args.duration, 5)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    report = {
+        'version': __version__,
+        'python': platform.python_version(),
+        'params': params,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if args.json:
+        print(json.dumps(report, indent=2, sort_keys=True))
+    else:
+        print_results(results, baseline)
+
+# vim: ts=4 sts=4 sw=4 et ai
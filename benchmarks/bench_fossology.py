@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# grissom - FOSS compliance tools
+#
+# Copyright (c) 2013 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Measure the throughput of the operations of the Fossology agent, using a
+local stand-in server replying with the recorded pages from the fixtures
+directory.
+
+The server runs in its own process, so that it does not compete with the
+agent for the interpreter. For each operation, the number of calls and HTTP
+requests per second, the percentiles of the latency of a call and the peak
+of memory allocated during a call are reported.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+import subprocess
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from grissom.legal.cache import SearchCache
+from grissom.legal.fossology import FossologyAgent
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(__file__), 'fossology_server.py')
+
+PKGNAME = 'foo-1.0.0.tar.gz'
+
+def start_server(latency, pages):
+    cmd = [sys.executable, SERVER_SCRIPT,
+           '--port', '0',
+           '--latency', str(latency),
+           '--pages', str(pages)]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                            universal_newlines=True)
+    line = proc.stdout.readline()
+    address = line.split()[-1]
+    return proc, address
+
+def count_requests(address):
+    url = 'http://{0}/stats'.format(address)
+    with urllib.request.urlopen(url) as response:
+        return int(response.read())
+
+def new_agent(address, jobs):
+    # Search results must not be cached, so that searches reach the server.
+    return FossologyAgent(address,
+                          user='bench',
+                          password='bench',
+                          pool_size=jobs,
+                          search_cache=SearchCache(ttl=0))
+
+def login_logout(agent, ctx):
+    agent = new_agent(ctx['address'], ctx['jobs'])
+    agent.login()
+    agent.logout()
+
+OPERATIONS = (
+    ('login+logout', login_logout),
+    ('search', lambda a, c: a.search('%.tar.gz')),
+    ('iter_search', lambda a, c: list(a.iter_search('%.tar.gz', c['jobs']))),
+    ('query', lambda a, c: a.query(PKGNAME)),
+    ('query_all', lambda a, c: a.query_all(PKGNAME)),
+    ('query_major', lambda a, c: a.query_major(PKGNAME)),
+    ('package_report', lambda a, c: a.package_report(PKGNAME)),
+    ('analyze', lambda a, c: a.analyze(c['files'][0])),
+    ('analyze_and_format', lambda a, c: a.analyze_and_format(c['archives'][0])),
+    ('analyze_many', lambda a, c: list(a.analyze_many(c['files'],
+                                                      jobs=c['jobs']))),
+    ('submit', lambda a, c: a.submit(c['archives'][0])),
+    ('submit_many', lambda a, c: list(a.submit_many(c['archives'],
+                                                    jobs=c['jobs'],
+                                                    poll_interval=0.01))),
+    ('job_status', lambda a, c: a.job_status(42)),
+    ('generate_spdx', lambda a, c: a.generate_spdx(PKGNAME, 'bench')),
+)
+
+def percentile(values, p):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))
+    return values[index]
+
+def measure(func, agent, ctx, duration, min_calls):
+    func(agent, ctx)
+    n_requests = count_requests(ctx['address'])
+    latencies = []
+    start = time.perf_counter()
+    elapsed = 0
+    while elapsed < duration or len(latencies) < min_calls:
+        t = time.perf_counter()
+        func(agent, ctx)
+        latencies.append(time.perf_counter() - t)
+        elapsed = time.perf_counter() - start
+    n_requests = count_requests(ctx['address']) - n_requests
+
+    tracemalloc.start()
+    func(agent, ctx)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'calls': len(latencies),
+        'calls_per_sec': len(latencies) / elapsed,
+        'requests_per_sec': n_requests / elapsed,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p90_ms': percentile(latencies, 90) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'peak_kib': peak / 1024.0,
+    }
+
+def create_files(dirname, count, size, suffix):
+    files = []
+    for i in range(count):
+        filename = os.path.join(dirname, 'file-{0}{1}'.format(i, suffix))
+        with open(filename, 'wb') as f:
+            f.write(os.urandom(size))
+        files.append(filename)
+    return files
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--duration', '-d',
+                        type=float,
+                        default=1.0,
+                        metavar='SECS',
+                        help='set measurement duration per operation')
+    parser.add_argument('--latency', '-l',
+                        type=float,
+                        default=0.0,
+                        metavar='SECS',
+                        help='set delay of the server before each reply')
+    parser.add_argument('--pages', '-n',
+                        type=int,
+                        default=1,
+                        help='set number of pages of search results')
+    parser.add_argument('--jobs', '-j',
+                        type=int,
+                        default=4,
+                        help='set number of concurrent requests')
+    parser.add_argument('--files', '-f',
+                        type=int,
+                        default=8,
+                        help='set number of files for batch operations')
+    parser.add_argument('--file-size', '-s',
+                        type=int,
+                        default=65536,
+                        metavar='BYTES',
+                        help='set size of the files to send')
+    parser.add_argument('--json',
+                        action='store_true',
+                        help='print results as JSON')
+    parser.add_argument('operations',
+                        nargs='*',
+                        metavar='OPERATION',
+                        help='operation to measure (default: all)')
+    args = parser.parse_args()
+
+    names = [name for name, _ in OPERATIONS]
+    for name in args.operations:
+        if name not in names:
+            parser.error("unknown operation '{0}'".format(name))
+
+    proc, address = start_server(args.latency, args.pages)
+    tmpdir = tempfile.mkdtemp(prefix='grissom-bench-')
+    results = {}
+    try:
+        ctx = {
+            'address': address,
+            'jobs': args.jobs,
+            'files': create_files(tmpdir, args.files, args.file_size, '.c'),
+            'archives': create_files(tmpdir, args.files, args.file_size,
+                                     '.tar.gz'),
+        }
+        agent = new_agent(address, args.jobs)
+        agent.login()
+        if not args.json:
+            print("{0:<20} {1:>7} {2:>9} {3:>9} {4:>9} {5:>9} {6:>9} {7:>10}".format(
+                'operation', 'calls', 'calls/s', 'req/s',
+                'p50 ms', 'p90 ms', 'p99 ms', 'peak KiB'))
+        for name, func in OPERATIONS:
+            if args.operations and name not in args.operations:
+                continue
+            r = measure(func, agent, ctx, args.duration, 5)
+            results[name] = r
+            if not args.json:
+                print("{0:<20} {1:>7} {2:>9.1f} {3:>9.1f} {4:>9.2f} {5:>9.2f} {6:>9.2f} {7:>10.1f}".format(
+                    name,
+                    r['calls'],
+                    r['calls_per_sec'],
+                    r['requests_per_sec'],
+                    r['p50_ms'],
+                    r['p90_ms'],
+                    r['p99_ms'],
+                    r['peak_kib']))
+        agent.logout()
+    finally:
+        shutil.rmtree(tmpdir)
+        proc.terminate()
+        proc.wait()
+
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+
+# vim: ts=4 sts=4 sw=4 et ai
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# grissom - FOSS compliance tools
+#
+# Copyright (c) 2013 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Measure the throughput of the parsers of Fossology pages, using the recorded
+pages from the fixtures directory.
+
+For each endpoint, the targeted parser used by the agent is compared with a
+full parse of the page.
+"""
+
+import os
+import sys
+import time
+import argparse
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from grissom.legal import fossology
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures', 'fossology')
+
+ENDPOINTS = (
+    ('search', 'search.html',
+     lambda d: fossology._parse_search_page(d)),
+    ('search-attrs', 'search-attrs.html',
+     lambda d: fossology._parse_search_page(d)),
+    ('nomoslicense', 'nomoslicense.html',
+     lambda d: fossology._parse_license_histogram(d)),
+    ('license-list', 'license-list.html',
+     lambda d: fossology._parse_license_list(d, 'foo-1.0.0.tar.gz')),
+    ('upload_file', 'upload_file.html',
+     lambda d: fossology._parse_upload_reply(d)),
+)
+
+def full_parse(data):
+    return BeautifulSoup(data.decode('utf-8'), fossology._HTML_PARSER)
+
+def measure(func, data, duration):
+    count = 0
+    start = time.perf_counter()
+    elapsed = 0
+    while elapsed < duration:
+        func(data)
+        count += 1
+        elapsed = time.perf_counter() - start
+    return count / elapsed
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--duration', '-d',
+                        type=float,
+                        default=1.0,
+                        metavar='SECS',
+                        help='set measurement duration per parser')
+    args = parser.parse_args()
+
+    print("Parser: {0}".format(fossology._HTML_PARSER))
+    print("{0:<14} {1:>8} {2:>10} {3:>10} {4:>10} {5:>10}".format(
+        'endpoint', 'size', 'pages/s', 'MB/s', 'full p/s', 'speed-up'))
+    for name, fixture, func in ENDPOINTS:
+        with open(os.path.join(FIXTURES_DIR, fixture), 'rb') as f:
+            data = f.read()
+        rate = measure(func, data, args.duration)
+        full_rate = measure(full_parse, data, args.duration)
+        print("{0:<14} {1:>8} {2:>10.1f} {3:>10.2f} {4:>10.1f} {5:>9.1f}x".format(
+            name,
+            len(data),
+            rate,
+            rate * len(data) / 1e6,
+            full_rate,
+            rate / full_rate))
+
+# vim: ts=4 sts=4 sw=4 et ai
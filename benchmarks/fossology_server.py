@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# grissom - FOSS compliance tools
+#
+# Copyright (c) 2013 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Stand-in for a Fossology server, replying with the recorded pages from the
+fixtures directory.
+
+The search results are split into a configurable number of pages, and each
+reply can be delayed to simulate network latency. The number of requests
+received so far is available at '/stats'.
+"""
+
+import os
+import re
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlsplit, parse_qs
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures', 'fossology')
+
+_NAV_EXPR = re.compile(r'<a href=\'/\?mod=search[^\']*\'>\[(Prev|Next)\]</a>')
+_UPLOAD_EXPR = re.compile(r'upload=(\d+)')
+
+def _load_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), 'rb') as f:
+        return f.read()
+
+class FossologyStandIn(ThreadingMixIn, HTTPServer):
+    """Stand-in for a Fossology server.
+
+    :param address: address to listen to, as (host, port).
+    :type address: tuple
+
+    :param latency: delay before each reply, in seconds.
+    :type latency: float
+
+    :param pages: number of pages of search results.
+    :type pages: int
+    """
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, pages=1):
+        HTTPServer.__init__(self, address, _FossologyRequestHandler)
+        self.latency = latency
+        self.pages = max(1, pages)
+        self.fixtures = {}
+        for name in os.listdir(FIXTURES_DIR):
+            self.fixtures[name] = _load_fixture(name)
+        text = self.fixtures['search.html'].decode('utf-8')
+        self._search_template = _NAV_EXPR.sub('{nav}', text)
+        self._lock = threading.Lock()
+        self._n_uploads = 0
+        self.n_requests = 0
+
+    def search_page(self, pattern, page):
+        """Build a page of search results.
+
+        :param pattern: the search pattern.
+        :type pattern: str
+
+        :param page: number of the page.
+        :type page: int
+
+        :returns: the contents of the page.
+        :rtype: bytes
+        """
+        if page >= self.pages:
+            return self.fixtures['auth.html']
+        href = "<a href='/?mod=search&searchtype=directory&filename={0}" \
+               "&page={1}'>[{2}]</a>"
+        quoted = pattern.replace('%', '%25')
+        nav = []
+        if page > 0:
+            nav.append(href.format(quoted, page - 1, 'Prev'))
+        if page < self.pages - 1:
+            nav.append(href.format(quoted, page + 1, 'Next'))
+        text = self._search_template.replace('{nav}', ' '.join(nav), 2)
+        # Make the upload identifiers unique across pages.
+        offset = page * 100000
+        text = _UPLOAD_EXPR.sub(lambda m: 'upload={0}'.format(
+            int(m.group(1)) + offset), text)
+        return text.encode('utf-8')
+
+    def new_upload(self):
+        """Register a new upload.
+
+        :returns: the upload identifier.
+        :rtype: int
+        """
+        with self._lock:
+            self._n_uploads += 1
+            return self._n_uploads
+
+class _FossologyRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately: do not let them wait for
+    # the acknowledgement of each other.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        while length > 0:
+            chunk = self.rfile.read(min(length, 65536))
+            if not chunk:
+                break
+            length -= len(chunk)
+
+    def _reply(self, data, content_type='text/html; charset=UTF-8',
+               cookie=False):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        if cookie:
+            self.send_header('Set-Cookie', 'Session=0123456789abcdef; path=/')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self):
+        server = self.server
+        url = urlsplit(self.path)
+        self._read_body()
+        if url.path != '/stats':
+            with server._lock:
+                server.n_requests += 1
+            if server.latency:
+                time.sleep(server.latency)
+
+        query = parse_qs(url.query)
+        mod = query.get('mod', [''])[0]
+        fixtures = server.fixtures
+
+        if url.path == '/stats':
+            data = str(server.n_requests).encode('ascii')
+            self._reply(data, 'text/plain')
+        elif url.path.startswith('/spdx-output-module/'):
+            self._reply(fixtures['spdx_main_output_tag.txt'], 'text/plain')
+        elif mod == 'auth':
+            self._reply(fixtures['auth.html'], cookie=True)
+        elif mod == 'search':
+            pattern = query.get('filename', ['%'])[0]
+            page = int(query.get('page', ['0'])[0])
+            self._reply(server.search_page(pattern, page))
+        elif mod == 'nomoslicense':
+            self._reply(fixtures['nomoslicense.html'])
+        elif mod == 'license-list':
+            self._reply(fixtures['license-list.html'])
+        elif mod == 'agent_nomos_once':
+            self._reply(fixtures['agent_nomos_once.txt'], 'text/plain')
+        elif mod == 'spdx_license_once':
+            self._reply(fixtures['spdx_license_once.json'],
+                        'application/json')
+        elif mod == 'upload_file':
+            text = fixtures['upload_file.html'].decode('utf-8')
+            upid = server.new_upload()
+            text = text.replace('upload=42', 'upload={0}'.format(upid))
+            text = text.replace('#42', '#{0}'.format(upid))
+            self._reply(text.encode('utf-8'))
+        elif mod == 'showjobs':
+            self._reply(fixtures['showjobs.html'])
+        elif mod == 'spdx_main_page_confirm':
+            self._reply(fixtures['spdx_main_page_confirm.html'])
+        else:
+            self.send_error(404)
+
+    do_GET = _handle
+    do_POST = _handle
+
+def start_server(latency=0.0, pages=1, port=0):
+    """Start a stand-in server in a background thread.
+
+    :param latency: delay before each reply, in seconds.
+    :type latency: float
+
+    :param pages: number of pages of search results.
+    :type pages: int
+
+    :param port: port to listen to, or 0 to pick a free one.
+    :type port: int
+
+    :returns: the server.
+    :rtype: :class:`FossologyStandIn`
+    """
+    server = FossologyStandIn(('127.0.0.1', port), latency, pages)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', '-p',
+                        type=int,
+                        default=8080,
+                        help='set port to listen to')
+    parser.add_argument('--latency', '-l',
+                        type=float,
+                        default=0.0,
+                        metavar='SECS',
+                        help='set delay before each reply')
+    parser.add_argument('--pages', '-n',
+                        type=int,
+                        default=1,
+                        help='set number of pages of search results')
+    args = parser.parse_args()
+
+    server = FossologyStandIn(('127.0.0.1', args.port),
+                              args.latency,
+                              args.pages)
+    print("Serving on 127.0.0.1:{0}".format(server.server_port), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+# vim: ts=4 sts=4 sw=4 et ai
@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# grissom - FOSS compliance tools
+#
+# Copyright (c) 2013 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Generate synthetic root file systems, holding small ELF executables and
+shared libraries among files which are not ELF files.
+
+The ELF files are built byte by byte, for x86-64, with no compiler: they
+have a dynamic section listing the libraries they need, but their code is
+random. The libraries are spread over layers: the executables need
+libraries of the first layer, and each library needs libraries of the next
+layer, so the chains of DT_NEEDED entries are as deep as there are layers,
+and shared by the files of the previous layer.
+
+If 'strip' is available, a tree of 'source code' is generated as well: the
+files of the root file system are stripped copies of files of this tree,
+holding symbols, next to decoys with the same layout but other contents.
+
+The same parameters and seed always give the same tree.
+"""
+
+import os
+import sys
+import shutil
+import struct
+import random
+import argparse
+import subprocess
+from collections import namedtuple
+
+SyntheticRootfs = namedtuple('SyntheticRootfs',
+                             ['root', 'sources', 'executables', 'libraries',
+                              'noise'])
+
+# Address the executables are loaded at.
+_EXEC_BASE = 0x400000
+
+_ET_EXEC = 2
+_ET_DYN = 3
+_EM_X86_64 = 62
+
+_PT_LOAD = 1
+_PT_DYNAMIC = 2
+
+_SHT_PROGBITS = 1
+_SHT_SYMTAB = 2
+_SHT_STRTAB = 3
+_SHT_DYNAMIC = 6
+
+_SHF_WRITE = 0x1
+_SHF_ALLOC = 0x2
+_SHF_EXECINSTR = 0x4
+
+_DT_NULL = 0
+_DT_NEEDED = 1
+_DT_STRTAB = 5
+_DT_STRSZ = 10
+_DT_SONAME = 14
+
+_EHDR = struct.Struct('<16sHHIQQQIHHHHHH')
+_PHDR = struct.Struct('<IIQQQQQQ')
+_SHDR = struct.Struct('<IIQQQQIIQQ')
+_DYN = struct.Struct('<qQ')
+_SYM = struct.Struct('<IBBHQQ')
+
+def _align(offset, alignment):
+    return (offset + alignment - 1) & ~(alignment - 1)
+
+class _StringTable(object):
+    def __init__(self):
+        self.data = bytearray(b'\0')
+
+    def add(self, name):
+        offset = len(self.data)
+        self.data += name.encode('ascii') + b'\0'
+        return offset
+
+def build_elf(needed, code, soname=None, symbols=False):
+    """Build an ELF file for x86-64.
+
+    :param needed: names of the libraries needed by the file.
+    :type needed: list of str
+
+    :param code: contents of the '.text' section.
+    :type code: bytes
+
+    :param soname: name of the library, or None for an executable.
+    :type soname: str
+
+    :param symbols: if true, add a symbol table, which 'strip' discards.
+    :type symbols: bool
+
+    :returns: the contents of the file.
+    :rtype: bytes
+    """
+    base = _EXEC_BASE if soname is None else 0
+
+    dynstr = _StringTable()
+    dynamic = [(_DT_NEEDED, dynstr.add(n)) for n in needed]
+    if soname is not None:
+        dynamic.append((_DT_SONAME, dynstr.add(soname)))
+
+    text_offset = _align(_EHDR.size + 2 * _PHDR.size, 16)
+    dynstr_offset = text_offset + len(code)
+    dynamic_offset = _align(dynstr_offset + len(dynstr.data), 8)
+    dynamic += [(_DT_STRTAB, base + dynstr_offset),
+                (_DT_STRSZ, len(dynstr.data)),
+                (_DT_NULL, 0)]
+    dynamic_data = b''.join(_DYN.pack(*d) for d in dynamic)
+    end = dynamic_offset + len(dynamic_data)
+
+    shstrtab = _StringTable()
+    # (name, type, flags, offset, data, link, info, align, entsize)
+    sections = [
+        ('.text', _SHT_PROGBITS, _SHF_ALLOC | _SHF_EXECINSTR,
+         text_offset, code, 0, 0, 16, 0),
+        # In the order 'strip' writes them in.
+        ('.dynamic', _SHT_DYNAMIC, _SHF_WRITE | _SHF_ALLOC,
+         dynamic_offset, dynamic_data, 3, 0, 8, _DYN.size),
+        ('.dynstr', _SHT_STRTAB, _SHF_ALLOC,
+         dynstr_offset, bytes(dynstr.data), 0, 0, 1, 0),
+    ]
+    if symbols:
+        strtab = _StringTable()
+        symtab = _SYM.pack(0, 0, 0, 0, 0, 0)
+        # A global function at the start of the code.
+        symtab += _SYM.pack(strtab.add('main'), 0x12, 0, 1,
+                            base + text_offset, len(code))
+        symtab_offset = _align(end, 8)
+        strtab_offset = symtab_offset + len(symtab)
+        sections += [
+            ('.symtab', _SHT_SYMTAB, 0,
+             symtab_offset, symtab, 5, 1, 8, _SYM.size),
+            ('.strtab', _SHT_STRTAB, 0,
+             strtab_offset, bytes(strtab.data), 0, 0, 1, 0),
+        ]
+        end = strtab_offset + len(strtab.data)
+    names = [shstrtab.add(s[0]) for s in sections]
+    shstrtab_name = shstrtab.add('.shstrtab')
+    sections.append(('.shstrtab', _SHT_STRTAB, 0,
+                     end, bytes(shstrtab.data), 0, 0, 1, 0))
+    names.append(shstrtab_name)
+    shoff = _align(end + len(shstrtab.data), 8)
+
+    header = _EHDR.pack(b'\x7fELF\x02\x01\x01' + bytes(9),
+                        _ET_EXEC if soname is None else _ET_DYN,
+                        _EM_X86_64,
+                        1,
+                        base + text_offset,
+                        _EHDR.size,
+                        shoff,
+                        0,
+                        _EHDR.size,
+                        _PHDR.size,
+                        2,
+                        _SHDR.size,
+                        len(sections) + 1,
+                        len(sections))
+    load_size = dynamic_offset + len(dynamic_data)
+    phdrs = _PHDR.pack(_PT_LOAD, 7, 0, base, base, load_size, load_size,
+                       0x1000)
+    phdrs += _PHDR.pack(_PT_DYNAMIC, 6, dynamic_offset,
+                        base + dynamic_offset, base + dynamic_offset,
+                        len(dynamic_data), len(dynamic_data), 8)
+
+    data = bytearray(shoff)
+    data[0:len(header)] = header
+    data[len(header):len(header) + len(phdrs)] = phdrs
+    shdrs = bytes(_SHDR.size)
+    for name, (n, kind, flags, offset, contents, link, info, align,
+               entsize) in zip(names, sections):
+        data[offset:offset + len(contents)] = contents
+        addr = base + offset if flags & _SHF_ALLOC else 0
+        shdrs += _SHDR.pack(name, kind, flags, addr, offset, len(contents),
+                            link, info, align, entsize)
+    return bytes(data) + shdrs
+
+def _write(filename, data, mode):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, 'wb') as f:
+        f.write(data)
+    os.chmod(filename, mode)
+
+def _install(source, filename, mode, strip):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    subprocess.check_call([strip, source, '-o', filename])
+    os.chmod(filename, mode)
+
+_NOISE_KINDS = ('text', 'data', 'script', 'symlink')
+
+def _write_noise(rng, root, index, size):
+    kind = _NOISE_KINDS[index % len(_NOISE_KINDS)]
+    if kind == 'text':
+        filename = os.path.join(root, 'usr', 'share', 'doc',
+                                'doc{0}.txt'.format(index))
+        words = ('lorem', 'ipsum', 'dolor', 'sit', 'amet', 'GPL', 'MIT')
+        text = ' '.join(rng.choice(words) for i in range(size // 6))
+        _write(filename, text.encode('ascii') + b'\n', 0o644)
+    elif kind == 'data':
+        filename = os.path.join(root, 'usr', 'share', 'data',
+                                'data{0}.bin'.format(index))
+        _write(filename, bytes(rng.getrandbits(8) for i in range(size)),
+               0o644)
+    elif kind == 'script':
+        # Executable, so it is only told apart from ELF files by libmagic.
+        filename = os.path.join(root, 'usr', 'bin',
+                                'script{0}'.format(index))
+        _write(filename, b'#!/bin/sh\necho ' + b'x' * size + b'\n', 0o755)
+    else:
+        filename = os.path.join(root, 'usr', 'bin', 'link{0}'.format(index))
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        os.symlink('/bin/exec0', filename)
+    return filename
+
+def generate(directory, executables=64, libraries=32, layers=4, fanout=2,
+             noise=64, code_size=4096, decoys=1, seed=0, strip='strip'):
+    """Generate a synthetic root file system.
+
+    :param directory: path to the directory to generate the tree in, as
+                      'rootfs' and 'src' subdirectories.
+    :type directory: str
+
+    :param executables: number of executables, in /bin and /usr/bin.
+    :type executables: int
+
+    :param libraries: number of shared libraries, in /lib and /usr/lib.
+    :type libraries: int
+
+    :param layers: number of layers of libraries, which is the depth of
+                   the chains of dependencies.
+    :type layers: int
+
+    :param fanout: number of libraries needed by each file.
+    :type fanout: int
+
+    :param noise: number of files which are not ELF files.
+    :type noise: int
+
+    :param code_size: size of the code of the ELF files, in bytes.
+    :type code_size: int
+
+    :param decoys: number of decoys of each file in the source tree.
+    :type decoys: int
+
+    :param seed: seed of the random generator.
+    :type seed: int
+
+    :param strip: command discarding symbols, or None to generate no
+                  source tree.
+    :type strip: str
+
+    :returns: the paths to the generated files.
+    :rtype: :class:`SyntheticRootfs`
+    """
+    rng = random.Random(seed)
+    root = os.path.join(directory, 'rootfs')
+    sources = None
+    if strip and shutil.which(strip):
+        sources = os.path.join(directory, 'src')
+    else:
+        strip = None
+
+    layers = max(1, min(layers, libraries))
+    names = ['libbench{0}.so'.format(i) for i in range(libraries)]
+    by_layer = [names[i::layers] for i in range(layers)]
+
+    def write_elf(filename, needed, soname, mode, package):
+        code = bytes(rng.getrandbits(8) for i in range(code_size))
+        if sources is None:
+            _write(filename, build_elf(needed, code, soname), mode)
+            return
+        name = os.path.basename(filename)
+        source = os.path.join(sources, package, name)
+        _write(source, build_elf(needed, code, soname, True), 0o755)
+        _install(source, filename, mode, strip)
+        for i in range(decoys):
+            other = bytes(rng.getrandbits(8) for i in range(code_size))
+            _write(os.path.join(sources, '{0}-old{1}'.format(package, i),
+                                name),
+                   build_elf(needed, other, soname, True),
+                   0o755)
+
+    libs = []
+    for depth, layer in enumerate(by_layer):
+        following = by_layer[depth + 1] if depth + 1 < layers else []
+        for name in layer:
+            needed = rng.sample(following, min(fanout, len(following)))
+            subdir = 'lib' if len(libs) % 2 == 0 else os.path.join('usr',
+                                                                  'lib')
+            filename = os.path.join(root, subdir, name)
+            write_elf(filename, needed, name, 0o755,
+                      os.path.splitext(name)[0])
+            libs.append(filename)
+
+    execs = []
+    for i in range(executables):
+        needed = rng.sample(by_layer[0], min(fanout, len(by_layer[0])))
+        subdir = 'bin' if i % 2 == 0 else os.path.join('usr', 'bin')
+        name = 'exec{0}'.format(i)
+        filename = os.path.join(root, subdir, name)
+        write_elf(filename, needed, None, 0o755, 'pkg{0}'.format(i))
+        execs.append(filename)
+
+    others = [_write_noise(rng, root, i, code_size) for i in range(noise)]
+    return SyntheticRootfs(root, sources, execs, libs, others)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('directory',
+                        metavar='DIR',
+                        help='set directory to generate the tree in')
+    parser.add_argument('--executables', '-e',
+                        type=int,
+                        default=64,
+                        help='set number of executables')
+    parser.add_argument('--libraries', '-l',
+                        type=int,
+                        default=32,
+                        help='set number of shared libraries')
+    parser.add_argument('--layers', '-L',
+                        type=int,
+                        default=4,
+                        help='set depth of the chains of dependencies')
+    parser.add_argument('--fanout', '-f',
+                        type=int,
+                        default=2,
+                        help='set number of libraries needed by each file')
+    parser.add_argument('--noise', '-n',
+                        type=int,
+                        default=64,
+                        help='set number of files which are not ELF files')
+    parser.add_argument('--code-size', '-s',
+                        type=int,
+                        default=4096,
+                        metavar='BYTES',
+                        help='set size of the code of the ELF files')
+    parser.add_argument('--decoys', '-d',
+                        type=int,
+                        default=1,
+                        help='set number of decoys of each source file')
+    parser.add_argument('--seed',
+                        type=int,
+                        default=0,
+                        help='set seed of the random generator')
+    parser.add_argument('--strip', '-S',
+                        default='strip',
+                        metavar='CMD',
+                        help='set command discarding symbols')
+    args = parser.parse_args()
+
+    if os.path.exists(args.directory):
+        parser.error("'{0}' already exists".format(args.directory))
+    tree = generate(args.directory,
+                    args.executables,
+                    args.libraries,
+                    args.layers,
+                    args.fanout,
+                    args.noise,
+                    args.code_size,
+                    args.decoys,
+                    args.seed,
+                    args.strip)
+    print("Root file system: {0}".format(tree.root))
+    if tree.sources:
+        print("Source code: {0}".format(tree.sources))
+    else:
+        print("No source code: '{0}' not found".format(args.strip),
+              file=sys.stderr)
+
+# vim: ts=4 sts=4 sw=4 et ai
@@ -22,20 +22,19 @@
 Binary executable file handling
 """
 
-import magic
 import re
 from gettext import gettext as _
 from ..common import InvalidFormatError
+from .core import identify_file
 from .elf import ElfInspector
 
 _BINFMT_INSPECTORS = {r'^ELF': ElfInspector}
 
-def create_inspector(filename):
-    with magic.Magic() as m:
-        text = m.id_filename(filename)
-        for pattern, klass in _BINFMT_INSPECTORS.items():
-            if re.match(pattern, text):
-                return klass(filename)
+def create_inspector(filename, fs=None):
+    text = identify_file(filename, fs)
+    for pattern, klass in _BINFMT_INSPECTORS.items():
+        if re.match(pattern, text):
+            return klass(filename, fs)
     raise InvalidFormatError(_("File format not supported"))
 
 # vim: ts=4 sts=4 sw=4 et ai
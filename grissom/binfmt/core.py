@@ -26,6 +26,8 @@ import os
 import re
 import stat
 import magic
+import threading
+from .. import profiling
 from ..common import FileNotFoundError
 from gettext import gettext as _
 
@@ -34,9 +36,14 @@ class BinfmtInspector(object):
 
     :param filename: path to the executable/library file to inspect.
     :type filename: str
+
+    :param fs: file system holding the file and the libraries, or None to
+               use the files of the host.
+    :type fs: :class:`grissom.vfs.FileSystem`
     """
-    def __init__(self, filename):
+    def __init__(self, filename, fs=None):
         self._filename = filename
+        self._fs = fs
         self._lib_paths = []
         self._with_full_path = False
 
@@ -58,12 +65,22 @@ class BinfmtInspector(object):
         """
         return []
 
+    def _exists(self, filename):
+        if self._fs:
+            return self._fs.exists(filename)
+        return os.path.exists(filename)
+
+    def _open(self, filename):
+        if self._fs:
+            return self._fs.open(filename)
+        return open(filename, 'rb')
+
     def _get_abs_path(self, filename):
         if os.path.isabs(filename):
             return filename
         for path in self._lib_paths:
             fullname = os.path.join(path, filename)
-            if os.path.exists(fullname):
+            if self._exists(fullname):
                 return fullname
         else:
             msg = _("can not find {fn}").format(fn=filename)
@@ -85,10 +102,50 @@ class BinfmtFinder(object):
 
     :param include_kmods: if true, will also look for kernel modules
     :type include_libs: bool
+
+    :param fs: file system to scan, or None to scan the files of the host.
+    :type fs: :class:`grissom.vfs.FileSystem`
     """
-    def __init__(self, include_libs=False, include_kmods=False):
+    def __init__(self, include_libs=False, include_kmods=False, fs=None):
         self._include_libs = include_libs
         self._include_kmods = include_kmods
+        self._fs = fs
+
+    def _iter_files(self, directory):
+        if self._fs:
+            for entry in self._fs.walk(directory):
+                yield entry.path, entry.mode
+            return
+        for root, dirs, files in os.walk(directory):
+            for f in files:
+                filename = os.path.join(root, f)
+                yield filename, os.lstat(filename).st_mode
+
+    def is_candidate(self, filename, mode):
+        """Check if a file may be a binary executable file, from its name
+        and mode only.
+
+        :param filename: path to the file.
+        :type filename: str
+
+        :param mode: mode of the file, as returned by :func:`os.lstat`.
+        :type mode: int
+
+        :returns: True or False.
+        :rtype: bool
+        """
+        if not stat.S_ISREG(mode):
+            return False
+        r, ext = os.path.splitext(filename)
+        if ext in ('.o', '.a'):
+            return False
+        if ext == '.ko' and self._include_kmods:
+            return True
+        elif ext == '.so' and self._include_libs:
+            return True
+        elif ext == '' and mode & stat.S_IXUSR:
+            return True
+        return False
 
     def scan(self, directory):
         """Scan a directory.
@@ -100,43 +157,63 @@ class BinfmtFinder(object):
         :rtype: list of strings
         """
         results = []
-        for root, dirs, files in os.walk(directory):
-            for f in files:
-                filename = os.path.join(root, f)
-                mode = os.lstat(filename).st_mode
-                if stat.S_ISLNK(mode):
-                    continue
-                if not is_binfmt_file(filename):
-                    continue
-                r, ext = os.path.splitext(filename)
-                if ext in ('.o', '.a'):
-                    continue
-                if ext == '.ko' and self._include_kmods:
-                    results.append(filename)
-                elif ext == '.so' and self._include_libs:
-                    results.append(filename)
-                elif ext == '' and mode & stat.S_IXUSR:
-                    results.append(filename)
+        files = profiling.iter_timed('binfmt.walk',
+                                     self._iter_files(directory))
+        for filename, mode in files:
+            if not self.is_candidate(filename, mode):
+                continue
+            # Identifying the contents is the costly part: do it last.
+            if is_binfmt_file(filename, self._fs):
+                results.append(filename)
         return results
 
 _BINFMT_MAGIC_PATTERNS = (
     r'^ELF',
 )
 
-def is_binfmt_file(filename):
+# Number of bytes needed to identify a file held by a virtual file system.
+MAGIC_HEADER_SIZE = 4096
+
+_local = threading.local()
+
+def identify_file(filename, fs=None):
+    """Describe the contents of a file.
+
+    :param filename: path to the file.
+    :type filename: str
+
+    :param fs: file system holding the file, or None to use the files of
+               the host. Only the first bytes of the file are read from it.
+    :type fs: :class:`grissom.vfs.FileSystem`
+
+    :returns: the description given by libmagic.
+    :rtype: str
+    """
+    if not hasattr(_local, 'magic'):
+        # Loading the database of libmagic is costly: once per thread.
+        _local.magic = magic.Magic()
+    if fs:
+        return _local.magic.id_buffer(fs.read(filename, MAGIC_HEADER_SIZE))
+    return _local.magic.id_filename(filename)
+
+@profiling.timed('binfmt.identify')
+def is_binfmt_file(filename, fs=None):
     """Check if filename points to a binary executable file/shared library.
 
     :param filename: path to the file.
     :type filename: str
 
+    :param fs: file system holding the file, or None to use the files of
+               the host.
+    :type fs: :class:`grissom.vfs.FileSystem`
+
     :returns: True or False.
     :rtype: bool
     """
-    with magic.Magic() as m:
-        text = m.id_filename(filename)
-        for pattern in _BINFMT_MAGIC_PATTERNS:
-            if re.match(pattern, text):
-                return True
+    text = identify_file(filename, fs)
+    for pattern in _BINFMT_MAGIC_PATTERNS:
+        if re.match(pattern, text):
+            return True
     return False
 
 # vim: ts=4 sts=4 sw=4 et ai
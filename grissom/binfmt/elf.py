@@ -23,20 +23,78 @@ Executable and Linkable Format
 """
 
 import os
+from collections import namedtuple
 from elftools.common.py3compat import bytes2str
 from elftools.common.exceptions import ELFError
 from elftools.elf.elffile import ELFFile
 from elftools.elf.dynamic import DynamicSection
+from elftools.elf.constants import SH_FLAGS
 from .core import BinfmtInspector
+from .. import profiling
+
+ElfLayout = namedtuple('ElfLayout',
+                       ['elfclass', 'little_endian', 'machine', 'type',
+                        'sections', 'segments'])
+
+@profiling.timed('elf.layout')
+def read_elf_layout(filename, fs=None):
+    """Read the parts of an ELF file which are not altered by stripping.
+
+    Only the header fields, the allocated sections and the loadable
+    segments are taken into account, so the layout of a file is the same
+    before and after discarding its symbols with strip. Other commands may
+    alter the sections and segments, but not the header fields, which are
+    the first four fields of the layout.
+
+    :param filename: path to the file.
+    :type filename: str
+
+    :param fs: file system holding the file, or None to use the files of
+               the host.
+    :type fs: :class:`grissom.vfs.FileSystem`
+
+    :returns: the layout or None if the file is not a valid ELF file.
+    :rtype: :class:`grissom.binfmt.elf.ElfLayout`
+    """
+    with (fs.open(filename) if fs else open(filename, 'rb')) as f:
+        if f.read(4) != b'\x7fELF':
+            return None
+        f.seek(0)
+        try:
+            elf = ELFFile(f)
+            sections = []
+            for section in elf.iter_sections():
+                if section['sh_flags'] & SH_FLAGS.SHF_ALLOC:
+                    sections.append((section.name,
+                                     section['sh_type'],
+                                     section['sh_size']))
+            segments = []
+            for segment in elf.iter_segments():
+                if segment['p_type'] == 'PT_LOAD':
+                    segments.append((segment['p_vaddr'],
+                                     segment['p_filesz'],
+                                     segment['p_memsz']))
+            return ElfLayout(elf.elfclass,
+                             elf.little_endian,
+                             elf['e_machine'],
+                             elf['e_type'],
+                             tuple(sections),
+                             tuple(segments))
+        except ELFError:
+            return None
 
 class ElfInspector(BinfmtInspector):
     """Inspect ELF files.
 
     :param filename: path to the ELF file.
     :type filename: str
+
+    :param fs: file system holding the file and the libraries, or None to
+               use the files of the host.
+    :type fs: :class:`grissom.vfs.FileSystem`
     """
-    def __init__(self, filename):
-        BinfmtInspector.__init__(self, filename)
+    def __init__(self, filename, fs=None):
+        BinfmtInspector.__init__(self, filename, fs)
 
     def find_dependencies(self, recursive=False):
         """Find the dependencies of the ELF file.
@@ -51,7 +109,7 @@ class ElfInspector(BinfmtInspector):
     def _find_deps(self, filename, recursive):
         libs = []
         filename = self._get_abs_path(filename)
-        with open(filename, 'rb') as f:
+        with profiling.timer('elf.parse'), self._open(filename) as f:
             try:
                 elf = ELFFile(f)
                 for section in elf.iter_sections():
@@ -59,7 +117,10 @@ class ElfInspector(BinfmtInspector):
                         continue
                     for tag in section.iter_tags():
                         if tag.entry.d_tag == 'DT_NEEDED':
-                            lib = bytes2str(tag.needed)
+                            lib = tag.needed
+                            # Recent pyelftools already decode the names.
+                            if isinstance(lib, bytes):
+                                lib = bytes2str(lib)
                             libs.append(lib)
             except ELFError:
                 raise
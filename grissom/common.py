@@ -24,12 +24,16 @@ Common functions/classes
 
 import configparser
 import subprocess
+import hashlib
 import mimetypes
 import random
 import sys
 import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from gettext import bindtextdomain, textdomain
 from gettext import gettext as _
+from . import profiling
 
 
 class InvalidFormatError(Exception):
@@ -44,6 +48,28 @@ class NoMatchError(Exception):
 class ToolNotFoundError(Exception):
     """Error raised when an external tool can not be found"""
 
+class CommandFailedError(Exception):
+    """Error raised when an external tool fails
+
+    :param result: the result of the command.
+    :type result: :class:`grissom.common.CommandResult`
+    """
+    def __init__(self, result):
+        if result.timed_out:
+            msg = _("{0} timed out")
+        else:
+            msg = _("{0} failed with status {1}")
+        text = msg.format(result.args[0], result.returncode)
+        stderr = result.stderr.decode('utf-8', 'replace').strip()
+        if stderr:
+            text += ': ' + stderr.splitlines()[-1]
+        Exception.__init__(self, text)
+        self.result = result
+
+CommandResult = namedtuple('CommandResult',
+                           ['args', 'returncode', 'stdout', 'stderr',
+                            'timed_out'])
+
 def topological_sort(graph_unsorted):
     """Perform a topological sort on a mapping between an item and its
     depedencies.
@@ -85,6 +111,126 @@ def load_configuration():
     parser.readfp(open(filename))
     return parser
 
+def compute_file_digest(filename, algorithm='sha1', chunk_size=65536):
+    """Compute the digest of the contents of a file, reading it by chunks.
+
+    :param filename: path to the file.
+    :type filename: str
+
+    :param algorithm: name of the hash algorithm.
+    :type algorithm: str
+
+    :param chunk_size: size of the chunks to read.
+    :type chunk_size: int
+
+    :returns: the hexadecimal digest.
+    :rtype: str
+    """
+    h = hashlib.new(algorithm)
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def get_cache_dir():
+    """Get the path to the user cache directory, creating it if needed.
+
+    :returns: the path to the directory.
+    :rtype: str
+    """
+    root = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    path = os.path.join(root, 'grissom')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+class MultipartEncoder(object):
+    """Encode variables and files for uploading, without loading the files in
+    memory.
+
+    Iterating over the encoder yields the body to be sent, chunk by chunk.
+    The files are read from their current position each time.
+
+    :param variables: regular form variables.
+    :type variables: sequence of (name, value) elements.
+
+    :param files: files to be encoded.
+    :type files: sequence of (name, filename, contents) elements, where
+                 contents is either a bytes object or a binary file object.
+
+    :param chunk_size: size of the chunks read from the files.
+    :type chunk_size: int
+    """
+    def __init__(self, variables, files, chunk_size=65536):
+        token = random.randrange(sys.maxsize)
+        self._boundary = '--' * 15 + "{0:x}".format(token)
+        self._chunk_size = chunk_size
+        self._parts = []
+        self._length = 0
+
+        lines = []
+        for k, v in variables:
+            lines.append(bytes("--{0}".format(self._boundary), 'utf-8'))
+            l = "Content-Disposition: form-data; name=\"{0}\"".format(k)
+            lines.append(bytes(l, 'utf-8'))
+            lines.append(b'')
+            lines.append(bytes(v, 'utf-8'))
+
+        for k, n, v in files:
+            filetype = mimetypes.guess_type(n)[0]
+            filetype = filetype or 'application/octet-stream'
+            lines.append(bytes("--{0}".format(self._boundary), 'utf-8'))
+            l = "Content-Disposition: form-data; name=\"{0}\"; filename=\"{1}\""
+            lines.append(bytes(l.format(k, n), 'utf-8'))
+            lines.append(bytes("Content-Type: {0}".format(filetype), 'utf-8'))
+            lines.append(b'')
+            if isinstance(v, bytes):
+                lines.append(v)
+            else:
+                lines.append(b'')
+                self._add_part(b'\r\n'.join(lines))
+                self._add_file(v)
+                lines = [b'']
+
+        lines.append(bytes("--{0}--".format(self._boundary), 'utf-8'))
+        lines.append(b'')
+        self._add_part(b'\r\n'.join(lines))
+
+    def _add_part(self, data):
+        self._parts.append(data)
+        self._length += len(data)
+
+    def _add_file(self, fileobj):
+        offset = fileobj.tell()
+        try:
+            size = os.fstat(fileobj.fileno()).st_size - offset
+        except (AttributeError, OSError):
+            size = fileobj.seek(0, os.SEEK_END) - offset
+            fileobj.seek(offset)
+        self._parts.append((fileobj, offset, size))
+        self._length += size
+
+    @property
+    def content_type(self):
+        """Content type of the body."""
+        return "multipart/form-data; boundary={0}".format(self._boundary)
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        for part in self._parts:
+            if isinstance(part, bytes):
+                yield part
+                continue
+            fileobj, offset, size = part
+            fileobj.seek(offset)
+            while size > 0:
+                chunk = fileobj.read(min(size, self._chunk_size))
+                if not chunk:
+                    raise IOError(_("File truncated while encoding"))
+                size -= len(chunk)
+                yield chunk
+
 def encode_multipart_formdata(variables, files):
     """Encode variables and files for uploading.
 
@@ -97,31 +243,8 @@ def encode_multipart_formdata(variables, files):
     :returns: the content-type and body to be sent.
     :rtype: tuple of strings.
     """
-    token = random.randrange(sys.maxsize)
-    boundary = '--' * 15 + "{0:x}".format(token)
-    lines = []
-
-    for k, v in variables:
-        lines.append(bytes("--{0}".format(boundary), 'utf-8'))
-        l = "Content-Disposition: form-data; name=\"{0}\"".format(k)
-        lines.append(bytes(l, 'utf-8'))
-        lines.append(b'')
-        lines.append(bytes(v, 'utf-8'))
-
-    for k, n, v in files:
-        filetype = mimetypes.guess_type(n)[0] or 'application/octet-stream'
-        lines.append(bytes("--{0}".format(boundary), 'utf-8'))
-        l = "Content-Disposition: form-data; name=\"{0}\"; filename=\"{1}\""
-        lines.append(bytes(l.format(k, n), 'utf-8'))
-        lines.append(bytes("Content-Type: {0}".format(filetype), 'utf-8'))
-        lines.append(b'')
-        lines.append(v)
-
-    lines.append(bytes("--{0}--".format(boundary), 'utf-8'))
-    lines.append(b'')
-    body = b'\r\n'.join(lines)
-    contenttype = "multipart/form-data; boundary={0}".format(boundary)
-    return contenttype, body
+    encoder = MultipartEncoder(variables, files)
+    return encoder.content_type, b''.join(encoder)
 
 __archive_mimetypes = (
     'application/x-tar',
@@ -162,19 +285,159 @@ def sanitize_args(args):
     else:
         return args
 
-def execute_command(args):
-    """Execute an external progam.
-
-    :param args: list of arguments.
-    :type args: list of str.
-    """
+@profiling.timed('command.run')
+def _run_command(args, timeout=None, cwd=None):
     try:
         proc = subprocess.Popen(args,
+                                stdin=subprocess.DEVNULL,
                                 stdout=subprocess.PIPE,
-                                stderr=subprocess.PIPE)
-        proc.wait()
+                                stderr=subprocess.PIPE,
+                                cwd=cwd)
     except OSError:
         raise ToolNotFoundError(_("Can not find {0}").format(args[0]))
+    # Both pipes are drained while waiting, so that a tool writing a lot
+    # can not block.
+    timed_out = False
+    try:
+        stdout, stderr = proc.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        stdout, stderr = proc.communicate()
+        timed_out = True
+    return CommandResult(list(args), proc.returncode, stdout, stderr,
+                         timed_out)
+
+def _check_result(result):
+    if result.returncode != 0 or result.timed_out:
+        raise CommandFailedError(result)
+    return result
+
+class CommandExecutor(object):
+    """Execute external programs concurrently.
+
+    The output of the programs is captured while they run, and returned
+    along with their exit status.
+
+    :param max_workers: maximum number of programs running at the same time.
+    :type max_workers: int
+
+    :param timeout: time after which a program is killed, in seconds, or
+                    None to wait for it forever.
+    :type timeout: float
+    """
+    def __init__(self, max_workers=4, timeout=None):
+        self._max_workers = max(1, max_workers)
+        self._timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=self._max_workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.shutdown()
+
+    @property
+    def max_workers(self):
+        """Maximum number of programs running at the same time."""
+        return self._max_workers
+
+    def submit(self, args, timeout=None, cwd=None):
+        """Schedule the execution of a program.
+
+        :param args: list of arguments.
+        :type args: list of str
+
+        :param timeout: time after which the program is killed, in seconds,
+                        or None to use the timeout of the executor.
+        :type timeout: float
+
+        :param cwd: working directory of the program or None.
+        :type cwd: str
+
+        :returns: a future, whose result is the
+                  :class:`grissom.common.CommandResult` of the program. It
+                  raises :class:`grissom.common.ToolNotFoundError` if the
+                  program can not be found.
+        :rtype: :class:`concurrent.futures.Future`
+        """
+        if timeout is None:
+            timeout = self._timeout
+        return self._executor.submit(_run_command, args, timeout, cwd)
+
+    def run(self, args, timeout=None, cwd=None, check=False):
+        """Execute a program and wait for its completion.
+
+        :param args: list of arguments.
+        :type args: list of str
+
+        :param timeout: time after which the program is killed, in seconds,
+                        or None to use the timeout of the executor.
+        :type timeout: float
+
+        :param cwd: working directory of the program or None.
+        :type cwd: str
+
+        :param check: if true, raise
+                      :class:`grissom.common.CommandFailedError` if the
+                      program fails or times out.
+        :type check: bool
+
+        :returns: the result of the program.
+        :rtype: :class:`grissom.common.CommandResult`
+        """
+        result = self.submit(args, timeout, cwd).result()
+        return _check_result(result) if check else result
+
+    def map(self, commands, timeout=None):
+        """Execute programs concurrently.
+
+        :param commands: the list of arguments of each program.
+        :type commands: iterable of lists of str
+
+        :param timeout: time after which a program is killed, in seconds,
+                        or None to use the timeout of the executor.
+        :type timeout: float
+
+        :returns: the results, in the order of the programs.
+        :rtype: iterator of :class:`grissom.common.CommandResult`
+        """
+        futures = [self.submit(args, timeout) for args in commands]
+        try:
+            for future in futures:
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def shutdown(self, wait=True):
+        """Release the workers, once the scheduled programs are done.
+
+        :param wait: if true, wait for the programs to complete.
+        :type wait: bool
+        """
+        self._executor.shutdown(wait)
+
+def execute_command(args, timeout=None, check=False):
+    """Execute an external progam.
+
+    The output of the program is captured while it runs.
+
+    :param args: list of arguments.
+    :type args: list of str.
+
+    :param timeout: time after which the program is killed, in seconds, or
+                    None to wait for it forever.
+    :type timeout: float
+
+    :param check: if true, raise :class:`grissom.common.CommandFailedError`
+                  if the program fails or times out.
+    :type check: bool
+
+    :returns: the result of the program.
+    :rtype: :class:`grissom.common.CommandResult`
+    """
+    result = _run_command(args, timeout)
+    return _check_result(result) if check else result
 
 def setup_i18n():
     """Set up internationalization."""
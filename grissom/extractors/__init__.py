@@ -26,16 +26,39 @@ import magic
 import re
 from gettext import gettext as _
 from ..common import InvalidFormatError
+from .. import profiling
+from .archive import TarExtractor, ZipExtractor, CompressedFileExtractor
 from .cramfs import CramfsExtractor
+from .squashfs import SquashfsExtractor
 
-_EXTRACTORS = {r'^Linux Compressed ROM File System data': CramfsExtractor}
+_EXTRACTORS = {
+    r'^Linux Compressed ROM File System data': CramfsExtractor,
+    r'^Squashfs filesystem': SquashfsExtractor,
+    r'^POSIX tar archive': TarExtractor,
+    r'^Zip archive data': ZipExtractor,
+    r'^(gzip|bzip2|XZ) compressed data': CompressedFileExtractor,
+}
 
+def find_extractor_class(text):
+    """Find the extractor class for a file.
+
+    :param text: description of the file, as given by libmagic.
+    :type text: str
+
+    :returns: the class or None if the file format is not supported.
+    :rtype: type
+    """
+    for pattern, klass in _EXTRACTORS.items():
+        if re.match(pattern, text):
+            return klass
+    return None
+
+@profiling.timed('extractors.identify')
 def create_extractor(filename):
     with magic.Magic() as m:
-        text = m.id_filename(filename)
-        for pattern, klass in _EXTRACTORS.items():
-            if re.match(pattern, text):
-                return klass(filename)
-    raise InvalidFormatError(_("File format not supported"))
+        klass = find_extractor_class(m.id_filename(filename))
+    if klass is None:
+        raise InvalidFormatError(_("File format not supported"))
+    return klass(filename)
 
 # vim: ts=4 sts=4 sw=4 et ai
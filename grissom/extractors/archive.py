@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+#
+# grissom - FOSS compliance tools
+#
+# Copyright (c) 2013 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Archive and compressed file extraction
+"""
+
+import os
+import bz2
+import gzip
+import lzma
+import stat
+import shutil
+import tarfile
+import zipfile
+import threading
+from gettext import gettext as _
+from .core import Extractor, ExtractorEntry, write_entries, create_file
+from ..common import InvalidFormatError
+from .. import profiling
+
+_COMPRESSED_SUFFIXES = ('.gz', '.tgz', '.bz2', '.tbz', '.tbz2', '.xz', '.txz')
+
+_DECOMPRESSORS = (
+    (b'\x1f\x8b', gzip.open),
+    (b'BZh', bz2.open),
+    (b'\xfd7zXZ\x00', lzma.open),
+)
+
+class _ArchiveEntry(ExtractorEntry):
+    def __init__(self, path, mode, size, uid, gid, member):
+        ExtractorEntry.__init__(self, path, mode, size, uid, gid)
+        self.member = member
+
+def _normalize_name(name):
+    # Like tar, make the members relative to the destination.
+    name = os.path.normpath(name.lstrip('/'))
+    return None if name == os.curdir else name
+
+def _strip_suffixes(filename):
+    root, ext = os.path.splitext(os.path.basename(filename))
+    if ext in _COMPRESSED_SUFFIXES:
+        root, ext = os.path.splitext(root)
+    return root
+
+class _ArchiveExtractor(Extractor):
+    """Base class for extracting archives read with the standard library.
+
+    The archive is read sequentially, so the members of compressed archives
+    are decompressed only once. When the first bytes of a member are read,
+    to select it, its stream is kept open to write it, as seeking backwards
+    in a compressed archive means decompressing it again from the start.
+    """
+    def __init__(self, filename):
+        Extractor.__init__(self, filename)
+        self._archive = None
+        self._lock = threading.Lock()
+        self._peeked = None
+
+    def _open_archive(self):
+        raise NotImplementedError
+
+    def _get_archive(self):
+        if self._archive is None:
+            self._archive = self._open_archive()
+        return self._archive
+
+    def _open_member(self, entry):
+        raise NotImplementedError
+
+    def _close_peeked(self):
+        if self._peeked is not None:
+            self._peeked[2].close()
+            self._peeked = None
+
+    @profiling.timed('archive.read')
+    def read(self, entry, size=None):
+        with self._lock:
+            peeked = self._peeked
+            if peeked and peeked[0] is entry and size is not None and \
+               size <= len(peeked[1]):
+                return peeked[1][:size]
+            self._close_peeked()
+            f = self._open_member(entry)
+            if size is None:
+                with f:
+                    return f.read()
+            data = f.read(size)
+            self._peeked = (entry, data, f)
+            return data
+
+    def _write_file(self, entry, path):
+        with self._lock:
+            peeked = self._peeked
+            self._peeked = None
+            with create_file(path) as dst:
+                if peeked and peeked[0] is entry:
+                    src = peeked[2]
+                    dst.write(peeked[1])
+                else:
+                    if peeked:
+                        peeked[2].close()
+                    src = self._open_member(entry)
+                with src:
+                    shutil.copyfileobj(src, dst)
+
+    @profiling.timed('archive.extract')
+    def extract(self, destination, predicate=None):
+        destination = os.path.join(destination,
+                                   _strip_suffixes(self._filename))
+        try:
+            write_entries(self,
+                          self.iter_entries(),
+                          destination,
+                          self._write_file,
+                          predicate)
+        finally:
+            with self._lock:
+                self._close_peeked()
+        return destination
+
+class TarExtractor(_ArchiveExtractor):
+    """Extract data from a tar archive, compressed or not.
+
+    :param filename: path to the archive.
+    :type filename: str
+    """
+    def __init__(self, filename):
+        _ArchiveExtractor.__init__(self, filename)
+        self._desc = 'tar'
+
+    def _open_archive(self):
+        try:
+            return tarfile.open(self._filename, 'r:*')
+        except tarfile.TarError as error:
+            raise InvalidFormatError(str(error))
+
+    def _make_entry(self, member, files):
+        path = _normalize_name(member.name)
+        if path is None:
+            return None
+        if member.isdir():
+            kind = stat.S_IFDIR
+        elif member.isfile() or member.islnk():
+            # Hard links are written as copies of their target.
+            kind = stat.S_IFREG
+        elif member.issym():
+            kind = stat.S_IFLNK
+        elif member.ischr():
+            kind = stat.S_IFCHR
+        elif member.isblk():
+            kind = stat.S_IFBLK
+        elif member.isfifo():
+            kind = stat.S_IFIFO
+        else:
+            return None
+        contents = member
+        if member.islnk():
+            # The target of a hard link comes before it in the archive, so
+            # it is looked up among the files already seen: asking tarfile
+            # would read the whole archive.
+            contents = files.get(_normalize_name(member.linkname))
+            if contents is None:
+                # The target is not in the archive: nothing to copy.
+                return None
+        if kind == stat.S_IFREG:
+            files[path] = contents
+        entry = _ArchiveEntry(path,
+                              kind | stat.S_IMODE(member.mode),
+                              contents.size,
+                              member.uid,
+                              member.gid,
+                              contents)
+        if member.issym():
+            entry.linkname = member.linkname
+        elif member.isdev():
+            entry.rdev = os.makedev(member.devmajor, member.devminor)
+        return entry
+
+    def iter_entries(self):
+        archive = self._get_archive()
+        files = {}
+        for member in archive:
+            entry = self._make_entry(member, files)
+            if entry is not None:
+                yield entry
+
+    def _open_member(self, entry):
+        return self._get_archive().extractfile(entry.member)
+
+class CompressedFileExtractor(TarExtractor):
+    """Extract data from a file compressed with gzip, bzip2 or xz.
+
+    A compressed tar archive is extracted as such. Otherwise, the file is
+    decompressed as a single entry.
+
+    :param filename: path to the compressed file.
+    :type filename: str
+    """
+    def __init__(self, filename):
+        TarExtractor.__init__(self, filename)
+        self._desc = 'compressed file'
+        self._single = False
+
+    def _find_decompressor(self):
+        with open(self._filename, 'rb') as f:
+            header = f.read(8)
+        for signature, opener in _DECOMPRESSORS:
+            if header.startswith(signature):
+                return opener
+        raise InvalidFormatError(_("Unsupported compression"))
+
+    def _open_archive(self):
+        opener = self._find_decompressor()
+        try:
+            archive = TarExtractor._open_archive(self)
+            self._desc = 'tar'
+            return archive
+        except InvalidFormatError:
+            self._single = True
+            return opener
+
+    def iter_entries(self):
+        archive = self._get_archive()
+        if not self._single:
+            yield from TarExtractor.iter_entries(self)
+            return
+        # The size is only known once decompressed.
+        size = 0
+        with archive(self._filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(65536), b''):
+                size += len(chunk)
+        yield _ArchiveEntry(_strip_suffixes(self._filename),
+                            stat.S_IFREG | 0o644,
+                            size,
+                            0,
+                            0,
+                            None)
+
+    def _open_member(self, entry):
+        if self._single:
+            return self._get_archive()(self._filename, 'rb')
+        return TarExtractor._open_member(self, entry)
+
+    @profiling.timed('archive.extract')
+    def extract(self, destination, predicate=None):
+        self._get_archive()
+        if not self._single:
+            return TarExtractor.extract(self, destination, predicate)
+        path = os.path.join(destination, _strip_suffixes(self._filename))
+        if predicate is None:
+            # Decompress the file once, without computing its size first.
+            entry = None
+        else:
+            entry, = self.iter_entries()
+            if not predicate(self, entry):
+                return path
+        os.makedirs(destination, exist_ok=True)
+        if os.path.lexists(path):
+            os.unlink(path)
+        try:
+            self._write_file(entry, path)
+        finally:
+            with self._lock:
+                self._close_peeked()
+        return path
+
+class ZipExtractor(_ArchiveExtractor):
+    """Extract data from a ZIP archive.
+
+    :param filename: path to the archive.
+    :type filename: str
+    """
+    def __init__(self, filename):
+        _ArchiveExtractor.__init__(self, filename)
+        self._desc = 'ZIP'
+
+    def _open_archive(self):
+        try:
+            return zipfile.ZipFile(self._filename)
+        except (zipfile.BadZipFile, OSError) as error:
+            raise InvalidFormatError(str(error))
+
+    def _make_entry(self, info):
+        path = _normalize_name(info.filename)
+        if path is None:
+            return None
+        mode = info.external_attr >> 16
+        if info.create_system != 3 or not stat.S_IFMT(mode):
+            # Not created on Unix: only the type of the entry is known.
+            if info.is_dir():
+                mode = stat.S_IFDIR | 0o755
+            else:
+                mode = stat.S_IFREG | 0o644
+        entry = _ArchiveEntry(path, mode, info.file_size, 0, 0, info)
+        if entry.issym():
+            entry.linkname = os.fsdecode(self.read(entry))
+        elif entry.isdev():
+            return None
+        return entry
+
+    def iter_entries(self):
+        for info in self._get_archive().infolist():
+            entry = self._make_entry(info)
+            if entry is not None:
+                yield entry
+
+    def _open_member(self, entry):
+        return self._get_archive().open(entry.member)
+
+# vim: ts=4 sts=4 sw=4 et ai
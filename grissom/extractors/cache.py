@@ -0,0 +1,385 @@
+# -*- coding: utf-8 -*-
+#
+# grissom - FOSS compliance tools
+#
+# Copyright (c) 2013 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Cache of extracted data
+"""
+
+import os
+import time
+import errno
+import fcntl
+import shutil
+import sqlite3
+import threading
+from .core import Extractor, ExtractorEntry, write_entries, is_inside, \
+    create_file
+from ..common import compute_file_digest
+from .. import profiling
+
+LINK_MODES = ('hardlink', 'reflink', 'copy')
+
+# Request of ioctl() for cloning a file, from <linux/fs.h>.
+_FICLONE = 0x40049409
+
+def _clone_file(src, dst):
+    with open(src, 'rb') as fsrc, create_file(dst) as fdst:
+        fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+
+def _remove_tree(path):
+    def make_writable(function, name, excinfo):
+        # Extracted directories can be read-only.
+        os.chmod(os.path.dirname(name), 0o700)
+        if os.path.isdir(name) and not os.path.islink(name):
+            os.chmod(name, 0o700)
+        function(name)
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, onerror=make_writable)
+    elif os.path.lexists(path):
+        os.unlink(path)
+
+def _get_tree_size(path):
+    if not os.path.isdir(path):
+        return os.lstat(path).st_size
+    size = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in filenames:
+            size += os.lstat(os.path.join(dirpath, name)).st_size
+    return size
+
+class _FileLock(object):
+    """Lock a file with flock() for the duration of a block.
+
+    The file is opened on each use: threads sharing an open file would
+    share its lock too."""
+    def __init__(self, filename, operation):
+        self._filename = filename
+        self._operation = operation
+        self._fd = None
+
+    def __enter__(self):
+        self._fd = os.open(self._filename, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(self._fd, self._operation)
+        except BaseException:
+            os.close(self._fd)
+            raise
+        return self
+
+    def __exit__(self, type, value, traceback):
+        # Closing the file releases the lock.
+        os.close(self._fd)
+
+class _CachedTree(Extractor):
+    """Read the data stored in the cache as if it was an image, so that it
+    is written like data extracted from the image."""
+    def __init__(self, root):
+        Extractor.__init__(self, root)
+        self._desc = 'cache'
+
+    def make_entry(self, fullname):
+        st = os.lstat(fullname)
+        entry = ExtractorEntry(os.path.relpath(fullname, self._filename),
+                               st.st_mode,
+                               st.st_size,
+                               st.st_uid,
+                               st.st_gid)
+        if entry.issym():
+            entry.linkname = os.readlink(fullname)
+        elif entry.isdev():
+            entry.rdev = st.st_rdev
+        return entry
+
+    def iter_entries(self):
+        for dirpath, dirnames, filenames in os.walk(self._filename):
+            dirnames.sort()
+            for name in dirnames + sorted(filenames):
+                yield self.make_entry(os.path.join(dirpath, name))
+
+    def read(self, entry, size=None):
+        with open(os.path.join(self._filename, entry.path), 'rb') as f:
+            return f.read(-1 if size is None else size)
+
+class ExtractionCache(object):
+    """Cache the data extracted from images, by digest of their contents and
+    version of their extractor.
+
+    The data is extracted once in the cache, then written to the output
+    directories as links to the cached files. With hard links, the files of
+    the output directories share their contents with the cache, so they must
+    not be modified in place. With reflinks, they are copies sharing the
+    blocks of the cache until modified, if the file system supports it.
+    Otherwise, they are copied.
+
+    The digests of the images are recorded along with their size and time
+    of modification, so that unchanged images are not read again. When the
+    size of the cached data exceeds the limit, the least recently used data
+    is evicted.
+
+    The cache can be shared by several processes: data is not evicted while
+    another process writes it to an output directory.
+
+    :param directory: path to the directory of the cache.
+    :type directory: str
+
+    :param max_size: maximum size of the cached data, in bytes.
+    :type max_size: int
+
+    :param link: how files are written to the output directories, one of
+                 'hardlink', 'reflink' or 'copy'.
+    :type link: str
+    """
+    def __init__(self, directory, max_size=4 * 1024 ** 3, link='hardlink'):
+        if link not in LINK_MODES:
+            raise ValueError("Unsupported link mode '{0}'".format(link))
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self._max_size = max_size
+        self._link = link
+        self._lock = threading.Lock()
+        self._lock_filename = os.path.join(directory, 'lock')
+        filename = os.path.join(directory, 'index.db')
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS extractions ('
+                         'key TEXT PRIMARY KEY, '
+                         'name TEXT NOT NULL, '
+                         'size INTEGER NOT NULL, '
+                         'atime REAL NOT NULL)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS digests ('
+                         'filename TEXT PRIMARY KEY, '
+                         'size INTEGER NOT NULL, '
+                         'mtime INTEGER NOT NULL, '
+                         'digest TEXT NOT NULL)')
+        self._db.commit()
+        self._size = self._get_size()
+
+    def _get_size(self):
+        row = self._db.execute('SELECT TOTAL(size) '
+                               'FROM extractions').fetchone()
+        return int(row[0])
+
+    def _locked(self, exclusive=False):
+        # Entries are looked up and written out under a shared lock, and
+        # added or removed under an exclusive one.
+        return _FileLock(self._lock_filename,
+                         fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+
+    def get_digest(self, filename):
+        """Get the digest of the contents of a file, computing it only if
+        the file changed since the last call.
+
+        :param filename: path to the file.
+        :type filename: str
+
+        :returns: the digest.
+        :rtype: str
+        """
+        filename = os.path.abspath(filename)
+        st = os.stat(filename)
+        with self._lock:
+            row = self._db.execute('SELECT digest FROM digests '
+                                   'WHERE filename = ? AND size = ? '
+                                   'AND mtime = ?',
+                                   (filename,
+                                    st.st_size,
+                                    st.st_mtime_ns)).fetchone()
+        if row is not None:
+            return row[0]
+        digest = compute_file_digest(filename)
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO digests '
+                             'VALUES (?, ?, ?, ?)',
+                             (filename, st.st_size, st.st_mtime_ns, digest))
+            self._db.commit()
+        return digest
+
+    def _make_key(self, extractor, digest):
+        return '{0}-{1}-{2}'.format(digest,
+                                    type(extractor).__name__.lower(),
+                                    extractor.version)
+
+    def _lookup(self, key):
+        with self._lock:
+            row = self._db.execute('SELECT name FROM extractions '
+                                   'WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            if not os.path.lexists(os.path.join(self._directory, key)):
+                # Removed behind our back.
+                self._remove(key)
+                self._db.commit()
+                return None
+            self._db.execute('UPDATE extractions SET atime = ? '
+                             'WHERE key = ?', (time.time(), key))
+            self._db.commit()
+        return row[0]
+
+    def _store(self, key, extractor, destination):
+        path = os.path.join(self._directory, key)
+        tmpname = '{0}.tmp-{1}-{2}'.format(path,
+                                           os.getpid(),
+                                           threading.get_ident())
+        try:
+            name = os.path.relpath(extractor.extract(tmpname), tmpname)
+            size = _get_tree_size(tmpname)
+            # The data is written out before another process can evict it.
+            with self._locked(exclusive=True):
+                with self._lock:
+                    _remove_tree(path)
+                    os.rename(tmpname, path)
+                    # Other processes may have changed the cache.
+                    self._size = self._get_size()
+                    self._remove(key)
+                    self._db.execute('INSERT INTO extractions '
+                                     'VALUES (?, ?, ?, ?)',
+                                     (key, name, size, time.time()))
+                    self._size += size
+                    self._evict(key)
+                    self._db.commit()
+                return self._materialize(key, name, destination, None)
+        finally:
+            if os.path.lexists(tmpname):
+                _remove_tree(tmpname)
+
+    def _remove(self, key):
+        row = self._db.execute('SELECT size FROM extractions '
+                               'WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return
+        self._db.execute('DELETE FROM extractions WHERE key = ?', (key,))
+        self._size -= row[0]
+
+    def _evict(self, keep):
+        if self._size <= self._max_size:
+            return
+        rows = self._db.execute('SELECT key FROM extractions '
+                                'ORDER BY atime').fetchall()
+        for key, in rows:
+            if self._size <= self._max_size:
+                break
+            if key == keep:
+                continue
+            self._remove(key)
+            _remove_tree(os.path.join(self._directory, key))
+
+    def _link_file(self, src, dst):
+        if self._link == 'hardlink':
+            try:
+                os.link(src, dst)
+                return
+            except OSError as error:
+                # Across file systems or too many links: copy.
+                if error.errno not in (errno.EXDEV, errno.EMLINK,
+                                       errno.EPERM):
+                    raise
+        elif self._link == 'reflink':
+            try:
+                _clone_file(src, dst)
+                return
+            except OSError:
+                # Not supported by the file system: copy.
+                pass
+        with open(src, 'rb') as fsrc, create_file(dst) as fdst:
+            shutil.copyfileobj(fsrc, fdst)
+
+    def _materialize(self, key, name, root, predicate):
+        source = os.path.normpath(os.path.join(self._directory, key, name))
+        destination = os.path.normpath(os.path.join(root, name))
+        if not os.path.isdir(source):
+            # The data is a single file.
+            if predicate is not None:
+                tree = _CachedTree(os.path.dirname(source))
+                if not predicate(tree, tree.make_entry(source)):
+                    return destination
+            # Same check as write_entries() for the entries of a tree.
+            if not is_inside(os.path.dirname(destination), root):
+                return destination
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            if os.path.lexists(destination):
+                os.unlink(destination)
+            self._link_file(source, destination)
+            return destination
+
+        tree = _CachedTree(source)
+
+        def write_file(entry, path):
+            self._link_file(os.path.join(source, entry.path), path)
+
+        write_entries(tree, tree.iter_entries(), destination, write_file,
+                      predicate)
+        return destination
+
+    def extract(self, extractor, destination, predicate=None, digest=None):
+        """Extract data from an image, through the cache.
+
+        Data extracted with a predicate is only taken from the cache, if it
+        is already there, as extracting all the data to cache it would
+        defeat the purpose of the predicate.
+
+        :param extractor: extractor of the image.
+        :type extractor: :class:`grissom.extractors.core.Extractor`
+
+        :param destination: path to destination directory.
+        :type destination: str
+
+        :param predicate: callable selecting the entries to write, or None
+                          to write all of them.
+        :type predicate: callable
+
+        :param digest: digest of the contents of the image, or None to
+                       compute it.
+        :type digest: str
+
+        :returns: path to the extracted data, as returned by
+                  :meth:`grissom.extractors.core.Extractor.extract`.
+        :rtype: str
+        """
+        if digest is None:
+            digest = self.get_digest(extractor.filename)
+        key = self._make_key(extractor, digest)
+        with self._locked():
+            name = self._lookup(key)
+            if name is not None:
+                profiling.count('cache.hits')
+                return self._materialize(key, name, destination, predicate)
+        profiling.count('cache.misses')
+        if predicate is not None:
+            return extractor.extract(destination, predicate)
+        return self._store(key, extractor, destination)
+
+    def clear(self):
+        """Remove all the cached data."""
+        with self._locked(exclusive=True), self._lock:
+            rows = self._db.execute('SELECT key FROM extractions').fetchall()
+            for key, in rows:
+                _remove_tree(os.path.join(self._directory, key))
+            self._db.execute('DELETE FROM extractions')
+            self._db.execute('DELETE FROM digests')
+            self._db.commit()
+            self._size = 0
+
+    def close(self):
+        """Close the index of the cache."""
+        with self._lock:
+            self._db.close()
+
+# vim: ts=4 sts=4 sw=4 et ai
@@ -22,24 +22,346 @@
 Binary file data extraction core classes.
 """
 
+import os
+import stat
+import threading
+from collections import deque
+
+class ExtractorEntry(object):
+    """Entry of a file system image.
+
+    :param path: path of the entry, relative to the root of the image.
+    :type path: str
+
+    :param mode: type and permissions of the entry, as in :func:`os.stat`.
+    :type mode: int
+
+    :param size: size of the contents of the entry, in bytes.
+    :type size: int
+
+    :param uid: user identifier of the owner.
+    :type uid: int
+
+    :param gid: group identifier of the owner.
+    :type gid: int
+
+    :param linkname: target of the entry, for a symbolic link.
+    :type linkname: str
+
+    :param rdev: device number, for a device.
+    :type rdev: int
+    """
+    def __init__(self, path, mode, size, uid=0, gid=0, linkname=None,
+                 rdev=0):
+        self.path = path
+        self.mode = mode
+        self.size = size
+        self.uid = uid
+        self.gid = gid
+        self.linkname = linkname
+        self.rdev = rdev
+
+    def __repr__(self):
+        return "<{0} {1!r}>".format(self.__class__.__name__, self.path)
+
+    def isdir(self):
+        """Return true if the entry is a directory."""
+        return stat.S_ISDIR(self.mode)
+
+    def isreg(self):
+        """Return true if the entry is a regular file."""
+        return stat.S_ISREG(self.mode)
+
+    def issym(self):
+        """Return true if the entry is a symbolic link."""
+        return stat.S_ISLNK(self.mode)
+
+    def isdev(self):
+        """Return true if the entry is a device, a FIFO or a socket."""
+        return not (self.isdir() or self.isreg() or self.issym())
+
 class Extractor(object):
     """Base class for extracting data from binary files.
 
     :param filename: path to the file to inspect.
     :type filename: str
     """
+    # Version of the output of the extractor, to increase whenever the
+    # extracted data changes for the same file.
+    version = 1
+
     def __init__(self, filename):
         self._filename = filename
         self._desc = 'Unknown'
 
+    @property
+    def filename(self):
+        return self._filename
+
     @property
     def description(self):
         return self._desc
 
-    def extract(self, destination):
+    def iter_entries(self):
+        """Iterate over the entries of the file, parents first.
+
+        :returns: the entries.
+        :rtype: iterator of :class:`grissom.extractors.core.ExtractorEntry`
+        """
+        raise NotImplementedError
+
+    def read(self, entry, size=None):
+        """Read the contents of an entry.
+
+        :param entry: the entry, as returned by :meth:`iter_entries`.
+        :type entry: :class:`grissom.extractors.core.ExtractorEntry`
+
+        :param size: maximum number of bytes to read, or None to read all
+                     the contents.
+        :type size: int
+
+        :returns: the contents.
+        :rtype: bytes
+        """
+        raise NotImplementedError
+
+    def extract(self, destination, predicate=None):
         """Extract data .
 
         :param destination: path to destination directory.
         :type destination: str
+
+        :param predicate: callable selecting the entries to write, as
+                          described in :mod:`grissom.extractors.predicates`,
+                          or None to write all of them.
+        :type predicate: callable
+
+        :returns: path to the extracted data, usually a directory, or a
+                  file if the data is a single file.
+        :rtype: str
         """
+        write_entries(self, self.iter_entries(), destination,
+                      predicate=predicate)
+        return destination
+
+class ParallelFileWriter(object):
+    """Write the contents of regular files, decompressing their blocks
+    across a pool of workers.
+
+    The image must provide a get_blocks(entry) method, returning the list of
+    the blocks of an entry as tuples whose last item is the size of the
+    block once decompressed, and a decompress(blocks) method, returning the
+    contents of consecutive blocks. Each task of the pool decompresses a run
+    of blocks and writes it at its position in the file.
+
+    :param image: the image holding the files.
+
+    :param executor: pool of workers.
+    :type executor: :class:`concurrent.futures.Executor`
+
+    :param blocks_per_task: number of blocks decompressed by a task.
+    :type blocks_per_task: int
+
+    :param max_pending: maximum number of tasks not finished yet.
+    :type max_pending: int
+    """
+    def __init__(self, image, executor, blocks_per_task=32, max_pending=16):
+        self._image = image
+        self._executor = executor
+        self._blocks_per_task = blocks_per_task
+        self._max_pending = max_pending
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._refs = {}
+
+    def _write_blocks(self, fd, position, blocks):
+        try:
+            os.pwrite(fd, self._image.decompress(blocks), position)
+        finally:
+            # The file is closed once all its blocks are written.
+            with self._lock:
+                self._refs[fd] -= 1
+                done = self._refs[fd] == 0
+                if done:
+                    del self._refs[fd]
+            if done:
+                os.close(fd)
+
+    def write_file(self, entry, path):
+        """Write the contents of a regular file.
+
+        The call returns as soon as the tasks are queued, unless too many
+        are pending.
+
+        :param entry: the entry of the file.
+        :type entry: :class:`grissom.extractors.core.ExtractorEntry`
+
+        :param path: path to the file to write.
+        :type path: str
+        """
+        blocks = self._image.get_blocks(entry)
+        fd = os.open(path,
+                     os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_NOFOLLOW,
+                     0o600)
+        if not blocks:
+            os.close(fd)
+            return
+        os.ftruncate(fd, entry.size)
+        n = self._blocks_per_task
+        tasks = [blocks[i:i + n] for i in range(0, len(blocks), n)]
+        with self._lock:
+            self._refs[fd] = len(tasks)
+        position = 0
+        for task in tasks:
+            future = self._executor.submit(self._write_blocks,
+                                           fd,
+                                           position,
+                                           task)
+            self._pending.append(future)
+            position += sum(b[-1] for b in task)
+        while len(self._pending) > self._max_pending:
+            self._pending.popleft().result()
+
+    def wait(self):
+        """Wait for all the files to be written."""
+        while self._pending:
+            self._pending.popleft().result()
+
+def head_blocks(blocks, size):
+    """Select the first blocks of an entry, holding at least a given number
+    of bytes once decompressed.
+
+    :param blocks: the blocks, whose last item is the size of the block once
+                   decompressed.
+    :type blocks: list of tuples
+
+    :param size: number of bytes to hold.
+    :type size: int
+
+    :returns: the selected blocks.
+    :rtype: list of tuples
+    """
+    length = 0
+    for i, block in enumerate(blocks):
+        if length >= size:
+            return blocks[:i]
+        length += block[-1]
+    return blocks
+
+def is_inside(path, directory):
+    """Check if a path stays inside a directory, once the symbolic links
+    of both are resolved.
+
+    :param path: the path.
+    :type path: str
+
+    :param directory: path to the directory.
+    :type directory: str
+
+    :returns: True or False.
+    :rtype: bool
+    """
+    path = os.path.realpath(path)
+    directory = os.path.realpath(directory)
+    return path == directory or \
+        path.startswith(directory.rstrip(os.sep) + os.sep)
+
+def create_file(path):
+    """Create a file for writing, failing if the path is a symbolic link,
+    so that the file can not be written outside of its directory.
+
+    :param path: path to the file.
+    :type path: str
+
+    :returns: the file, opened in binary mode.
+    :rtype: file object
+    """
+    flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_NOFOLLOW
+    return os.fdopen(os.open(path, flags, 0o666), 'wb')
+
+def _write_special(entry, path):
+    if entry.issym():
+        os.symlink(entry.linkname, path)
+    elif entry.isdev():
+        try:
+            os.mknod(path, entry.mode, entry.rdev)
+        except OSError:
+            # Creating devices requires privileges: skip them.
+            pass
+
+def write_entries(extractor, entries, destination, write_file=None,
+                  predicate=None):
+    """Write entries of a file to a directory.
+
+    The permissions of the directories are set once all the entries are
+    written, so that read-only directories can be filled. If a predicate is
+    given, the directories are only created to hold the selected entries.
+
+    Entries which would be written outside of the destination directory,
+    directly or through the symbolic links already written, are skipped.
+
+    :param extractor: extractor of the file.
+    :type extractor: :class:`grissom.extractors.core.Extractor`
+
+    :param entries: the entries to write, parents first.
+    :type entries: iterable of :class:`grissom.extractors.core.ExtractorEntry`
+
+    :param destination: path to destination directory.
+    :type destination: str
+
+    :param write_file: callable writing the contents of a regular file,
+                       given the entry and the path to the file, or None to
+                       use :meth:`Extractor.read`.
+    :type write_file: callable
+
+    :param predicate: callable selecting the entries to write, or None to
+                      write all of them.
+    :type predicate: callable
+
+    :returns: the number of entries written.
+    :rtype: int
+    """
+    if write_file is None:
+        def write_file(entry, path):
+            with create_file(path) as f:
+                f.write(extractor.read(entry))
+
+    os.makedirs(destination, exist_ok=True)
+    root = os.path.realpath(destination)
+    dirs = []
+    count = 0
+    for entry in entries:
+        parts = entry.path.split(os.sep)
+        if os.path.isabs(entry.path) or os.pardir in parts:
+            # Never write outside of the destination directory.
+            continue
+        path = os.path.join(destination, entry.path)
+        # A symbolic link written before may lead elsewhere.
+        if not is_inside(path if entry.isdir() else os.path.dirname(path),
+                         root):
+            continue
+        if entry.isdir():
+            if predicate is None:
+                os.makedirs(path, exist_ok=True)
+                count += 1
+            dirs.append((path, entry.mode))
+            continue
+        if predicate is not None and not predicate(extractor, entry):
+            continue
+        if os.path.lexists(path):
+            os.unlink(path)
+        else:
+            # Archives do not always hold the parent directories.
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        if entry.isreg():
+            write_file(entry, path)
+            os.chmod(path, stat.S_IMODE(entry.mode))
+        else:
+            _write_special(entry, path)
+        count += 1
+    for path, mode in reversed(dirs):
+        if os.path.isdir(path) and not os.path.islink(path):
+            os.chmod(path, stat.S_IMODE(mode))
+    return count
+
 # vim: ts=4 sts=4 sw=4 et ai
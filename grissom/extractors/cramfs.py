@@ -19,21 +19,285 @@
 #
 
 import os
-from .core import Extractor
-from ..common import execute_command
+import mmap
+import zlib
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from gettext import gettext as _
+from .core import Extractor, ExtractorEntry, ParallelFileWriter
+from .core import write_entries, head_blocks
+from ..common import execute_command, InvalidFormatError
+from .. import profiling
+
+_MAGIC = 0x28cd3d45
+_SIGNATURE = b'Compressed ROMFS'
+_SUPERBLOCK_FMT = 'IIII16sIIII16s'
+_SUPERBLOCK_SIZE = 64
+_INODE_SIZE = 12
+
+# Offset of the superblock when the image is padded for boot code.
+_PADDED_OFFSET = 512
+
+# Extended block pointers are not supported.
+_SUPPORTED_FLAGS = 0x07ff
+
+class _CramfsEntry(ExtractorEntry):
+    def __init__(self, path, mode, size, uid, gid, offset):
+        ExtractorEntry.__init__(self, path, mode, size, uid, gid)
+        self.offset = offset
+
+class CramfsImage(object):
+    """Read a Linux Compressed ROM File System image, without extracting it.
+
+    The image is mapped in memory. The blocks of a file are only inflated
+    when its contents are read.
+
+    :param filename: path to the image.
+    :type filename: str
+
+    :param block_size: size of the blocks, which is the size of a page of
+                       the system the image was built for.
+    :type block_size: int
+    """
+    def __init__(self, filename, block_size=4096):
+        self._block_size = block_size
+        with open(filename, 'rb') as f:
+            try:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise InvalidFormatError(_("Empty file"))
+        try:
+            self._parse_superblock()
+        except Exception:
+            self._map.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def close(self):
+        """Unmap the image."""
+        self._map.close()
+
+    def _parse_superblock(self):
+        for offset in (0, _PADDED_OFFSET):
+            if len(self._map) < offset + _SUPERBLOCK_SIZE + _INODE_SIZE:
+                break
+            for endian in ('<', '>'):
+                magic, = struct.unpack_from(endian + 'I', self._map, offset)
+                if magic == _MAGIC:
+                    self._endian = endian
+                    break
+            else:
+                continue
+            break
+        else:
+            raise InvalidFormatError(_("Not a CRAMFS image"))
+
+        fields = struct.unpack_from(self._endian + _SUPERBLOCK_FMT,
+                                    self._map,
+                                    offset)
+        magic, size, flags, future, signature = fields[:5]
+        if signature != _SIGNATURE:
+            raise InvalidFormatError(_("Not a CRAMFS image"))
+        if flags & ~_SUPPORTED_FLAGS:
+            raise InvalidFormatError(_("Unsupported CRAMFS features"))
+        if size > len(self._map):
+            raise InvalidFormatError(_("Truncated CRAMFS image"))
+        self.name = fields[-1].rstrip(b'\0').decode('latin-1')
+        self.edition = fields[6]
+        self._root = self._parse_inode(offset + _SUPERBLOCK_SIZE)
+
+    def _parse_inode(self, offset):
+        w0, w1, w2 = struct.unpack_from(self._endian + 'III',
+                                        self._map,
+                                        offset)
+        if self._endian == '<':
+            mode, uid = w0 & 0xffff, w0 >> 16
+            size, gid = w1 & 0xffffff, w1 >> 24
+            namelen, data = w2 & 0x3f, w2 >> 6
+        else:
+            mode, uid = w0 >> 16, w0 & 0xffff
+            size, gid = w1 >> 8, w1 & 0xff
+            namelen, data = w2 >> 26, w2 & 0x3ffffff
+        return mode, uid, size, gid, namelen * 4, data * 4
+
+    def _make_entry(self, path, inode):
+        mode, uid, size, gid, namelen, offset = inode
+        entry = _CramfsEntry(path, mode, size, uid, gid, offset)
+        if entry.issym():
+            entry.linkname = os.fsdecode(self.read(entry))
+        elif entry.isdev():
+            # The size of a device holds its number.
+            entry.rdev = size
+            entry.size = 0
+        return entry
+
+    def iter_entries(self):
+        """Iterate over the entries of the image, parents first.
+
+        The root directory is not included.
+
+        :returns: the entries.
+        :rtype: iterator of :class:`grissom.extractors.core.ExtractorEntry`
+        """
+        return self._iter_directory('', self._root, set())
+
+    def _iter_directory(self, path, inode, visited):
+        size, offset = inode[2], inode[5]
+        if size:
+            # A directory holding one of its parents would be walked
+            # forever. Empty directories all have a null offset.
+            if offset in visited:
+                raise InvalidFormatError(_("Directory loop at '{0}'")
+                                         .format(path))
+            visited.add(offset)
+        end = offset + size
+        while offset < end:
+            child = self._parse_inode(offset)
+            offset += _INODE_SIZE
+            name = self._map[offset:offset + child[4]].rstrip(b'\0')
+            offset += child[4]
+            entry = self._make_entry(os.path.join(path, os.fsdecode(name)),
+                                     child)
+            yield entry
+            if entry.isdir():
+                yield from self._iter_directory(entry.path, child, visited)
+
+    def get_blocks(self, entry):
+        """Get the location of the blocks of the contents of an entry.
+
+        :param entry: the entry.
+        :type entry: :class:`grissom.extractors.core.ExtractorEntry`
+
+        :returns: the (start, end, length) of the blocks, where start and
+                  end delimit the compressed data in the image and length is
+                  the size of the block once inflated, as expected by
+                  :class:`grissom.extractors.core.ParallelFileWriter`.
+        :rtype: list of (int, int, int)
+        """
+        n_blocks = (entry.size + self._block_size - 1) // self._block_size
+        if n_blocks == 0:
+            return []
+        ends = struct.unpack_from('{0}{1}I'.format(self._endian, n_blocks),
+                                  self._map,
+                                  entry.offset)
+        start = entry.offset + 4 * n_blocks
+        remaining = entry.size
+        blocks = []
+        for end in ends:
+            length = min(remaining, self._block_size)
+            blocks.append((start, end, length))
+            remaining -= length
+            start = end
+        return blocks
+
+    def decompress(self, blocks):
+        """Inflate blocks of the contents of an entry.
+
+        :param blocks: the blocks, as returned by :meth:`get_blocks`.
+        :type blocks: list of (int, int, int)
+
+        :returns: the inflated data.
+        :rtype: bytes
+        """
+        data = []
+        for start, end, length in blocks:
+            if end == start:
+                # A hole in a sparse file.
+                data.append(bytes(length))
+                continue
+            if end < start or end > len(self._map):
+                raise InvalidFormatError(_("Corrupted CRAMFS image"))
+            try:
+                data.append(zlib.decompress(self._map[start:end]))
+            except zlib.error:
+                raise InvalidFormatError(_("Corrupted CRAMFS image"))
+        return b''.join(data)
+
+    def read(self, entry, size=None):
+        """Read the contents of an entry.
+
+        Only the blocks holding the requested bytes are inflated.
+
+        :param entry: the entry, as returned by :meth:`iter_entries`.
+        :type entry: :class:`grissom.extractors.core.ExtractorEntry`
+
+        :param size: maximum number of bytes to read, or None to read all
+                     the contents.
+        :type size: int
+
+        :returns: the contents.
+        :rtype: bytes
+        """
+        blocks = self.get_blocks(entry)
+        if size is None:
+            return self.decompress(blocks)
+        return self.decompress(head_blocks(blocks, size))[:size]
 
 class CramfsExtractor(Extractor):
-    """Extract data from a Linux Compressed ROM File System."""
-    def __init__(self, filename):
+    """Extract data from a Linux Compressed ROM File System.
+
+    The image is read natively, inflating the blocks of the files across a
+    pool of workers. The cramfsck tool is only used for images with features
+    which are not supported, in which case all the entries are extracted.
+
+    :param filename: path to the image.
+    :type filename: str
+
+    :param jobs: maximum number of workers.
+    :type jobs: int
+
+    :param executor: executor of the cramfsck tool, or None to run it directly.
+    :type executor: :class:`grissom.common.CommandExecutor`
+    """
+    def __init__(self, filename, jobs=4, executor=None):
         Extractor.__init__(self, filename)
+        self._executor = executor
         self._desc = 'CRAMFS'
+        self._jobs = max(1, jobs)
+        self._image = None
+
+    def _get_image(self):
+        if self._image is None:
+            self._image = CramfsImage(self._filename)
+        return self._image
+
+    def iter_entries(self):
+        return self._get_image().iter_entries()
+
+    @profiling.timed('cramfs.read')
+    def read(self, entry, size=None):
+        return self._get_image().read(entry, size)
 
-    def extract(self, destination):
+    @profiling.timed('cramfs.extract')
+    def extract(self, destination, predicate=None):
         if not os.path.exists(destination):
             os.makedirs(destination)
         root, ext = os.path.splitext(os.path.basename(self._filename))
         destination = os.path.join(destination, root)
-        args = ['cramfsck', '-x', destination, self._filename]
-        execute_command(args)
+        try:
+            image = self._get_image()
+        except InvalidFormatError:
+            args = ['cramfsck', '-x', destination, self._filename]
+            if self._executor:
+                self._executor.run(args, check=True)
+            else:
+                execute_command(args, check=True)
+            return destination
+        with ThreadPoolExecutor(max_workers=self._jobs) as executor:
+            writer = ParallelFileWriter(image, executor, 32, 4 * self._jobs)
+            try:
+                write_entries(self,
+                              image.iter_entries(),
+                              destination,
+                              writer.write_file,
+                              predicate)
+            finally:
+                writer.wait()
+        return destination
 
 # vim: ts=4 sts=4 sw=4 et ai
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+#
+# grissom - FOSS compliance tools
+#
+# Copyright (c) 2013 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Predicates for selecting the entries to extract
+
+A predicate is called with the extractor and an entry which is not a
+directory, and returns True if the entry must be written. The directories
+are only created to hold the selected entries.
+"""
+
+import os
+import magic
+import fnmatch
+import threading
+from . import find_extractor_class
+
+_ELF_MAGIC = b'\x7fELF'
+
+# Number of bytes needed to identify an image.
+_IMAGE_HEADER_SIZE = 4096
+
+_local = threading.local()
+
+def is_elf(extractor, entry):
+    """Select ELF files and symbolic links.
+
+    Symbolic links are kept, since libraries are usually looked up through
+    them.
+    """
+    if entry.issym():
+        return True
+    if not entry.isreg() or entry.size < len(_ELF_MAGIC):
+        return False
+    return extractor.read(entry, len(_ELF_MAGIC)) == _ELF_MAGIC
+
+def is_executable(extractor, entry):
+    """Select regular files which can be executed by someone."""
+    return entry.isreg() and bool(entry.mode & 0o111)
+
+def is_image(extractor, entry):
+    """Select regular files which can be extracted in turn."""
+    if not entry.isreg() or entry.size == 0:
+        return False
+    if not hasattr(_local, 'magic'):
+        # Loading the database of libmagic is costly: once per thread.
+        _local.magic = magic.Magic()
+    text = _local.magic.id_buffer(extractor.read(entry, _IMAGE_HEADER_SIZE))
+    return find_extractor_class(text) is not None
+
+def match_names(*patterns):
+    """Create a predicate selecting entries by name.
+
+    :param patterns: shell-style patterns, matched against the base name of
+                     the entries.
+    :type patterns: list of str
+
+    :returns: the predicate.
+    :rtype: callable
+    """
+    def predicate(extractor, entry):
+        name = os.path.basename(entry.path)
+        return any(fnmatch.fnmatchcase(name, p) for p in patterns)
+    return predicate
+
+def all_of(*predicates):
+    """Create a predicate selecting entries selected by all the predicates.
+
+    The predicates are called in order, so cheap ones should come first.
+
+    :param predicates: the predicates.
+    :type predicates: list of callables
+
+    :returns: the predicate.
+    :rtype: callable
+    """
+    def predicate(extractor, entry):
+        return all(p(extractor, entry) for p in predicates)
+    return predicate
+
+def any_of(*predicates):
+    """Create a predicate selecting entries selected by one of the
+    predicates.
+
+    :param predicates: the predicates.
+    :type predicates: list of callables
+
+    :returns: the predicate.
+    :rtype: callable
+    """
+    def predicate(extractor, entry):
+        return any(p(extractor, entry) for p in predicates)
+    return predicate
+
+# vim: ts=4 sts=4 sw=4 et ai
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+#
+# grissom - FOSS compliance tools
+#
+# Copyright (c) 2013 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Recursive extraction of nested images
+"""
+
+import os
+import stat
+import magic
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from . import create_extractor, find_extractor_class
+from .predicates import any_of, is_image
+from ..common import compute_file_digest
+
+ExtractedImage = namedtuple('ExtractedImage',
+                            ['filename', 'description', 'destination',
+                             'depth', 'error'])
+
+# Suffix of the directory a nested image is extracted to, next to it.
+NESTED_SUFFIX = '.extracted'
+
+class RecursiveExtractor(object):
+    """Extract images, then the images found in the extracted files.
+
+    The images waiting to be extracted are kept in a queue, processed by a
+    pool of workers, so that independent images are extracted concurrently.
+    Each nested image is extracted in a directory next to it, named after it
+    with the '.extracted' suffix. An image whose contents was already
+    extracted, such as an image holding itself, is not extracted again.
+
+    :param jobs: maximum number of images extracted at the same time.
+    :type jobs: int
+
+    :param max_depth: maximum nesting level of the images to extract, 0 to
+                      only extract the given images.
+    :type max_depth: int
+
+    :param predicate: callable selecting the entries to write, as described
+                      in :mod:`grissom.extractors.predicates`, or None to
+                      write all of them. The nested images are always
+                      written, so that they can be extracted in turn.
+    :type predicate: callable
+
+    :param cache: cache of extracted data or None.
+    :type cache: :class:`grissom.extractors.cache.ExtractionCache`
+    """
+    def __init__(self, jobs=4, max_depth=8, predicate=None, cache=None):
+        self._jobs = max(1, jobs)
+        self._max_depth = max_depth
+        self._cache = cache
+        self._predicate = predicate
+        if predicate is not None and max_depth > 0:
+            self._predicate = any_of(predicate, is_image)
+        self._lock = threading.Lock()
+        self._digests = set()
+
+    def _iter_files(self, path):
+        if not os.path.isdir(path):
+            yield path
+            return
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for name in sorted(filenames):
+                yield os.path.join(dirpath, name)
+
+    def _find_images(self, path):
+        images = []
+        with magic.Magic() as m:
+            for filename in self._iter_files(path):
+                try:
+                    if not stat.S_ISREG(os.lstat(filename).st_mode):
+                        continue
+                    text = m.id_filename(filename)
+                except Exception:
+                    continue
+                klass = find_extractor_class(text)
+                if klass is not None:
+                    images.append((filename, klass))
+        return images
+
+    def _extract(self, filename, klass, destination, depth):
+        description = None
+        try:
+            if self._cache:
+                digest = self._cache.get_digest(filename)
+            else:
+                digest = compute_file_digest(filename)
+            with self._lock:
+                if digest in self._digests:
+                    return None, []
+                self._digests.add(digest)
+            if klass is None:
+                extractor = create_extractor(filename)
+            else:
+                extractor = klass(filename)
+            description = extractor.description
+            if self._cache:
+                destination = self._cache.extract(extractor,
+                                                  destination,
+                                                  self._predicate,
+                                                  digest)
+            else:
+                destination = extractor.extract(destination, self._predicate)
+            # The description can be refined once the image is read.
+            description = extractor.description
+        except Exception as error:
+            result = ExtractedImage(filename, description, None, depth,
+                                    str(error) or error.__class__.__name__)
+            return result, []
+        result = ExtractedImage(filename, description, destination, depth,
+                                None)
+        if depth >= self._max_depth:
+            return result, []
+        return result, self._find_images(destination)
+
+    def iter_extract(self, filenames, destination):
+        """Extract images recursively.
+
+        Images whose contents was already extracted are not reported.
+
+        :param filenames: paths to the images.
+        :type filenames: iterable of str
+
+        :param destination: path to destination directory of the images.
+        :type destination: str
+
+        :returns: the images, in the order their extraction is completed.
+        :rtype: iterator of
+                :class:`grissom.extractors.recursive.ExtractedImage`
+        """
+        with ThreadPoolExecutor(max_workers=self._jobs) as executor:
+            pending = set()
+            for filename in filenames:
+                future = executor.submit(self._extract,
+                                         filename,
+                                         None,
+                                         destination,
+                                         0)
+                pending.add(future)
+            try:
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        result, images = future.result()
+                        if result is None:
+                            continue
+                        yield result
+                        for filename, klass in images:
+                            future = executor.submit(self._extract,
+                                                     filename,
+                                                     klass,
+                                                     filename + NESTED_SUFFIX,
+                                                     result.depth + 1)
+                            pending.add(future)
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def extract(self, filenames, destination):
+        """Extract images recursively.
+
+        :param filenames: paths to the images.
+        :type filenames: iterable of str
+
+        :param destination: path to destination directory of the images.
+        :type destination: str
+
+        :returns: the images.
+        :rtype: list of :class:`grissom.extractors.recursive.ExtractedImage`
+        """
+        return list(self.iter_extract(filenames, destination))
+
+# vim: ts=4 sts=4 sw=4 et ai
@@ -0,0 +1,498 @@
+# -*- coding: utf-8 -*-
+#
+# grissom - FOSS compliance tools
+#
+# Copyright (c) 2013 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import mmap
+import stat
+import zlib
+import lzma
+import struct
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from gettext import gettext as _
+from .core import Extractor, ExtractorEntry, ParallelFileWriter
+from .core import write_entries, head_blocks
+from ..common import execute_command, InvalidFormatError
+from .. import profiling
+
+try:
+    import lz4.block
+except ImportError:
+    lz4 = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+_MAGIC = 0x73717368
+_SUPERBLOCK_FMT = '<IIIIIHHHHHHQQQQQQQQ'
+_SUPERBLOCK_SIZE = struct.calcsize(_SUPERBLOCK_FMT)
+
+_METADATA_SIZE = 8192
+_METADATA_UNCOMPRESSED = 0x8000
+_BLOCK_UNCOMPRESSED = 0x1000000
+_NO_FRAGMENT = 0xffffffff
+
+_INODE_HEADER_FMT = '<HHHHII'
+_INODE_HEADER_SIZE = struct.calcsize(_INODE_HEADER_FMT)
+
+_DIR, _FILE, _SYMLINK, _BLKDEV, _CHRDEV, _FIFO, _SOCKET = range(1, 8)
+_EXT_DIR, _EXT_FILE, _EXT_SYMLINK = 8, 9, 10
+
+# Extended inode types are basic ones plus 7.
+_FILE_TYPES = {
+    _DIR: stat.S_IFDIR,
+    _FILE: stat.S_IFREG,
+    _SYMLINK: stat.S_IFLNK,
+    _BLKDEV: stat.S_IFBLK,
+    _CHRDEV: stat.S_IFCHR,
+    _FIFO: stat.S_IFIFO,
+    _SOCKET: stat.S_IFSOCK,
+}
+
+# Kinds of blocks of a file.
+_DATA, _SPARSE, _FRAGMENT = range(3)
+
+def _decompress_lz4(data, size):
+    return lz4.block.decompress(data, uncompressed_size=size)
+
+def _decompress_zstd(data, size):
+    return zstandard.ZstdDecompressor().decompress(data, max_output_size=size)
+
+_DECOMPRESSORS = {
+    1: lambda data, size: zlib.decompress(data),
+    2: lambda data, size: lzma.decompress(data, lzma.FORMAT_ALONE),
+    4: lambda data, size: lzma.decompress(data, lzma.FORMAT_XZ),
+}
+if lz4:
+    _DECOMPRESSORS[5] = _decompress_lz4
+if zstandard:
+    _DECOMPRESSORS[6] = _decompress_zstd
+
+# Number of fragment blocks kept decompressed.
+_FRAGMENT_CACHE_SIZE = 32
+
+# Number of metadata blocks kept decompressed, of up to 8 KiB each.
+_METADATA_CACHE_SIZE = 256
+
+class _SquashfsEntry(ExtractorEntry):
+    def __init__(self, path, mode, size, uid, gid, inode):
+        ExtractorEntry.__init__(self, path, mode, size, uid, gid)
+        self.inode = inode
+
+class SquashfsImage(object):
+    """Read a SquashFS 4.0 image, without extracting it.
+
+    The image is mapped in memory. The inode and directory tables are
+    decompressed as they are walked, and the blocks of a file are only
+    decompressed when its contents are read.
+
+    The gzip, lzma and xz compressors are supported, as well as lz4 and
+    zstd if the corresponding Python modules are installed.
+
+    :param filename: path to the image.
+    :type filename: str
+    """
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            try:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise InvalidFormatError(_("Empty file"))
+        self._metadata = OrderedDict()
+        self._metadata_lock = threading.Lock()
+        self._fragments = OrderedDict()
+        self._fragments_lock = threading.Lock()
+        try:
+            self._parse_superblock()
+        except Exception:
+            self._map.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def close(self):
+        """Unmap the image."""
+        self._map.close()
+
+    def _parse_superblock(self):
+        if len(self._map) < _SUPERBLOCK_SIZE:
+            raise InvalidFormatError(_("Not a SquashFS image"))
+        fields = struct.unpack_from(_SUPERBLOCK_FMT, self._map, 0)
+        (magic, self.inode_count, self.mtime, self._block_size,
+         n_fragments, compression, block_log, flags, n_ids, major, minor,
+         root, bytes_used, id_table, xattr_table, inode_table,
+         directory_table, fragment_table, export_table) = fields
+        if magic != _MAGIC:
+            raise InvalidFormatError(_("Not a SquashFS image"))
+        if (major, minor) != (4, 0):
+            raise InvalidFormatError(_("Unsupported SquashFS version"))
+        if compression not in _DECOMPRESSORS:
+            raise InvalidFormatError(_("Unsupported SquashFS compression"))
+        if bytes_used > len(self._map):
+            raise InvalidFormatError(_("Truncated SquashFS image"))
+        self._decompressor = _DECOMPRESSORS[compression]
+        self._inode_table = inode_table
+        self._directory_table = directory_table
+        self._ids = self._read_table(id_table, n_ids, 4, 'I')
+        self._fragment_table = self._read_table(fragment_table,
+                                                n_fragments,
+                                                16,
+                                                'QII')
+        self._root = self._read_inode(root >> 16, root & 0xffff)
+
+    def _decompress_block(self, data, size):
+        try:
+            return self._decompressor(data, size)
+        except Exception:
+            raise InvalidFormatError(_("Corrupted SquashFS image"))
+
+    def _read_metadata_block(self, position):
+        # Metadata blocks are shared by many inodes and directories: keep
+        # the most recently used ones once decompressed.
+        with self._metadata_lock:
+            block = self._metadata.get(position)
+            if block is not None:
+                self._metadata.move_to_end(position)
+                return block
+        if position + 2 > len(self._map):
+            raise InvalidFormatError(_("Corrupted SquashFS image"))
+        header, = struct.unpack_from('<H', self._map, position)
+        size = header & ~_METADATA_UNCOMPRESSED
+        data = self._map[position + 2:position + 2 + size]
+        if not header & _METADATA_UNCOMPRESSED:
+            data = self._decompress_block(data, _METADATA_SIZE)
+        block = (data, position + 2 + size)
+        with self._metadata_lock:
+            self._metadata[position] = block
+            if len(self._metadata) > _METADATA_CACHE_SIZE:
+                self._metadata.popitem(last=False)
+        return block
+
+    def _read_metadata(self, position, offset, size):
+        # Read data which may span over several metadata blocks, returning
+        # it with the position following it.
+        chunks = []
+        while size > 0:
+            data, next_position = self._read_metadata_block(position)
+            if offset >= len(data):
+                position, offset = next_position, offset - len(data)
+                continue
+            chunk = data[offset:offset + size]
+            chunks.append(chunk)
+            size -= len(chunk)
+            offset += len(chunk)
+        return b''.join(chunks), position, offset
+
+    def _read_table(self, start, count, entry_size, fmt):
+        if count == 0:
+            return []
+        n_blocks = (count * entry_size + _METADATA_SIZE - 1) // _METADATA_SIZE
+        pointers = struct.unpack_from('<{0}Q'.format(n_blocks),
+                                      self._map,
+                                      start)
+        data = b''.join(self._read_metadata_block(p)[0] for p in pointers)
+        fmt = '<' + fmt
+        return [struct.unpack_from(fmt, data, i * entry_size)
+                for i in range(count)]
+
+    def _read_inode(self, block, offset):
+        position = self._inode_table + block
+        data, position, offset = self._read_metadata(position,
+                                                     offset,
+                                                     _INODE_HEADER_SIZE)
+        itype, perms, uid, gid, mtime, number = \
+            struct.unpack(_INODE_HEADER_FMT, data)
+
+        def read(fmt):
+            nonlocal position, offset
+            size = struct.calcsize(fmt)
+            data, position, offset = self._read_metadata(position,
+                                                         offset,
+                                                         size)
+            return struct.unpack(fmt, data)
+
+        base_type = itype - 7 if itype > _SOCKET else itype
+        if base_type not in _FILE_TYPES:
+            raise InvalidFormatError(_("Corrupted SquashFS image"))
+        inode = {
+            'type': base_type,
+            'mode': _FILE_TYPES[base_type] | perms,
+            'uid': self._ids[uid][0],
+            'gid': self._ids[gid][0],
+            'size': 0,
+        }
+        if itype == _DIR:
+            start, links, size, doff, parent = read('<IIHHI')
+            inode.update(size=size, start=start, offset=doff)
+        elif itype == _EXT_DIR:
+            links, size, start, parent, n_idx, doff, xattr = read('<IIIIHHI')
+            inode.update(size=size, start=start, offset=doff)
+        elif itype in (_FILE, _EXT_FILE):
+            if itype == _FILE:
+                start, frag, foff, size = read('<IIII')
+            else:
+                start, size, sparse, links, frag, foff, xattr = \
+                    read('<QQQIIII')
+            n_blocks = size // self._block_size
+            if frag == _NO_FRAGMENT and size % self._block_size:
+                n_blocks += 1
+            inode.update(size=size, start=start, fragment=frag,
+                         fragment_offset=foff,
+                         blocks=read('<{0}I'.format(n_blocks)))
+        elif itype in (_SYMLINK, _EXT_SYMLINK):
+            links, size = read('<II')
+            target, position, offset = self._read_metadata(position,
+                                                           offset,
+                                                           size)
+            inode.update(target=target)
+        elif base_type in (_BLKDEV, _CHRDEV):
+            links, rdev = read('<II')
+            inode.update(rdev=rdev)
+        return inode
+
+    def _make_entry(self, path, inode):
+        size = inode['size'] if inode['type'] == _FILE else 0
+        entry = _SquashfsEntry(path,
+                               inode['mode'],
+                               size,
+                               inode['uid'],
+                               inode['gid'],
+                               inode)
+        if entry.issym():
+            entry.linkname = os.fsdecode(inode['target'])
+        entry.rdev = inode.get('rdev', 0)
+        return entry
+
+    def iter_entries(self):
+        """Iterate over the entries of the image, parents first.
+
+        The root directory is not included.
+
+        :returns: the entries.
+        :rtype: iterator of :class:`grissom.extractors.core.ExtractorEntry`
+        """
+        return self._iter_directory('', self._root, set())
+
+    def _iter_directory(self, path, inode, visited):
+        # The size of a listing includes 3 bytes for the implicit '.' and
+        # '..' entries.
+        remaining = inode['size'] - 3
+        if remaining > 0:
+            # A directory listed within itself would be walked forever.
+            key = (inode['start'], inode['offset'])
+            if key in visited:
+                raise InvalidFormatError(_("Directory loop at '{0}'")
+                                         .format(path))
+            visited.add(key)
+        position = self._directory_table + inode['start']
+        offset = inode['offset']
+        while remaining > 0:
+            data, position, offset = self._read_metadata(position, offset, 12)
+            count, block, number = struct.unpack('<III', data)
+            remaining -= 12
+            for i in range(count + 1):
+                data, position, offset = self._read_metadata(position,
+                                                             offset,
+                                                             8)
+                ioff, delta, itype, name_size = struct.unpack('<HhHH', data)
+                name, position, offset = self._read_metadata(position,
+                                                             offset,
+                                                             name_size + 1)
+                remaining -= 8 + name_size + 1
+                child = self._read_inode(block, ioff)
+                entry = self._make_entry(os.path.join(path, os.fsdecode(name)),
+                                         child)
+                yield entry
+                if entry.isdir():
+                    yield from self._iter_directory(entry.path,
+                                                    child,
+                                                    visited)
+
+    def get_blocks(self, entry):
+        """Get the location of the blocks of the contents of an entry.
+
+        :param entry: the entry.
+        :type entry: :class:`grissom.extractors.core.ExtractorEntry`
+
+        :returns: the blocks, as (kind, start, size, length) tuples, where
+                  length is the size of the block once decompressed, as
+                  expected by
+                  :class:`grissom.extractors.core.ParallelFileWriter`.
+        :rtype: list of tuples
+        """
+        inode = entry.inode
+        if inode['type'] != _FILE:
+            return []
+        blocks = []
+        start = inode['start']
+        remaining = inode['size']
+        for size in inode['blocks']:
+            length = min(remaining, self._block_size)
+            on_disk = size & ~_BLOCK_UNCOMPRESSED
+            if on_disk == 0:
+                blocks.append((_SPARSE, start, size, length))
+            else:
+                blocks.append((_DATA, start, size, length))
+            start += on_disk
+            remaining -= length
+        if remaining > 0:
+            blocks.append((_FRAGMENT,
+                           inode['fragment'],
+                           inode['fragment_offset'],
+                           remaining))
+        return blocks
+
+    def _read_fragment(self, index):
+        with self._fragments_lock:
+            data = self._fragments.get(index)
+            if data is not None:
+                self._fragments.move_to_end(index)
+                return data
+        if index >= len(self._fragment_table):
+            raise InvalidFormatError(_("Corrupted SquashFS image"))
+        start, size, unused = self._fragment_table[index]
+        data = self._read_data_block(start, size, self._block_size)
+        with self._fragments_lock:
+            self._fragments[index] = data
+            if len(self._fragments) > _FRAGMENT_CACHE_SIZE:
+                self._fragments.popitem(last=False)
+        return data
+
+    def _read_data_block(self, start, size, length):
+        on_disk = size & ~_BLOCK_UNCOMPRESSED
+        if start + on_disk > len(self._map):
+            raise InvalidFormatError(_("Corrupted SquashFS image"))
+        data = self._map[start:start + on_disk]
+        if size & _BLOCK_UNCOMPRESSED:
+            return data
+        return self._decompress_block(data, length)
+
+    def decompress(self, blocks):
+        """Decompress blocks of the contents of an entry.
+
+        :param blocks: the blocks, as returned by :meth:`get_blocks`.
+        :type blocks: list of tuples
+
+        :returns: the decompressed data.
+        :rtype: bytes
+        """
+        data = []
+        for kind, start, size, length in blocks:
+            if kind == _SPARSE:
+                data.append(bytes(length))
+            elif kind == _FRAGMENT:
+                fragment = self._read_fragment(start)
+                data.append(fragment[size:size + length])
+            else:
+                data.append(self._read_data_block(start, size, length))
+        return b''.join(data)
+
+    def read(self, entry, size=None):
+        """Read the contents of an entry.
+
+        Only the blocks holding the requested bytes are decompressed.
+
+        :param entry: the entry, as returned by :meth:`iter_entries`.
+        :type entry: :class:`grissom.extractors.core.ExtractorEntry`
+
+        :param size: maximum number of bytes to read, or None to read all
+                     the contents.
+        :type size: int
+
+        :returns: the contents.
+        :rtype: bytes
+        """
+        blocks = self.get_blocks(entry)
+        if size is None:
+            return self.decompress(blocks)
+        return self.decompress(head_blocks(blocks, size))[:size]
+
+class SquashfsExtractor(Extractor):
+    """Extract data from a SquashFS file system.
+
+    The image is read natively, decompressing the blocks of the files across
+    a pool of workers. The unsquashfs tool is only used for images with
+    features which are not supported, in which case all the entries are
+    extracted.
+
+    :param filename: path to the image.
+    :type filename: str
+
+    :param jobs: maximum number of workers.
+    :type jobs: int
+
+    :param executor: executor of the unsquashfs tool, or None to run it
+                     directly.
+    :type executor: :class:`grissom.common.CommandExecutor`
+    """
+    def __init__(self, filename, jobs=4, executor=None):
+        Extractor.__init__(self, filename)
+        self._executor = executor
+        self._desc = 'SquashFS'
+        self._jobs = max(1, jobs)
+        self._image = None
+
+    def _get_image(self):
+        if self._image is None:
+            self._image = SquashfsImage(self._filename)
+        return self._image
+
+    def iter_entries(self):
+        return self._get_image().iter_entries()
+
+    @profiling.timed('squashfs.read')
+    def read(self, entry, size=None):
+        return self._get_image().read(entry, size)
+
+    @profiling.timed('squashfs.extract')
+    def extract(self, destination, predicate=None):
+        if not os.path.exists(destination):
+            os.makedirs(destination)
+        root, ext = os.path.splitext(os.path.basename(self._filename))
+        destination = os.path.join(destination, root)
+        try:
+            image = self._get_image()
+        except InvalidFormatError:
+            args = ['unsquashfs', '-f', '-d', destination, self._filename]
+            if self._executor:
+                self._executor.run(args, check=True)
+            else:
+                execute_command(args, check=True)
+            return destination
+        with ThreadPoolExecutor(max_workers=self._jobs) as executor:
+            writer = ParallelFileWriter(image, executor, 4, 4 * self._jobs)
+            try:
+                write_entries(self,
+                              image.iter_entries(),
+                              destination,
+                              writer.write_file,
+                              predicate)
+            finally:
+                writer.wait()
+        return destination
+
+# vim: ts=4 sts=4 sw=4 et ai
@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+#
+# grissom - FOSS compliance tools
+#
+# Copyright (c) 2013 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Caches for legal information
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+class SearchCache(object):
+    """Cache the results of searches, evicting the least recently used ones.
+
+    :param ttl: time to live of the entries, in seconds.
+    :type ttl: float
+
+    :param max_entries: maximum number of entries.
+    :type max_entries: int
+
+    :param filename: path to the file where to persist the entries, or None
+                     to keep them in memory only.
+    :type filename: str
+    """
+    def __init__(self, ttl=300, max_entries=128, filename=None):
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._filename = filename
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if filename and os.path.exists(filename):
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self._filename) as f:
+                entries = json.load(f)
+        except ValueError:
+            return
+        for key, stamp, value in entries:
+            self._entries[key] = (stamp, value)
+        self._evict()
+
+    def _evict(self):
+        limit = time.time() - self._ttl
+        for key in [k for k, (s, v) in self._entries.items() if s < limit]:
+            del self._entries[key]
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key):
+        """Get the value of an entry.
+
+        :param key: key of the entry.
+        :type key: str
+
+        :returns: the value or None if there is no valid entry.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stamp, value = entry
+            if stamp < time.time() - self._ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        """Add or replace an entry.
+
+        :param key: key of the entry.
+        :type key: str
+
+        :param value: value of the entry, which must be serializable as JSON
+                      if the cache is persisted.
+        """
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def clear(self):
+        """Remove all the entries."""
+        with self._lock:
+            self._entries.clear()
+
+    def sync(self):
+        """Write the entries to the file, if any."""
+        if not self._filename:
+            return
+        with self._lock:
+            self._evict()
+            entries = [(k, s, v) for k, (s, v) in self._entries.items()]
+        tmpname = self._filename + '.tmp'
+        with open(tmpname, 'w') as f:
+            json.dump(entries, f)
+        os.replace(tmpname, self._filename)
+
+class LicenseCache(object):
+    """Cache the legal information about files, by digest of their contents.
+
+    The entries are stored in a single SQLite database. When the size of
+    the stored information exceeds the limit, the least recently used
+    entries are evicted.
+
+    :param filename: path to the database, or ':memory:' to keep the entries
+                     in memory only.
+    :type filename: str
+
+    :param max_size: maximum size of the stored information, in bytes.
+    :type max_size: int
+    """
+    def __init__(self, filename=':memory:', max_size=64 * 1024 * 1024):
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        if filename != ':memory:':
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS licenses ('
+                         'digest TEXT NOT NULL, '
+                         'mode TEXT NOT NULL, '
+                         'value TEXT NOT NULL, '
+                         'size INTEGER NOT NULL, '
+                         'atime REAL NOT NULL, '
+                         'PRIMARY KEY (digest, mode))')
+        self._db.commit()
+        row = self._db.execute('SELECT TOTAL(size) FROM licenses').fetchone()
+        self._size = int(row[0])
+
+    def get(self, digest, mode):
+        """Get the information about a file.
+
+        :param digest: digest of the contents of the file.
+        :type digest: str
+
+        :param mode: name of the analysis which produced the information.
+        :type mode: str
+
+        :returns: the information or None if there is no entry.
+        """
+        with self._lock:
+            row = self._db.execute('SELECT value FROM licenses '
+                                   'WHERE digest = ? AND mode = ?',
+                                   (digest, mode)).fetchone()
+            if row is None:
+                return None
+            self._db.execute('UPDATE licenses SET atime = ? '
+                             'WHERE digest = ? AND mode = ?',
+                             (time.time(), digest, mode))
+            self._db.commit()
+        return json.loads(row[0])
+
+    def put(self, digest, mode, value):
+        """Add or replace the information about a file.
+
+        :param digest: digest of the contents of the file.
+        :type digest: str
+
+        :param mode: name of the analysis which produced the information.
+        :type mode: str
+
+        :param value: the information, which must be serializable as JSON.
+        """
+        data = json.dumps(value)
+        with self._lock:
+            row = self._db.execute('SELECT size FROM licenses '
+                                   'WHERE digest = ? AND mode = ?',
+                                   (digest, mode)).fetchone()
+            if row is not None:
+                self._size -= row[0]
+            self._db.execute('INSERT OR REPLACE INTO licenses '
+                             'VALUES (?, ?, ?, ?, ?)',
+                             (digest, mode, data, len(data), time.time()))
+            self._size += len(data)
+            self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        if self._size <= self._max_size:
+            return
+        rows = self._db.execute('SELECT digest, mode, size FROM licenses '
+                                'ORDER BY atime').fetchall()
+        for digest, mode, size in rows:
+            if self._size <= self._max_size:
+                break
+            self._db.execute('DELETE FROM licenses '
+                             'WHERE digest = ? AND mode = ?',
+                             (digest, mode))
+            self._size -= size
+
+    def clear(self):
+        """Remove all the entries."""
+        with self._lock:
+            self._db.execute('DELETE FROM licenses')
+            self._db.commit()
+            self._size = 0
+
+    def sync(self):
+        """Write the pending changes to the database."""
+        with self._lock:
+            self._db.commit()
+
+    def close(self):
+        """Close the database."""
+        with self._lock:
+            self._db.close()
+
+class UploadLedger(object):
+    """Record the files uploaded to servers, by digest of their contents.
+
+    :param filename: path to the database, or ':memory:' to keep the records
+                     in memory only.
+    :type filename: str
+    """
+    def __init__(self, filename=':memory:'):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS uploads ('
+                         'server TEXT NOT NULL, '
+                         'digest TEXT NOT NULL, '
+                         'upid INTEGER NOT NULL, '
+                         'filename TEXT NOT NULL, '
+                         'mtime REAL NOT NULL, '
+                         'PRIMARY KEY (server, digest))')
+        self._db.commit()
+
+    def get(self, server, digest):
+        """Get the upload identifier of a file.
+
+        :param server: address of the server.
+        :type server: str
+
+        :param digest: digest of the contents of the file.
+        :type digest: str
+
+        :returns: the upload identifier and the name of the uploaded file, or
+                  None if the file has not been uploaded.
+        :rtype: tuple
+        """
+        with self._lock:
+            row = self._db.execute('SELECT upid, filename FROM uploads '
+                                   'WHERE server = ? AND digest = ?',
+                                   (server, digest)).fetchone()
+        return row
+
+    def put(self, server, digest, upid, filename):
+        """Record the upload of a file.
+
+        :param server: address of the server.
+        :type server: str
+
+        :param digest: digest of the contents of the file.
+        :type digest: str
+
+        :param upid: the upload identifier.
+        :type upid: int
+
+        :param filename: name of the uploaded file.
+        :type filename: str
+        """
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO uploads '
+                             'VALUES (?, ?, ?, ?, ?)',
+                             (server, digest, upid, filename, time.time()))
+            self._db.commit()
+
+    def remove(self, server, digest):
+        """Forget the upload of a file.
+
+        :param server: address of the server.
+        :type server: str
+
+        :param digest: digest of the contents of the file.
+        :type digest: str
+        """
+        with self._lock:
+            self._db.execute('DELETE FROM uploads '
+                             'WHERE server = ? AND digest = ?',
+                             (server, digest))
+            self._db.commit()
+
+    def close(self):
+        """Close the database."""
+        with self._lock:
+            self._db.close()
+
+# vim: ts=4 sts=4 sw=4 et ai
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+#
+# grissom - FOSS compliance tools
+#
+# Copyright (c) 2013 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Persistent HTTP connections
+"""
+
+import socket
+import threading
+import http.client
+import urllib.error
+import urllib.request
+
+_BUSY = object()
+
+_BLOCK_SIZE = 65536
+
+_STALE_ERRORS = (
+    http.client.RemoteDisconnected,
+    ConnectionResetError,
+    BrokenPipeError,
+)
+
+class ConnectionPool(object):
+    """Pool of persistent HTTP/1.1 connections to a host.
+
+    A connection goes back to the pool as soon as the response it carried
+    has been read completely.
+
+    :param factory: callable creating a new connection.
+    :type factory: callable
+
+    :param size: maximum number of persistent connections.
+    :type size: int
+    """
+    def __init__(self, factory, size=4):
+        self._factory = factory
+        self._size = size
+        self._conns = {}
+        self._lock = threading.Lock()
+
+    def _is_idle(self, state):
+        return state is None or (state is not _BUSY and state.isclosed())
+
+    def acquire(self):
+        """Get a connection.
+
+        :returns: the connection and a flag telling if it was used before.
+        :rtype: tuple
+        """
+        with self._lock:
+            for conn, state in self._conns.items():
+                if self._is_idle(state):
+                    self._conns[conn] = _BUSY
+                    return conn, state is not None
+            conn = self._factory()
+            if len(self._conns) < self._size:
+                self._conns[conn] = _BUSY
+            return conn, False
+
+    def bind(self, conn, response):
+        """Bind a connection to the response it carries.
+
+        :param conn: the connection.
+        :type conn: :class:`http.client.HTTPConnection`
+
+        :param response: the response being received.
+        :type response: :class:`http.client.HTTPResponse`
+        """
+        with self._lock:
+            if conn in self._conns:
+                self._conns[conn] = response
+
+    def discard(self, conn):
+        """Close a connection and remove it from the pool.
+
+        :param conn: the connection.
+        :type conn: :class:`http.client.HTTPConnection`
+        """
+        with self._lock:
+            self._conns.pop(conn, None)
+        conn.close()
+
+    def close(self):
+        """Close all the connections."""
+        with self._lock:
+            conns = list(self._conns)
+            self._conns.clear()
+        for conn in conns:
+            conn.close()
+
+class _KeepAliveMixin(object):
+    def _init_pools(self, pool_size):
+        self._pool_size = pool_size
+        self._pools = {}
+        self._pools_lock = threading.Lock()
+
+    def _get_pool(self, host, klass, **kwargs):
+        with self._pools_lock:
+            pool = self._pools.get(host)
+            if pool is None:
+                factory = lambda: klass(host, blocksize=_BLOCK_SIZE, **kwargs)
+                pool = ConnectionPool(factory, self._pool_size)
+                self._pools[host] = pool
+            return pool
+
+    def close(self):
+        """Close all the persistent connections."""
+        with self._pools_lock:
+            pools = list(self._pools.values())
+            self._pools.clear()
+        for pool in pools:
+            pool.close()
+
+    def _send(self, conn, req, headers):
+        timeout = req.timeout
+        if timeout is socket._GLOBAL_DEFAULT_TIMEOUT:
+            timeout = socket.getdefaulttimeout()
+        conn.timeout = timeout
+        if conn.sock:
+            conn.sock.settimeout(timeout)
+        conn.request(req.get_method(), req.selector, req.data, headers)
+        return conn.getresponse()
+
+    def _do_keepalive_open(self, req, klass, **kwargs):
+        host = req.host
+        if not host:
+            raise urllib.error.URLError('no host given')
+
+        headers = dict(req.unredirected_hdrs)
+        headers.update((k, v) for k, v in req.headers.items()
+                       if k not in headers)
+        headers = dict((k.title(), v) for k, v in headers.items())
+        headers.pop('Connection', None)
+
+        pool = self._get_pool(host, klass, **kwargs)
+        conn, reused = pool.acquire()
+        try:
+            try:
+                r = self._send(conn, req, headers)
+            except _STALE_ERRORS:
+                # The server closed an idle connection: retry on a new one.
+                if not reused:
+                    raise
+                conn.close()
+                if hasattr(req.data, 'seek'):
+                    req.data.seek(0)
+                r = self._send(conn, req, headers)
+        except OSError as err:
+            pool.discard(conn)
+            raise urllib.error.URLError(err)
+        except http.client.HTTPException:
+            pool.discard(conn)
+            raise
+
+        pool.bind(conn, r)
+        r.url = req.get_full_url()
+        r.msg = r.reason
+        return r
+
+class KeepAliveHTTPHandler(_KeepAliveMixin, urllib.request.HTTPHandler):
+    """Handle HTTP requests using persistent connections.
+
+    :param pool_size: maximum number of persistent connections per host.
+    :type pool_size: int
+    """
+    def __init__(self, pool_size=4):
+        urllib.request.HTTPHandler.__init__(self)
+        self._init_pools(pool_size)
+
+    def http_open(self, req):
+        return self._do_keepalive_open(req, http.client.HTTPConnection)
+
+class KeepAliveHTTPSHandler(_KeepAliveMixin, urllib.request.HTTPSHandler):
+    """Handle HTTPS requests using persistent connections.
+
+    :param pool_size: maximum number of persistent connections per host.
+    :type pool_size: int
+    """
+    def __init__(self, pool_size=4, context=None):
+        urllib.request.HTTPSHandler.__init__(self, context=context)
+        self._init_pools(pool_size)
+
+    def https_open(self, req):
+        return self._do_keepalive_open(req,
+                                       http.client.HTTPSConnection,
+                                       context=self._context)
+
+# vim: ts=4 sts=4 sw=4 et ai
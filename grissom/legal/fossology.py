@@ -25,21 +25,66 @@ Fossology helpers
 import os
 import re
 import json
+import html
+import codecs
+import time
+import heapq
+import socket
 import platform
+import http.client
+import urllib.error
 import urllib.request
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from http.cookiejar import CookieJar
 from urllib.parse import urlencode
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 from gettext import gettext as _
 from datetime import datetime
 from collections import namedtuple
-from ..common import is_compressed_archive, encode_multipart_formdata
+from ..common import is_compressed_archive, MultipartEncoder
+from ..common import compute_file_digest
+from .connection import KeepAliveHTTPHandler, KeepAliveHTTPSHandler
+from .cache import SearchCache
+from .. import profiling
 
 
 FossologyResult = namedtuple('FossologyResult',
                              ['name', 'upid', 'itemid', 'folder'])
 
-def create_agent(server, secured, user, password):
+AnalysisResult = namedtuple('AnalysisResult',
+                            ['filename', 'info', 'error'])
+
+SubmissionResult = namedtuple('SubmissionResult',
+                              ['filename', 'upid', 'status', 'error'])
+
+JOB_PENDING = 'pending'
+JOB_RUNNING = 'running'
+JOB_COMPLETED = 'completed'
+JOB_FAILED = 'failed'
+
+PackageReport = namedtuple('PackageReport',
+                           ['package', 'major', 'histogram', 'files'])
+
+_MINOR_LICENSES = (
+    'No_license_found', 'Same-license-as',
+    'FSF', 'Trademark-ref', 'GPL-exception'
+)
+
+_TRANSIENT_ERRORS = (
+    urllib.error.URLError,
+    http.client.HTTPException,
+    socket.timeout,
+    ConnectionError,
+)
+
+def _is_transient_error(error):
+    if isinstance(error, urllib.error.HTTPError):
+        return error.code >= 500
+    return isinstance(error, _TRANSIENT_ERRORS)
+
+def create_agent(server, secured, user, password, pool_size=4,
+                 search_cache=None, license_cache=None, upload_ledger=None,
+                 scanner=None):
     """Create agent to interact with Fossology server.
 
     This function can be used with the 'with' statement::
@@ -61,14 +106,345 @@ def create_agent(server, secured, user, password):
     :param password: password for the connection
     :type password: str
 
+    :param pool_size: maximum number of persistent connections.
+    :type pool_size: int
+
+    :param search_cache: cache for search results or None to use a new one.
+    :type search_cache: :class:`grissom.legal.cache.SearchCache`
+
+    :param license_cache: cache for analysis results or None.
+    :type license_cache: :class:`grissom.legal.cache.LicenseCache`
+
+    :param upload_ledger: record of the past uploads or None.
+    :type upload_ledger: :class:`grissom.legal.cache.UploadLedger`
+
+    :param scanner: local license scanner or None.
+    :type scanner: :class:`grissom.legal.scanner.LicenseScanner`
+
     :returns: the agent.
     :rtype: :class:`grissom.legal.fossology.FossologyAgent`
     """
-    return FossologyAgent(server, secured, user, password)
+    return FossologyAgent(server,
+                          secured,
+                          user,
+                          password,
+                          pool_size,
+                          search_cache,
+                          license_cache,
+                          upload_ledger,
+                          scanner)
 
 class FossologyError(Exception):
     """Error raised when on operation involving Fossology server fails"""
 
+def _iter_json_items(stream, key, chunk_size=65536):
+    """Iterate over the items of an array held by a JSON object, decoding
+    them as soon as they have been read from a stream.
+
+    The stream is read until its end once the array is done with, so that
+    the connection carrying it can be reused.
+
+    :param stream: stream to read the UTF-8 encoded JSON object from.
+    :type stream: file-like object
+
+    :param key: key of the array in the object.
+    :type key: str
+
+    :param chunk_size: size of the chunks read from the stream.
+    :type chunk_size: int
+
+    :returns: the items of the array.
+    :rtype: iterator
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    buf = ''
+    pos = 0
+    eof = False
+
+    def fill():
+        nonlocal buf, pos, eof
+        chunk = stream.read(chunk_size)
+        buf = buf[pos:] + utf8.decode(chunk, not chunk)
+        pos = 0
+        eof = not chunk
+
+    def peek():
+        # Skip blanks, returning the next character or '' at the end.
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos].isspace():
+                pos += 1
+            if pos < len(buf) or eof:
+                return buf[pos:pos + 1]
+            fill()
+
+    def expect(char):
+        nonlocal pos
+        if peek() != char:
+            raise FossologyError(_("Invalid reply"))
+        pos += 1
+
+    def decode():
+        nonlocal pos
+        peek()
+        while True:
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+                # A trailing value may be incomplete, e.g. a truncated
+                # number.
+                if end < len(buf) or eof:
+                    pos = end
+                    return value
+            except ValueError:
+                if eof:
+                    raise FossologyError(_("Invalid reply"))
+            fill()
+
+    # Only the keys of the object itself are looked at, the values of the
+    # others being skipped whole.
+    expect('{')
+    while True:
+        if peek() != '"':
+            raise FossologyError(_("Invalid reply"))
+        name = decode()
+        expect(':')
+        if name == key:
+            break
+        decode()
+        expect(',')
+
+    expect('[')
+    while True:
+        char = peek()
+        if char == ']':
+            break
+        elif char == ',':
+            pos += 1
+            continue
+        yield decode()
+
+    while stream.read(chunk_size):
+        pass
+
+#
+# Fossology pages are big, but only a few of their elements are of interest.
+# Only these elements are parsed, using the fastest parser available.
+#
+try:
+    import lxml
+    _HTML_PARSER = 'lxml'
+except ImportError:
+    _HTML_PARSER = 'html.parser'
+
+_SEARCH_STRAINER = SoupStrainer('div', style=True)
+_NEXT_ANCHOR_EXPR = re.compile(r'<a\b[^>]*?\shref=([\'"])([^\'"]*)\1[^>]*>'
+                               r'\s*\[Next\]\s*</a>',
+                               re.IGNORECASE)
+_SEARCH_PAGE_LINK_EXPR = re.compile(r'href=[\'"]/\?mod=search&[^\'"]*?'
+                                    r'&(?:amp;)?page=(\d+)[\'"]')
+_HISTOGRAM_STRAINER = SoupStrainer('table', id='lichistogram')
+_JOBS_STRAINER = SoupStrainer('td')
+# Statuses of the jobs which did not fail, completed ones included.
+_JOB_OK_STATUSES = ('Completed', 'Started', 'Restart', 'Paused',
+                    'Not started')
+_JOB_FAILED_STATUSES = ('Failed', 'Killed')
+_UPLOAD_STRAINER = SoupStrainer('a', href=re.compile(r'^/\?mod=showjobs&'))
+
+def _parse_html(data, strainer):
+    return BeautifulSoup(data.decode('utf-8'),
+                         _HTML_PARSER,
+                         parse_only=strainer)
+
+def _parse_search_page(data):
+    """Parse a page of search results.
+
+    :param data: contents of the page.
+    :type data: bytes
+
+    :returns: the results and the URL of the next page, or None if it is the
+              last one.
+    :rtype: tuple
+    """
+    doc = _parse_html(data, _SEARCH_STRAINER)
+    results = _parse_search_result_doc(doc)
+    expr = re.compile(r'^/\?mod=search&searchtype=directory&filename=(.+)&page=(\d+)$')
+    pages = []
+    # The navigation links are matched directly, sparing a full parse.
+    for anchor in _NEXT_ANCHOR_EXPR.finditer(data.decode('utf-8')):
+        href = html.unescape(anchor.group(2))
+        match = expr.search(href)
+        if match:
+            pages.append(href)
+    if len(pages) >= 2:
+        return results, pages[-1]
+    return results, None
+
+def _find_last_search_page(data):
+    """Find the highest page number linked from a page of search results.
+
+    :param data: contents of the page.
+    :type data: bytes
+
+    :returns: the page number, or -1 if there is no link.
+    :rtype: int
+    """
+    numbers = _SEARCH_PAGE_LINK_EXPR.findall(data.decode('utf-8'))
+    return max([int(n) for n in numbers] or [-1])
+
+def _split_search_page_url(url):
+    """Split the URL of a page of search results.
+
+    :param url: the URL.
+    :type url: str
+
+    :returns: a template of the URL, with the page number as field, and the
+              page number.
+    :rtype: tuple
+    """
+    head, number = url.rsplit('page=', 1)
+    return head.replace('{', '{{').replace('}', '}}') + 'page={0}', int(number)
+
+def _parse_search_result_doc(doc):
+    expr = re.compile(r'^/\?mod=browse&upload=(\d+)&item=(\d+)$')
+    results = []
+    for div in doc.find_all('div'):
+        if not div.has_attr('style'):
+            continue
+        anchors = div.find_all('a')
+        if not anchors:
+            raise FossologyError(_("Invalid reply"))
+        f_crumbs = []
+        p_crumbs = []
+        for a in anchors[:-1]:
+            text = ''.join([s for s in a.stripped_strings])
+            if "folder=" in a['href']:
+                f_crumbs.append(text)
+            else:
+                p_crumbs.append(text)
+        folder = '/'.join(f_crumbs)
+        parent = '/'.join(p_crumbs)
+        if anchors[-1].has_attr('href'):
+            match = expr.match(anchors[-1]['href'])
+            if match:
+                children = anchors[-1].contents
+                name = children[-1].string
+                upid = int(match.group(1))
+                itemid = int(match.group(2))
+                if not parent:
+                    result = FossologyResult(name,
+                                             upid,
+                                             itemid,
+                                             folder)
+                    results.append(result)
+    return results
+
+def _parse_license_histogram(data):
+    """Parse the license histogram of a package.
+
+    :param data: contents of the page.
+    :type data: bytes
+
+    :returns: list of (license, count) pairs, the most frequent first.
+    :rtype: list of (str, int)
+    """
+    doc = _parse_html(data, _HISTOGRAM_STRAINER)
+    results = []
+    tables = doc.find_all('table', id='lichistogram')
+    if not tables:
+        raise FossologyError(_("Invalid reply"))
+    for row in tables[0].find_all('tr'):
+        cols = row.find_all('td')
+        if len(cols) == 3:
+            results.append((cols[2].string.strip(), int(cols[0].string)))
+    return sorted(results, key=lambda r: r[1], reverse=True)
+
+def _find_major_license(histogram):
+    """Find the major license in a license histogram.
+
+    :param histogram: list of (license, count) pairs.
+    :type histogram: list of (str, int)
+
+    :returns: the major license or None.
+    :rtype: str
+    """
+    major = None
+    limit = 0
+    for license, count in histogram:
+        if not license in _MINOR_LICENSES:
+            if count > limit:
+                major = license
+                limit = count
+    return major
+
+def _parse_license_list(data, pkgname):
+    """Parse the list of licenses of the files in a package.
+
+    :param data: contents of the page.
+    :type data: bytes
+
+    :param pkgname: name of the package.
+    :type pkgname: str
+
+    :returns: list of (filename, license) pairs.
+    :rtype: list of (str, str)
+    """
+    expr = re.compile(r'^{0}/(.+):(.+)'.format(pkgname))
+    doc = _parse_html(data, SoupStrainer(string=expr))
+    results = []
+    if '.tar.' in pkgname:
+        depth = 1
+    else:
+        depth = 0
+    for s in doc.strings:
+        match = expr.match(s)
+        if match:
+            fields = match.group(1).split('/', depth)
+            lic = match.group(2)
+            results.append((fields[-1], lic))
+    return results
+
+def _parse_job_status(data):
+    """Parse the status of the jobs of an upload.
+
+    :param data: contents of the page.
+    :type data: bytes
+
+    :returns: the overall status of the jobs.
+    :rtype: str
+    """
+    doc = _parse_html(data, _JOBS_STRAINER)
+    statuses = []
+    for cell in doc.find_all('td'):
+        text = cell.get_text().strip()
+        if text in _JOB_OK_STATUSES:
+            statuses.append(text)
+        elif text in _JOB_FAILED_STATUSES:
+            return JOB_FAILED
+    if not statuses:
+        return JOB_PENDING
+    if all(s == 'Completed' for s in statuses):
+        return JOB_COMPLETED
+    return JOB_RUNNING
+
+def _parse_upload_reply(data):
+    """Parse the reply to an upload.
+
+    :param data: contents of the page.
+    :type data: bytes
+
+    :returns: the upload identifier.
+    :rtype: int
+    """
+    doc = _parse_html(data, _UPLOAD_STRAINER)
+    expr = re.compile(r'^/\?mod=showjobs&upload=(\d+)')
+    for tag in doc.find_all('a'):
+        if tag.has_attr('href'):
+            match = expr.match(tag['href'])
+            if match:
+                return int(match.group(1))
+    raise FossologyError(_('Upload failed'))
+
 class FossologyAgent(object):
     """Interact with a Fossology server.
 
@@ -83,13 +459,41 @@ class FossologyAgent(object):
 
     :param password: password for the connection
     :type password: str
+
+    :param pool_size: maximum number of persistent connections.
+    :type pool_size: int
+
+    :param search_cache: cache for search results or None to use a new one.
+    :type search_cache: :class:`grissom.legal.cache.SearchCache`
+
+    :param license_cache: cache for analysis results or None. When set, a
+                          file is only sent for analysis if its contents are
+                          not already known.
+    :type license_cache: :class:`grissom.legal.cache.LicenseCache`
+
+    :param upload_ledger: record of the past uploads or None. When set, a
+                          file already uploaded is not submitted again.
+    :type upload_ledger: :class:`grissom.legal.cache.UploadLedger`
+
+    :param scanner: local license scanner or None. When set, a file is only
+                    sent for analysis if the scanner can not tell its
+                    licenses.
+    :type scanner: :class:`grissom.legal.scanner.LicenseScanner`
     """
-    def __init__(self, address, secured=False, user=None, password=None):
+    def __init__(self, address, secured=False, user=None, password=None,
+                 pool_size=4, search_cache=None, license_cache=None,
+                 upload_ledger=None, scanner=None):
         self._user = user
         self._password = password
+        self._pool_size = pool_size
+        self._search_cache = search_cache or SearchCache()
+        self._license_cache = license_cache
+        self._upload_ledger = upload_ledger
+        self._scanner = scanner
         self._opener = None
+        self._handlers = []
         if secured:
-            fmt = "https://{O}/"
+            fmt = "https://{0}/"
         else:
             fmt = "http://{0}/"
         self._url = fmt.format(address)
@@ -104,7 +508,11 @@ class FossologyAgent(object):
     def login(self):
         """Log into Fossology."""
         cookie_p = urllib.request.HTTPCookieProcessor(CookieJar())
-        self._opener = urllib.request.build_opener(cookie_p)
+        self._handlers = [
+            KeepAliveHTTPHandler(self._pool_size),
+            KeepAliveHTTPSHandler(self._pool_size),
+        ]
+        self._opener = urllib.request.build_opener(cookie_p, *self._handlers)
         self._opener.addheaders = [
             ('User-Agent', "Grissom/1.0 ({0})".format(platform.system())),
             ('Accept', '*/*')
@@ -112,12 +520,22 @@ class FossologyAgent(object):
         data = urlencode({'username': self._user, 'password': self._password})
         data = data.encode('utf-8')
         url = self._url + '?mod=auth'
-        self._opener.open(url, data)
+        self._open(url, data).read()
 
     def logout(self):
         """Log out of Fossology."""
         url = self._url + '?mod=auth'
-        self._opener.open(url)
+        self._open(url).read()
+        for handler in self._handlers:
+            handler.close()
+        self._search_cache.sync()
+        if self._license_cache:
+            self._license_cache.sync()
+
+    @profiling.timed('fossology.request')
+    def _open(self, *args, **kwargs):
+        # Every request to the server goes through here.
+        return self._opener.open(*args, **kwargs)
 
     def _check_session(self):
         if not self._opener:
@@ -130,71 +548,86 @@ class FossologyAgent(object):
 
           agent.search('foo%.tar.gz')
 
+        The results are cached, so a pattern is only looked up once as long as
+        the entry is valid.
+
         :param pattern: pattern for package name.
         :type pattern: str
 
         :returns: list of matching packages
         :rtype: list of :class:`grissom.legal.fossology.FossologyResult`.
         """
+        return list(self.iter_search(pattern))
+
+    def iter_search(self, pattern, jobs=4):
+        """Search for uploaded packages, yielding the results as the pages
+        are received.
+
+        The pages of results are fetched concurrently.
+
+        :param pattern: pattern for package name.
+        :type pattern: str
+
+        :param jobs: maximum number of pages fetched at the same time.
+        :type jobs: int
+
+        :returns: the matching packages.
+        :rtype: iterator of :class:`grissom.legal.fossology.FossologyResult`.
+        """
         self._check_session()
+        key = self._url + ' ' + pattern
+        results = self._search_cache.get(key)
+        if results is not None:
+            for r in results:
+                yield FossologyResult(*r)
+            return
+        results = []
+        for page in self._iter_search_pages(pattern, max(1, jobs)):
+            results += page
+            for r in page:
+                yield r
+        self._search_cache.put(key, results)
+
+    def _fetch_search_page(self, url):
+        data = self._open(self._url.rstrip('/') + url).read()
+        results, next_url = _parse_search_page(data)
+        return results, next_url, _find_last_search_page(data)
+
+    def _iter_search_pages(self, pattern, jobs):
         data = urlencode({'searchtype': 'directory', 'filename': pattern})
         data = data.encode('utf-8')
         url = self._url + '?mod=search'
-        response = self._opener.open(url, data)
-        has_next = True
-        results = []
-        expr = re.compile(r'^/\?mod=search&searchtype=directory&filename=(.+)&page=(\d+)$')
-        while has_next:
-            doc = BeautifulSoup(response.read().decode('utf-8'))
-            results += self._parse_search_result_doc(doc)
-            pages = []
-            for anchor in doc.find_all('a'):
-                if anchor.string == '[Next]':
-                    match = expr.search(anchor['href'])
-                    if match:
-                        pages.append(anchor['href'])
-            if len(pages) >= 2:
-                url = self._url.rstrip('/') + pages[-1]
-                response = self._opener.open(url)
-            else:
-                has_next = False
-        return results
-
-    def _parse_search_result_doc(self, doc):
-        expr = re.compile(r'^/\?mod=browse&upload=(\d+)&item=(\d+)$')
-        results = []
-        for div in doc.find_all('div'):
-            if not div.has_attr('style'):
-                continue
-            anchors = div.find_all('a')
-            if not anchors:
-                raise FossologyError(_("Invalid reply"))
-            f_crumbs = []
-            p_crumbs = []
-            for a in anchors[:-1]:
-                text = ''.join([s for s in a.stripped_strings])
-                if "folder=" in a['href']:
-                    f_crumbs.append(text)
-                else:
-                    p_crumbs.append(text)
-            folder = '/'.join(f_crumbs)
-            parent = '/'.join(p_crumbs)
-            if anchors[-1].has_attr('href'):
-                match = expr.match(anchors[-1]['href'])
-                if match:
-                    children = anchors[-1].contents
-                    name = children[-1].string
-                    upid = int(match.group(1))
-                    itemid = int(match.group(2))
-                    if not parent:
-                        result = FossologyResult(name,
-                                                 upid,
-                                                 itemid,
-                                                 folder)
-                        results.append(result)
-        return results
-
-    def _analyse_file(self, filename, as_spdx):
+        data = self._open(url, data).read()
+        results, next_url = _parse_search_page(data)
+        yield results
+        if not next_url:
+            return
+
+        # Fossology only links the next page when it does not know how many
+        # pages there are. Pages are then fetched ahead of time and those
+        # past the last one are discarded.
+        template, number = _split_search_page_url(next_url)
+        last = _find_last_search_page(data)
+        ahead = last <= number
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            pending = []
+            try:
+                while True:
+                    while len(pending) < jobs and (ahead or number <= last):
+                        future = executor.submit(self._fetch_search_page,
+                                                 template.format(number))
+                        pending.append(future)
+                        number += 1
+                    results, next_url, page_last = pending.pop(0).result()
+                    yield results
+                    if not next_url:
+                        break
+                    last = max(last, page_last)
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def _analyse_file(self, filename, as_spdx, timeout=None):
         """Post file for analysis.
 
         :param filename: path to the file to analyse.
@@ -203,8 +636,11 @@ class FossologyAgent(object):
         :param as_spdx: if true, output result in SPDX format.
         :type as_spdx: bool
 
-        :returns: the result of the analysis
-        :rtype: str
+        :param timeout: timeout of the request in seconds or None.
+        :type timeout: float
+
+        :returns: the reply, holding the result of the analysis.
+        :rtype: file-like object
         """
 
         #
@@ -226,41 +662,81 @@ class FossologyAgent(object):
         else:
             url += "?mod=agent_nomos_once"
 
+        if timeout is None:
+            timeout = socket._GLOBAL_DEFAULT_TIMEOUT
+
+        # The file is streamed rather than loaded in memory, so its length
+        # has to be known beforehand.
         with open(filename, 'rb') as f:
-            body = f.read()
-            response = self._opener.open(url, body)
-            contents = response.read().decode('utf-8').strip()
-            return contents
+            request = urllib.request.Request(url, f)
+            request.add_unredirected_header('Content-Length',
+                                            os.fstat(f.fileno()).st_size)
+            return self._open(request, timeout=timeout)
 
-    def analyze_and_format(self, filename):
+    def analyze_and_format(self, filename, timeout=None):
         """Perform a one-shot analysis of a file and format as SPDX.
 
         :param filename: path to the file to analyze.
         :type filename: str
 
+        :param timeout: timeout of the request in seconds or None.
+        :type timeout: float
+
         :returns: list of legal information about files.
         :rtype: list
         """
         if not is_compressed_archive(filename):
             raise FossologyError(_("SPDX only works with archives"))
 
-        reply = self._analyse_file(filename, True)
-        data = json.loads(reply)
-        return data['file_level_info']
-
-    def analyze(self, filename):
+        return self._cached_analysis(filename, 'spdx', self._analyze_spdx,
+                                     timeout)
+
+    def _analyze_spdx(self, filename, timeout):
+        reply = self._analyse_file(filename, True, timeout)
+        try:
+            return list(_iter_json_items(reply, 'file_level_info'))
+        finally:
+            reply.close()
+
+    def _cached_analysis(self, filename, mode, func, timeout):
+        if not self._license_cache:
+            return func(filename, timeout)
+        digest = compute_file_digest(filename)
+        info = self._license_cache.get(digest, mode)
+        if info is None:
+            info = func(filename, timeout)
+            self._license_cache.put(digest, mode, info)
+        return info
+
+    def analyze(self, filename, timeout=None):
         """Perform a one-shot analysis of a file.
 
+        If the agent has a local license scanner, the file is only sent to the
+        server when the result of the scanner is inconclusive.
+
         :param filename: path to the file to analyse.
         :type filename: str
 
+        :param timeout: timeout of the request in seconds or None.
+        :type timeout: float
+
         :returns: legal information.
         :rtype: a mapping between strings.
         """
         if is_compressed_archive(filename):
             raise FossologyError(_("Archives not supported"))
 
-        reply = self._analyse_file(filename, False)
+        if self._scanner:
+            info = self._scanner.scan(filename)
+            if info is not None:
+                return info
+
+        return self._cached_analysis(filename, 'nomos', self._analyze_nomos,
+                                     timeout)
+
+    def _analyze_nomos(self, filename, timeout):
+        reply = self._analyse_file(filename, False, timeout)
+        reply = reply.read().decode('utf-8').strip()
         # Handle Fossology <= 2.0.0
         info = reply.split(',')
         if len(info) == 2:
@@ -268,6 +744,88 @@ class FossologyAgent(object):
         else:
             return {'License': info[0]}
 
+    def _analyze_with_retries(self, filename, as_spdx, timeout, retries,
+                              backoff):
+        if as_spdx:
+            func = self.analyze_and_format
+        else:
+            func = self.analyze
+        attempt = 0
+        while True:
+            try:
+                return AnalysisResult(filename, func(filename, timeout), None)
+            except Exception as e:
+                if attempt >= retries or not _is_transient_error(e):
+                    return AnalysisResult(filename, None, e)
+            time.sleep(backoff * 2 ** attempt)
+            attempt += 1
+
+    def analyze_many(self, filenames, as_spdx=False, jobs=4, timeout=None,
+                     retries=2, backoff=1.0):
+        """Perform one-shot analyses of several files concurrently.
+
+        Failed requests are retried when the failure is transient (network
+        error, timeout or server error), waiting *backoff* seconds before the
+        first retry and twice as long before each of the next ones.
+
+        :param filenames: paths to the files to analyze.
+        :type filenames: iterable of str
+
+        :param as_spdx: if true, perform the analysis as
+                        :meth:`analyze_and_format` would.
+        :type as_spdx: bool
+
+        :param jobs: maximum number of requests running at the same time.
+        :type jobs: int
+
+        :param timeout: timeout of each request in seconds or None.
+        :type timeout: float
+
+        :param retries: maximum number of retries per file.
+        :type retries: int
+
+        :param backoff: delay in seconds before the first retry.
+        :type backoff: float
+
+        :returns: the results, in the order of the files.
+        :rtype: iterator of :class:`grissom.legal.fossology.AnalysisResult`
+        """
+        self._check_session()
+        jobs = max(1, jobs)
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            pending = []
+            for filename in filenames:
+                future = executor.submit(self._analyze_with_retries,
+                                         filename,
+                                         as_spdx,
+                                         timeout,
+                                         retries,
+                                         backoff)
+                pending.append(future)
+                # Keep a bounded window of requests in flight.
+                if len(pending) >= 2 * jobs:
+                    yield pending.pop(0).result()
+            for future in pending:
+                yield future.result()
+
+    def _find_package(self, pkgname):
+        packages = self.search(pkgname)
+        if not packages:
+            raise FossologyError(_("Can not find '{0}'").format(pkgname))
+        return packages[0]
+
+    def _fetch_license_histogram(self, package):
+        url = "?mod=nomoslicense&upload={0}&item={1}&show=detail"
+        url = url.format(package.upid, package.itemid)
+        response = self._open(self._url + url)
+        return _parse_license_histogram(response.read())
+
+    def _fetch_license_list(self, package, pkgname):
+        url = "?mod=license-list&show=detail&upload={0}&item={1}"
+        url = url.format(package.upid, package.itemid)
+        response = self._open(self._url + url)
+        return _parse_license_list(response.read(), pkgname)
+
     def query(self, pkgname):
         """Query licenses of the files in a package.
 
@@ -278,22 +836,7 @@ class FossologyAgent(object):
         :rtype: list of str
         """
         self._check_session()
-        packages = self.search(pkgname)
-        if not packages:
-            raise FossologyError(_("Can not find '{0}'").format(pkgname))
-        url = "?mod=nomoslicense&upload={0}&item={1}&show=detail"
-        url = url.format(packages[0].upid, packages[0].itemid)
-        response = self._opener.open(self._url + url)
-        doc = BeautifulSoup(response.read().decode('utf-8'))
-        results = []
-        tables = doc.find_all('table', id='lichistogram')
-        if not tables:
-            raise FossologyError(_("Invalid reply"))
-        for row in tables[0].find_all('tr'):
-            cols = row.find_all('td')
-            if len(cols) == 3:
-                results.append((cols[2].string.strip(), int(cols[0].string)))
-        return sorted(results, key=lambda r: r[1], reverse=True)
+        return self._fetch_license_histogram(self._find_package(pkgname))
 
     def query_all(self, pkgname):
         """Query licenses of the files in a package.
@@ -305,26 +848,8 @@ class FossologyAgent(object):
         :rtype: list of (str, str)
         """
         self._check_session()
-        packages = self.search(pkgname)
-        if not packages:
-            raise FossologyError(_("Can not find '{0}'").format(pkgname))
-        url = "?mod=license-list&show=detail&upload={0}&item={1}"
-        url = url.format(packages[0].upid, packages[0].itemid)
-        response = self._opener.open(self._url + url)
-        doc = BeautifulSoup(response.read().decode('utf-8'))
-        expr = re.compile(r'^{0}/(.+):(.+)'.format(pkgname))
-        results = []
-        if '.tar.' in pkgname:
-            depth = 1
-        else:
-            depth = 0
-        for s in doc.strings:
-            match = expr.match(s)
-            if match:
-                fields = match.group(1).split('/', depth)
-                lic = match.group(2)
-                results.append((fields[-1], lic))
-        return results
+        package = self._find_package(pkgname)
+        return self._fetch_license_list(package, pkgname)
 
     def query_major(self, pkgname):
         """Query major license of a package.
@@ -335,29 +860,87 @@ class FossologyAgent(object):
         :returns: the major license
         :rtype: str
         """
-        exceptions = [
-            'No_license_found', 'Same-license-as',
-            'FSF', 'Trademark-ref', 'GPL-exception'
-        ]
-        major = None
-        limit = 0
-        for license, count in self.query(pkgname):
-            if not license in exceptions:
-                if count > limit:
-                    major = license
-                    limit = count
-        return major
-
-    def submit(self, filename):
+        return _find_major_license(self.query(pkgname))
+
+    def package_report(self, pkgname):
+        """Query the major license, the licenses and the licenses of the files
+        of a package at once.
+
+        The package is looked up once, and both the license histogram and the
+        list of licenses of the files are fetched at the same time.
+
+        :param pkgname: name of the package.
+        :type pkgname: str
+
+        :returns: the report.
+        :rtype: :class:`grissom.legal.fossology.PackageReport`
+        """
+        self._check_session()
+        package = self._find_package(pkgname)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            histogram = executor.submit(self._fetch_license_histogram,
+                                        package)
+            files = executor.submit(self._fetch_license_list,
+                                    package,
+                                    pkgname)
+            histogram = histogram.result()
+            files = files.result()
+        return PackageReport(pkgname,
+                             _find_major_license(histogram),
+                             histogram,
+                             files)
+
+    def _find_previous_upload(self, digest):
+        record = self._upload_ledger.get(self._url, digest)
+        if record is None:
+            return None
+        upid, name = record
+        # Check the upload has not been deleted from the server since. The
+        # search cache is bypassed, as it may still list a deleted upload.
+        for page in self._iter_search_pages(name, 1):
+            for result in page:
+                if result.upid == upid:
+                    return upid
+        self._upload_ledger.remove(self._url, digest)
+        return None
+
+    def submit(self, filename, force=False):
         """Submit a file to Fossology for analysis.
 
+        If the agent has an upload ledger and a file with the same checksum
+        has already been uploaded to the server, which still has it, the
+        identifier of that upload is returned instead.
+
         :param filename: path to the file to submit.
         :type filename: str.
 
+        :param force: if true, always upload the file.
+        :type force: bool.
+
         :returns: the submission identifier.
         :rtype: int
         """
+        self._check_session()
+        digest = None
+        if self._upload_ledger:
+            digest = compute_file_digest(filename)
+            if not force:
+                upid = self._find_previous_upload(digest)
+                if upid is not None:
+                    return upid
+
+        upid = self._upload_file(filename)
+        if digest:
+            self._upload_ledger.put(self._url,
+                                    digest,
+                                    upid,
+                                    os.path.basename(filename))
+        return upid
+
+    def _upload_file(self, filename):
         url = self._url + '?mod=upload_file'
+        # The new upload may match cached search patterns.
+        self._search_cache.clear()
         with open(filename, 'rb') as f:
             variables = [
                 ('folder', '1'),
@@ -368,20 +951,130 @@ class FossologyAgent(object):
                 ('Check_agent_nomos', '1'),
                 ('Check_agent_pkgagent', '0'),
             ]
-            files = [('getfile', os.path.basename(filename), f.read())]
-            ct, data = encode_multipart_formdata(variables, files)
-            request = urllib.request.Request(url, data)
-            request.add_unredirected_header('Content-Type', ct)
-            request.add_unredirected_header('Content-Length', len(data))
-            response = self._opener.open(request)
-            doc = BeautifulSoup(response.read().decode('utf-8'))
-            expr = re.compile(r'^/\?mod=showjobs&upload=(\d+)')
-            for tag in doc.find_all('a'):
-                if tag.has_attr('href'):
-                    match = expr.match(tag['href'])
-                    if match:
-                        return int(match.group(1))
-            raise FossologyError(_('Upload failed'))
+            files = [('getfile', os.path.basename(filename), f)]
+            encoder = MultipartEncoder(variables, files)
+            request = urllib.request.Request(url, encoder)
+            request.add_unredirected_header('Content-Type',
+                                            encoder.content_type)
+            request.add_unredirected_header('Content-Length', len(encoder))
+            response = self._open(request)
+            return _parse_upload_reply(response.read())
+
+    def job_status(self, upid):
+        """Get the status of the analysis of an upload.
+
+        :param upid: the upload identifier.
+        :type upid: int
+
+        :returns: one of JOB_PENDING, JOB_RUNNING, JOB_COMPLETED or
+                  JOB_FAILED.
+        :rtype: str
+        """
+        self._check_session()
+        url = self._url + "?mod=showjobs&upload={0}".format(upid)
+        response = self._open(url)
+        return _parse_job_status(response.read())
+
+    def submit_many(self, filenames, jobs=4, wait_jobs=True,
+                    poll_interval=5.0, max_poll_interval=60.0, force=False,
+                    max_wait=3600.0):
+        """Submit several files to Fossology concurrently.
+
+        When waiting for the analyses, the status of each upload is polled,
+        first after *poll_interval* seconds, then twice as late each time,
+        up to *max_poll_interval* seconds. An analysis which is not finished
+        *max_wait* seconds after its upload is reported as failed, with a
+        timeout error.
+
+        :param filenames: paths to the files to submit.
+        :type filenames: iterable of str
+
+        :param jobs: maximum number of uploads running at the same time.
+        :type jobs: int
+
+        :param wait_jobs: if true, wait for the analyses to complete.
+        :type wait_jobs: bool
+
+        :param poll_interval: initial delay between polls, in seconds.
+        :type poll_interval: float
+
+        :param max_poll_interval: maximum delay between polls, in seconds.
+        :type max_poll_interval: float
+
+        :param force: if true, always upload the files, as :meth:`submit`
+                      would.
+        :type force: bool
+
+        :param max_wait: maximum time to wait for an analysis, in seconds,
+                         or None to wait until it is finished.
+        :type max_wait: float
+
+        :returns: the submissions, as soon as they are finished.
+        :rtype: iterator of :class:`grissom.legal.fossology.SubmissionResult`
+        """
+        self._check_session()
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+            uploads = dict((executor.submit(self.submit, fn, force), fn)
+                           for fn in filenames)
+            polls = []
+            while uploads or polls:
+                timeout = None
+                if polls:
+                    timeout = max(0, polls[0][0] - time.time())
+                if uploads:
+                    done = wait(uploads, timeout, FIRST_COMPLETED).done
+                else:
+                    time.sleep(timeout)
+                    done = []
+                for future in done:
+                    filename = uploads.pop(future)
+                    try:
+                        upid = future.result()
+                    except Exception as e:
+                        yield SubmissionResult(filename, None, JOB_FAILED, e)
+                        continue
+                    if wait_jobs:
+                        now = time.time()
+                        deadline = None
+                        if max_wait is not None:
+                            deadline = now + max_wait
+                        entry = (now + poll_interval, upid, filename,
+                                 poll_interval, deadline)
+                        heapq.heappush(polls, entry)
+                    else:
+                        yield SubmissionResult(filename,
+                                               upid,
+                                               JOB_PENDING,
+                                               None)
+                while polls and polls[0][0] <= time.time():
+                    when, upid, filename, interval, deadline = \
+                        heapq.heappop(polls)
+                    try:
+                        status = self.job_status(upid)
+                    except Exception as e:
+                        if not _is_transient_error(e):
+                            yield SubmissionResult(filename,
+                                                   upid,
+                                                   JOB_FAILED,
+                                                   e)
+                            continue
+                        status = JOB_RUNNING
+                    if status in (JOB_COMPLETED, JOB_FAILED):
+                        yield SubmissionResult(filename, upid, status, None)
+                        continue
+                    now = time.time()
+                    if deadline is not None and now >= deadline:
+                        e = FossologyError(_("Timed out waiting for the "
+                                             "analysis"))
+                        yield SubmissionResult(filename, upid, JOB_FAILED, e)
+                        continue
+                    interval = min(interval * 2, max_poll_interval)
+                    when = now + interval
+                    if deadline is not None:
+                        # Poll a last time when the time is up.
+                        when = min(when, deadline)
+                    entry = (when, upid, filename, interval, deadline)
+                    heapq.heappush(polls, entry)
 
     def generate_spdx(self, pkgname, author=None, comment=None):
         """Generate SPDX file for a package.
@@ -413,7 +1106,7 @@ class FossologyAgent(object):
         }
 
         data = urlencode(params).encode('utf-8')
-        response = self._opener.open(url, data)
+        response = self._open(url, data)
         contents = response.read().decode('utf-8')
         fmttype = 'tag' # Maybe 'rdf' one day?
         expr = r'window.location.href=\'spdx-output-module/spdx_main_output_{0}.php\?fileSuffix=(.+)\';'
@@ -422,7 +1115,7 @@ class FossologyAgent(object):
             raise FossologyError(_('Can not create SPDX file'))
         url = 'spdx-output-module/spdx_main_output_{0}.php?fileSuffix={1}'
         url = self._url + url.format(fmttype, match.group(1))
-        response = self._opener.open(url)
+        response = self._open(url)
         return response.read().decode('utf-8')
 
 # vim: ts=4 sts=4 sw=4 et ai
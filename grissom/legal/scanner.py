@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+#
+# grissom - FOSS compliance tools
+#
+# Copyright (c) 2013 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Local license detection
+"""
+
+import re
+from .. import profiling
+
+# Notices of well-known licenses, in lowercase, with punctuation and comment
+# markers reduced to single spaces.
+_LICENSE_NOTICES = (
+    ('GPL-2.0+',
+     r'gnu general public license as published by the free software '
+     r'foundation either version 2 of the license or at your option any '
+     r'later version'),
+    ('GPL-2.0',
+     r'gnu general public license version 2 as published by the free '
+     r'software foundation'),
+    ('GPL-3.0+',
+     r'gnu general public license as published by the free software '
+     r'foundation either version 3 of the license or at your option any '
+     r'later version'),
+    ('LGPL-2.0+',
+     r'gnu library general public license as published by the free '
+     r'software foundation either version 2 of the license or at your '
+     r'option any later version'),
+    ('LGPL-2.1+',
+     r'gnu lesser general public license as published by the free '
+     r'software foundation either version 2 1 of the license or at your '
+     r'option any later version'),
+    ('LGPL-3.0+',
+     r'gnu lesser general public license as published by the free '
+     r'software foundation either version 3 of the license or at your '
+     r'option any later version'),
+    ('Apache-2.0',
+     r'licensed under the apache license version 2 0'),
+    ('MPL-2.0',
+     r'subject to the terms of the mozilla public license v 2 0'),
+    ('MIT',
+     r'permission is hereby granted free of charge to any person obtaining '
+     r'a copy of this software and associated documentation files'),
+    ('ISC',
+     r'permission to use copy modify and or distribute this software for '
+     r'any purpose with or without fee is hereby granted'),
+    ('BSD-3-Clause',
+     r'neither the name of [a-z0-9 ]{1,120}? nor the names of its '
+     r'contributors may be used to endorse or promote products derived '
+     r'from this software'),
+    ('BSD-2-Clause',
+     r'redistribution and use in source and binary forms with or without '
+     r'modification are permitted provided that'),
+    ('Zlib',
+     r'in no event will the authors be held liable for any damages arising '
+     r'from the use of this software'),
+    ('Public-domain',
+     r'(?:placed|released|is) in(?:to)? the public domain'),
+)
+
+# A license also matching the notice of another one replaces it.
+_SUPERSEDED = {
+    'BSD-2-Clause': 'BSD-3-Clause',
+}
+
+_NOTICES_EXPR = re.compile(b'|'.join(
+    '(?P<n{0}>{1})'.format(i, n[1]).encode('ascii')
+    for i, n in enumerate(_LICENSE_NOTICES)))
+
+# Words of which at least one is in every notice, before normalization.
+_KEYWORDS = (b'license', b'permission', b'redistribution', b'liable',
+             b'domain')
+
+# Parts of which at least one is in every notice, once normalized, and the
+# maximum distance between the start of a notice and such part.
+_ANCHORS = (
+    b'general public license', b'apache license', b'mozilla public license',
+    b'permission is hereby granted', b'permission to use copy',
+    b'nor the names of its contributors', b'redistribution and use',
+    b'held liable', b'public domain'
+)
+_ANCHOR_DISTANCE = 256
+
+_SPDX_EXPR = re.compile(
+    br'SPDX-License-Identifier:[ \t]*([A-Za-z0-9(][A-Za-z0-9.:+() \t-]*)')
+
+_COPYRIGHT_EXPR = re.compile(
+    br'(?:Copyright|COPYRIGHT)[ \t]+(?:\([cC]\)|\xc2\xa9|[0-9]{4})[^\r\n]*')
+
+_NORMALIZE_EXPR = re.compile(br'[^a-z0-9]+')
+
+_OPERATOR_EXPR = re.compile(r'(?:^|[\s()])(?:AND|OR|WITH)(?:$|[\s()])',
+                            re.IGNORECASE)
+
+# Identifiers stop before the characters they can not hold, leaving the
+# dashes of '-->' and '-}' behind.
+_COMMENT_END_EXPR = re.compile(br'[\s-]*(?:(?:\*/|-->|\*\)|-})\s*)?$')
+
+# Longest notice, once normalized, plus some slack for comment markers.
+_OVERLAP = 1024
+
+def _find_notices(data):
+    data = data.lower()
+    if not any(w in data for w in _KEYWORDS):
+        return
+    text = _NORMALIZE_EXPR.sub(b' ', data)
+    positions = [p for p in (text.find(a) for a in _ANCHORS) if p >= 0]
+    if not positions:
+        return
+    start = max(0, min(positions) - _ANCHOR_DISTANCE)
+    for m in _NOTICES_EXPR.finditer(text, start):
+        yield _LICENSE_NOTICES[m.lastindex - 1][0]
+
+def _is_enclosed(expression):
+    if not expression.startswith('('):
+        return False
+    depth = 0
+    for i, char in enumerate(expression):
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+            if depth == 0:
+                return i == len(expression) - 1
+    return False
+
+def _join_expressions(expressions):
+    # AND takes precedence over OR, so compound expressions are enclosed in
+    # parentheses to keep their meaning.
+    if len(expressions) > 1:
+        expressions = ['({0})'.format(e)
+                       if _OPERATOR_EXPR.search(e) and not _is_enclosed(e)
+                       else e
+                       for e in expressions]
+    unique = []
+    for e in expressions:
+        if e not in unique:
+            unique.append(e)
+    return ' AND '.join(unique)
+
+class LicenseScanner(object):
+    """Detect licenses of files locally.
+
+    SPDX license identifiers and the notices of well-known licenses are
+    looked for in a single pass over the contents of the file, which is read
+    by chunks. When nothing is found, the result is inconclusive and the
+    file should be analyzed by other means (Fossology, for example).
+
+    :param max_size: maximum number of bytes to read from a file, or None to
+                     read all of it.
+    :type max_size: int
+
+    :param chunk_size: number of bytes read at once.
+    :type chunk_size: int
+    """
+    def __init__(self, max_size=None, chunk_size=65536):
+        self._max_size = max_size
+        self._chunk_size = max(chunk_size, 2 * _OVERLAP)
+
+    def scan(self, filename):
+        """Detect the licenses of a file.
+
+        :param filename: path to the file to scan.
+        :type filename: str
+
+        :returns: legal information, as returned by
+                  :meth:`grissom.legal.fossology.FossologyAgent.analyze`,
+                  or None if inconclusive.
+        :rtype: a mapping between strings.
+        """
+        with open(filename, 'rb') as f:
+            return self.scan_stream(f)
+
+    @profiling.timed('scanner.scan')
+    def scan_stream(self, stream):
+        """Detect the licenses of the contents of a stream.
+
+        :param stream: binary file-like object to scan.
+        :type stream: file-like object
+
+        :returns: legal information or None if inconclusive.
+        :rtype: a mapping between strings.
+        """
+        identifiers = []
+        licenses = set()
+        copyrights = []
+        tail = b''
+        base = 0
+        scanned = {_SPDX_EXPR: 0, _COPYRIGHT_EXPR: 0}
+        remaining = self._max_size
+        while True:
+            size = self._chunk_size
+            if remaining is not None:
+                size = min(size, remaining)
+                remaining -= size
+            chunk = stream.read(size) if size > 0 else b''
+            data = tail + chunk
+            for expr, values in ((_SPDX_EXPR, identifiers),
+                                 (_COPYRIGHT_EXPR, copyrights)):
+                for m in expr.finditer(data):
+                    # Matches in the overlap with the previous chunk have
+                    # already been handled, and the one at the end may be
+                    # truncated.
+                    if base + m.start() < scanned[expr]:
+                        continue
+                    if chunk and m.end() == len(data):
+                        break
+                    scanned[expr] = base + m.end()
+                    value = m.group(m.lastindex or 0)
+                    value = _COMMENT_END_EXPR.sub(b'', value)
+                    value = value.decode('utf-8', 'replace')
+                    if value and value not in values:
+                        values.append(value)
+            if not chunk:
+                break
+            if not identifiers:
+                licenses.update(_find_notices(data))
+            tail = data[-_OVERLAP:]
+            base += len(data) - len(tail)
+
+        if identifiers:
+            license = _join_expressions(identifiers)
+        elif licenses:
+            for old, new in _SUPERSEDED.items():
+                if new in licenses:
+                    licenses.discard(old)
+            license = ' '.join(sorted(licenses))
+        else:
+            return None
+
+        info = {'License': license}
+        if copyrights:
+            info['Copyright'] = '; '.join(copyrights)
+        return info
+
+# vim: ts=4 sts=4 sw=4 et ai
@@ -0,0 +1,427 @@
+# -*- coding: utf-8 -*-
+#
+# grissom - FOSS compliance tools
+#
+# Copyright (c) 2013 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Local generation of SPDX documents
+"""
+
+import os
+import re
+import json
+import uuid
+import shutil
+import hashlib
+import tempfile
+from datetime import datetime, timezone
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from .. import __version__
+
+SpdxFile = namedtuple('SpdxFile',
+                      ['name', 'checksum', 'licenses', 'copyright'])
+
+SPDX_VERSION = 'SPDX-2.2'
+
+NOASSERTION = 'NOASSERTION'
+
+_LICENSE_TOKEN_EXPR = re.compile(r'[^\s()]+')
+_LICENSE_OPERATORS = ('AND', 'OR', 'WITH')
+_NO_LICENSES = ('No_license_found', 'NONE')
+_LICENSE_REF_PREFIX = 'LicenseRef-'
+_EXTRACTED_COMMENT = 'Only the name of the license is known.'
+
+# Identifiers of the SPDX License List, limited to the licenses commonly
+# found in root file systems and source trees, deprecated ones included.
+# Any other license is written as a LicenseRef, which is always valid.
+_LICENSE_LIST = (
+    '0BSD', 'AAL', 'AFL-1.1', 'AFL-1.2', 'AFL-2.0', 'AFL-2.1', 'AFL-3.0',
+    'AGPL-1.0', 'AGPL-1.0-only', 'AGPL-1.0-or-later', 'AGPL-3.0',
+    'AGPL-3.0-only', 'AGPL-3.0-or-later', 'Apache-1.0', 'Apache-1.1',
+    'Apache-2.0', 'APSL-1.0', 'APSL-1.1', 'APSL-1.2', 'APSL-2.0',
+    'Artistic-1.0', 'Artistic-1.0-cl8', 'Artistic-1.0-Perl', 'Artistic-2.0',
+    'Beerware', 'BlueOak-1.0.0', 'BSD-1-Clause', 'BSD-2-Clause',
+    'BSD-2-Clause-FreeBSD', 'BSD-2-Clause-NetBSD', 'BSD-2-Clause-Patent',
+    'BSD-2-Clause-Views', 'BSD-3-Clause', 'BSD-3-Clause-Attribution',
+    'BSD-3-Clause-Clear', 'BSD-3-Clause-LBNL', 'BSD-4-Clause',
+    'BSD-4-Clause-UC', 'BSD-Protection', 'BSD-Source-Code', 'BSL-1.0',
+    'bzip2-1.0.5', 'bzip2-1.0.6', 'CC-BY-1.0', 'CC-BY-2.0', 'CC-BY-2.5',
+    'CC-BY-3.0', 'CC-BY-4.0', 'CC-BY-SA-1.0', 'CC-BY-SA-2.0',
+    'CC-BY-SA-2.5', 'CC-BY-SA-3.0', 'CC-BY-SA-4.0', 'CC0-1.0', 'CDDL-1.0',
+    'CDDL-1.1', 'CECILL-2.0', 'CECILL-2.1', 'CECILL-B', 'CECILL-C',
+    'ClArtistic', 'CPL-1.0', 'curl', 'ECL-2.0', 'eCos-2.0', 'EFL-2.0',
+    'EPL-1.0', 'EPL-2.0', 'EUPL-1.1', 'EUPL-1.2', 'FSFAP', 'FSFUL',
+    'FSFULLR', 'FTL', 'GFDL-1.1', 'GFDL-1.1-only', 'GFDL-1.1-or-later',
+    'GFDL-1.2', 'GFDL-1.2-only', 'GFDL-1.2-or-later', 'GFDL-1.3',
+    'GFDL-1.3-only', 'GFDL-1.3-or-later', 'GPL-1.0', 'GPL-1.0+',
+    'GPL-1.0-only', 'GPL-1.0-or-later', 'GPL-2.0', 'GPL-2.0+',
+    'GPL-2.0-only', 'GPL-2.0-or-later', 'GPL-3.0', 'GPL-3.0+',
+    'GPL-3.0-only', 'GPL-3.0-or-later', 'HPND', 'ICU', 'IJG', 'Imlib2',
+    'Info-ZIP', 'IPL-1.0', 'ISC', 'JSON', 'LGPL-2.0', 'LGPL-2.0+',
+    'LGPL-2.0-only', 'LGPL-2.0-or-later', 'LGPL-2.1', 'LGPL-2.1+',
+    'LGPL-2.1-only', 'LGPL-2.1-or-later', 'LGPL-3.0', 'LGPL-3.0+',
+    'LGPL-3.0-only', 'LGPL-3.0-or-later', 'libpng-2.0', 'Libpng',
+    'libtiff', 'LPPL-1.3c', 'MirOS', 'MIT', 'MIT-0', 'MIT-advertising',
+    'MIT-CMU', 'MIT-enna', 'MIT-feh', 'MITNFA', 'MPL-1.0', 'MPL-1.1',
+    'MPL-2.0', 'MPL-2.0-no-copyleft-exception', 'MS-PL', 'MS-RL', 'NCSA',
+    'Net-SNMP', 'NPL-1.0', 'NPL-1.1', 'NTP', 'OFL-1.0', 'OFL-1.1',
+    'OLDAP-2.8', 'OpenSSL', 'OSL-1.0', 'OSL-2.0', 'OSL-2.1', 'OSL-3.0',
+    'PHP-3.0', 'PHP-3.01', 'PostgreSQL', 'PSF-2.0', 'Python-2.0', 'QPL-1.0',
+    'Ruby', 'Sendmail', 'SGI-B-2.0', 'Sleepycat', 'SMLNJ', 'SPL-1.0',
+    'TCL', 'Unicode-DFS-2015', 'Unicode-DFS-2016', 'Unlicense', 'UPL-1.0',
+    'Vim', 'W3C', 'W3C-20150513', 'WTFPL', 'wxWindows', 'X11',
+    'XFree86-1.1', 'xinetd', 'Xnet', 'Zend-2.0', 'Zlib',
+    'zlib-acknowledgement', 'ZPL-1.1', 'ZPL-2.0', 'ZPL-2.1',
+)
+
+# Identifiers are matched regardless of case.
+_LICENSE_IDS = dict((i.lower(), i) for i in _LICENSE_LIST)
+
+# Files are written to a temporary file until the document header can be
+# written. It stays in memory up to this size.
+_SPOOL_SIZE = 4 * 1024 * 1024
+
+def _to_license_id(token):
+    if token in _NO_LICENSES:
+        return 'NONE'
+    license_id = _LICENSE_IDS.get(token.lower())
+    if license_id is None and token.endswith('+'):
+        # The "or later" operator of license expressions.
+        license_id = _LICENSE_IDS.get(token[:-1].lower())
+        if license_id is not None:
+            license_id += '+'
+    if license_id is not None:
+        return license_id
+    if token.startswith(_LICENSE_REF_PREFIX):
+        token = token[len(_LICENSE_REF_PREFIX):]
+    return _LICENSE_REF_PREFIX + re.sub(r'[^A-Za-z0-9.-]', '-', token)
+
+def _to_license_ids(text):
+    ids = []
+    exception = False
+    for token in _LICENSE_TOKEN_EXPR.findall(text or ''):
+        if token in _LICENSE_OPERATORS:
+            exception = token == 'WITH'
+            continue
+        if exception:
+            # Exceptions are not licenses of their own.
+            exception = False
+            continue
+        license_id = _to_license_id(token)
+        if license_id not in ids:
+            ids.append(license_id)
+    return ids
+
+def _get_extracted_licenses(licenses):
+    # Licenses which are not in the SPDX License List must be described in
+    # the document.
+    extracted = []
+    for license_id in sorted(licenses):
+        if license_id.startswith(_LICENSE_REF_PREFIX):
+            name = license_id[len(_LICENSE_REF_PREFIX):]
+            extracted.append((license_id, name))
+    return extracted
+
+def _to_text(value):
+    if not value:
+        return NOASSERTION
+    return '<text>{0}</text>'.format(value)
+
+def _iter_tree(root):
+    with os.scandir(root) as it:
+        entries = sorted(it, key=lambda e: e.name)
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            yield from _iter_tree(entry.path)
+        elif entry.is_file(follow_symlinks=False):
+            yield entry.path
+
+class SpdxDocumentBuilder(object):
+    """Build SPDX documents for source trees, without Fossology.
+
+    The checksums of the files are computed concurrently, and their licenses
+    are taken from the results of previous analyses if known, or detected
+    locally otherwise. The documents are written as the files are processed,
+    so only the checksums of the files are kept in memory.
+
+    :param license_cache: cache for analysis results or None.
+    :type license_cache: :class:`grissom.legal.cache.LicenseCache`
+
+    :param scanner: local license scanner or None.
+    :type scanner: :class:`grissom.legal.scanner.LicenseScanner`
+
+    :param jobs: maximum number of files processed at the same time.
+    :type jobs: int
+
+    :param chunk_size: number of bytes read at once when hashing.
+    :type chunk_size: int
+    """
+    def __init__(self, license_cache=None, scanner=None, jobs=4,
+                 chunk_size=65536):
+        self._license_cache = license_cache
+        self._scanner = scanner
+        self._jobs = max(1, jobs)
+        self._chunk_size = chunk_size
+
+    def _inspect_file(self, root, path):
+        h = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(self._chunk_size), b''):
+                h.update(chunk)
+        digest = h.hexdigest()
+
+        info = None
+        if self._license_cache:
+            info = self._license_cache.get(digest, 'nomos')
+        if info is None and self._scanner:
+            info = self._scanner.scan(path)
+        info = info or {}
+
+        name = os.path.relpath(path, root).replace(os.sep, '/')
+        return SpdxFile('./' + name,
+                        digest,
+                        _to_license_ids(info.get('License')),
+                        info.get('Copyright'))
+
+    def iter_files(self, root):
+        """Inspect the files of a source tree.
+
+        :param root: path to the top directory of the tree.
+        :type root: str
+
+        :returns: the files, sorted by name.
+        :rtype: iterator of :class:`grissom.legal.spdx.SpdxFile`
+        """
+        with ThreadPoolExecutor(max_workers=self._jobs) as executor:
+            pending = []
+            try:
+                for path in _iter_tree(root):
+                    future = executor.submit(self._inspect_file, root, path)
+                    pending.append(future)
+                    # Keep a bounded window of files in flight.
+                    if len(pending) >= 4 * self._jobs:
+                        yield pending.pop(0).result()
+                while pending:
+                    yield pending.pop(0).result()
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def _make_header(self, name, author, comment):
+        creators = ['Tool: grissom-{0}'.format(__version__)]
+        if author:
+            creators.append('Person: {0}'.format(author))
+        created = datetime.now(timezone.utc)
+        return {
+            'name': name,
+            'namespace': 'http://spdx.org/spdxdocs/{0}-{1}'.format(
+                re.sub(r'[^A-Za-z0-9.-]', '-', name), uuid.uuid4()),
+            'creators': creators,
+            'created': created.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'comment': comment,
+        }
+
+    def write(self, root, stream, name=None, author=None, comment=None,
+              fmt='tag'):
+        """Write the SPDX document of a source tree.
+
+        :param root: path to the top directory of the tree.
+        :type root: str
+
+        :param stream: text stream to write the document to.
+        :type stream: file-like object
+
+        :param name: name of the package or None to use the name of the
+                     directory.
+        :type name: str
+
+        :param author: name of the author or None.
+        :type author: str
+
+        :param comment: a comment to add in the document or None.
+        :type comment: str
+
+        :param fmt: format of the document, either 'tag' or 'json'.
+        :type fmt: str
+
+        :returns: the number of files in the document.
+        :rtype: int
+        """
+        name = name or os.path.basename(os.path.abspath(root))
+        header = self._make_header(name, author, comment)
+        if fmt == 'json':
+            return self._write_json(root, stream, header)
+        elif fmt == 'tag':
+            return self._write_tag_value(root, stream, header)
+        raise ValueError("Unsupported format '{0}'".format(fmt))
+
+    def _write_tag_value(self, root, stream, header):
+        # The package information, which depends on all the files, comes
+        # first.
+        checksums = []
+        licenses = set()
+        with tempfile.SpooledTemporaryFile(_SPOOL_SIZE, 'w+') as spool:
+            for i, f in enumerate(self.iter_files(root), 1):
+                spdxid = 'SPDXRef-File-{0}'.format(i)
+                lines = [
+                    '',
+                    'FileName: {0}'.format(f.name),
+                    'SPDXID: {0}'.format(spdxid),
+                    'FileChecksum: SHA1: {0}'.format(f.checksum),
+                    'LicenseConcluded: {0}'.format(NOASSERTION),
+                ]
+                for l in f.licenses or [NOASSERTION]:
+                    lines.append('LicenseInfoInFile: {0}'.format(l))
+                lines.append('FileCopyrightText: {0}'.format(
+                    _to_text(f.copyright)))
+                lines.append('Relationship: SPDXRef-Package CONTAINS '
+                             '{0}'.format(spdxid))
+                spool.write('\n'.join(lines) + '\n')
+                checksums.append(bytes.fromhex(f.checksum))
+                licenses.update(f.licenses)
+
+            lines = [
+                'SPDXVersion: {0}'.format(SPDX_VERSION),
+                'DataLicense: CC0-1.0',
+                'SPDXID: SPDXRef-DOCUMENT',
+                'DocumentName: {0}'.format(header['name']),
+                'DocumentNamespace: {0}'.format(header['namespace']),
+            ]
+            for creator in header['creators']:
+                lines.append('Creator: {0}'.format(creator))
+            lines.append('Created: {0}'.format(header['created']))
+            if header['comment']:
+                lines.append('DocumentComment: {0}'.format(
+                    _to_text(header['comment'])))
+            lines += [
+                '',
+                'PackageName: {0}'.format(header['name']),
+                'SPDXID: SPDXRef-Package',
+                'PackageDownloadLocation: {0}'.format(NOASSERTION),
+                'FilesAnalyzed: true',
+                'PackageVerificationCode: {0}'.format(
+                    self._compute_verification_code(checksums)),
+                'PackageLicenseConcluded: {0}'.format(NOASSERTION),
+            ]
+            for l in sorted(licenses) or [NOASSERTION]:
+                lines.append('PackageLicenseInfoFromFiles: {0}'.format(l))
+            lines += [
+                'PackageLicenseDeclared: {0}'.format(NOASSERTION),
+                'PackageCopyrightText: {0}'.format(NOASSERTION),
+                'Relationship: SPDXRef-DOCUMENT DESCRIBES SPDXRef-Package',
+            ]
+            stream.write('\n'.join(lines) + '\n')
+            spool.seek(0)
+            shutil.copyfileobj(spool, stream)
+
+        lines = []
+        for license_id, name in _get_extracted_licenses(licenses):
+            lines += [
+                '',
+                'LicenseID: {0}'.format(license_id),
+                'ExtractedText: {0}'.format(_to_text(name)),
+                'LicenseName: {0}'.format(name),
+                'LicenseComment: {0}'.format(_to_text(_EXTRACTED_COMMENT)),
+            ]
+        if lines:
+            stream.write('\n'.join(lines) + '\n')
+        return len(checksums)
+
+    def _write_json(self, root, stream, header):
+        # The members of an object are not ordered: the files come first, so
+        # that they can be written as they are processed.
+        checksums = []
+        licenses = set()
+        creation = {'created': header['created'],
+                    'creators': header['creators']}
+        if header['comment']:
+            creation['comment'] = header['comment']
+        stream.write('{\n')
+        for key, value in (('spdxVersion', SPDX_VERSION),
+                           ('dataLicense', 'CC0-1.0'),
+                           ('SPDXID', 'SPDXRef-DOCUMENT'),
+                           ('name', header['name']),
+                           ('documentNamespace', header['namespace']),
+                           ('creationInfo', creation),
+                           ('documentDescribes', ['SPDXRef-Package'])):
+            stream.write('  {0}: {1},\n'.format(json.dumps(key),
+                                                json.dumps(value)))
+        stream.write('  "files": [')
+        for i, f in enumerate(self.iter_files(root), 1):
+            entry = {
+                'fileName': f.name,
+                'SPDXID': 'SPDXRef-File-{0}'.format(i),
+                'checksums': [{'algorithm': 'SHA1',
+                               'checksumValue': f.checksum}],
+                'licenseConcluded': NOASSERTION,
+                'licenseInfoInFiles': f.licenses or [NOASSERTION],
+                'copyrightText': f.copyright or NOASSERTION,
+            }
+            if i > 1:
+                stream.write(',')
+            stream.write('\n    ' + json.dumps(entry))
+            checksums.append(bytes.fromhex(f.checksum))
+            licenses.update(f.licenses)
+        stream.write('\n  ],\n')
+
+        package = {
+            'name': header['name'],
+            'SPDXID': 'SPDXRef-Package',
+            'downloadLocation': NOASSERTION,
+            'filesAnalyzed': True,
+            'packageVerificationCode': {
+                'packageVerificationCodeValue':
+                    self._compute_verification_code(checksums),
+            },
+            'licenseConcluded': NOASSERTION,
+            'licenseInfoFromFiles': sorted(licenses) or [NOASSERTION],
+            'licenseDeclared': NOASSERTION,
+            'copyrightText': NOASSERTION,
+        }
+        stream.write('  "packages": [\n    {0}\n  ],\n'.format(
+            json.dumps(package)))
+        extracted = [{'licenseId': license_id,
+                      'extractedText': name,
+                      'name': name,
+                      'comment': _EXTRACTED_COMMENT}
+                     for license_id, name
+                     in _get_extracted_licenses(licenses)]
+        if extracted:
+            stream.write('  "hasExtractedLicensingInfos": [')
+            stream.write(','.join('\n    ' + json.dumps(e)
+                                  for e in extracted))
+            stream.write('\n  ],\n')
+        stream.write('  "relationships": [')
+        relationship = {'spdxElementId': 'SPDXRef-Package',
+                        'relationshipType': 'CONTAINS'}
+        for i in range(1, len(checksums) + 1):
+            relationship['relatedSpdxElement'] = 'SPDXRef-File-{0}'.format(i)
+            if i > 1:
+                stream.write(',')
+            stream.write('\n    ' + json.dumps(relationship))
+        stream.write('\n  ]\n}\n')
+        return len(checksums)
+
+    def _compute_verification_code(self, checksums):
+        h = hashlib.sha1()
+        for checksum in sorted(checksums):
+            h.update(checksum.hex().encode('ascii'))
+        return h.hexdigest()
+
+# vim: ts=4 sts=4 sw=4 et ai
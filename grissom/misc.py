@@ -25,21 +25,38 @@ Miscellaneous functions/classes
 import sys
 import os
 import hashlib
-import subprocess
 import tempfile
+from collections import deque
+from concurrent.futures import wait
 from gettext import gettext as _
-from .common import NoMatchError
+from . import profiling
+from .common import NoMatchError, CommandExecutor
+from .binfmt.elf import read_elf_layout
 
 class SourceCodeFinder(object):
     """Find the source code a binary executable file originated from.
 
+    The files to identify can be held by a virtual file system, such as a
+    file system image, while the source code is searched on the host.
+
     :param verbose: if True, be more verbose.
     :type verbose: bool
+
+    :param fs: file system holding the files to identify, or None to use
+               the files of the host.
+    :type fs: :class:`grissom.vfs.FileSystem`
+
+    :param executor: executor of the command discarding symbols, or None to
+                     run one command at a time.
+    :type executor: :class:`grissom.common.CommandExecutor`
     """
-    def __init__(self, verbose=False):
+    def __init__(self, verbose=False, fs=None, executor=None):
+        self._fs = fs
+        self._executor = executor or CommandExecutor(1)
         self._search_paths = []
         self._strip_args = ['strip']
         self._verbose = verbose
+        self._n_strips_avoided = 0
 
     def _set_strip_cmd(self, value):
         self._strip_args = value.split()
@@ -52,6 +69,11 @@ class SourceCodeFinder(object):
                              None,
                              'command for discarding symbols')
 
+    @property
+    def n_strips_avoided(self):
+        """Number of candidates discarded without invoking strip."""
+        return self._n_strips_avoided
+
     def add_search_path(self, path):
         """Add new a search path for source code.
 
@@ -60,20 +82,58 @@ class SourceCodeFinder(object):
         """
         self._search_paths.append(path)
 
-    def _check_file_match(self, filename, reference):
-        newname = 'grissom-origin-' + os.path.basename(filename)
-        tmpname = os.path.join(tempfile.gettempdir(), newname)
-        args = [a for a in self._strip_args]
-        args.append(filename)
-        args.append('-o')
-        args.append(tmpname)
-
-        try:
-            msg = subprocess.check_output(args,
-                                          stderr=subprocess.STDOUT)
-        except subprocess.CalledProcessError:
+    def _has_default_strip(self):
+        # Only the strip command of binutils, with no options, is known to
+        # keep the allocated sections and the loadable segments. Others,
+        # such as sstrip, drop the section headers or trim the segments.
+        if len(self._strip_args) != 1:
+            return False
+        name = os.path.basename(self._strip_args[0])
+        return name == 'strip' or name.endswith('-strip')
+
+    def _check_file_layout(self, filename, ref_size, ref_layout, exact):
+        # Stripping only removes data, so a smaller file can not match.
+        if exact and os.path.getsize(filename) < ref_size:
             return False
+        if ref_layout is None:
+            return True
+        layout = read_elf_layout(filename)
+        if layout is None:
+            return False
+        # Without section headers, the reference was not stripped by the
+        # default command.
+        if exact and ref_layout.sections:
+            return layout == ref_layout
+        return layout[:4] == ref_layout[:4]
+
+    def _report_mismatch(self, candidate):
+        if self._verbose:
+            e =_("File does not match: {0}")
+            print(e.format(candidate), file=sys.stderr)
+
+    def _iter_candidates(self, filename, ref_size, ref_layout):
+        exact = self._has_default_strip()
+        for path in self._search_paths:
+            for dirpath, dirnames, filenames in os.walk(path):
+                for fn in filenames:
+                    if fn != filename:
+                        continue
+                    candidate = os.path.join(dirpath, fn)
+                    if not self._check_file_layout(candidate,
+                                                   ref_size,
+                                                   ref_layout,
+                                                   exact):
+                        self._n_strips_avoided += 1
+                        profiling.count('origin.strips_avoided')
+                        self._report_mismatch(candidate)
+                        continue
+                    yield candidate
 
+    @profiling.timed('origin.check')
+    def _check_file_match(self, future, tmpname, reference):
+        result = future.result()
+        if result.returncode != 0 or not os.path.exists(tmpname):
+            return False
         with open(tmpname, 'rb') as f:
             if hashlib.sha1(f.read()).hexdigest() == reference:
                 matched = True
@@ -85,29 +145,55 @@ class SourceCodeFinder(object):
     def find_origin_of(self, filename):
         """Find the path to the source code of a file.
 
+        The candidates are stripped concurrently, up to the number of
+        workers of the executor, and checked in the order they are found.
+
         :param filename: path to file to identify.
         :type filename: str
 
         :returns: the path to the source code directory.
         :rtype: str
         """
-        reference = None
-        with open(filename, 'rb') as f:
-            reference = hashlib.sha1(f.read()).hexdigest()
+        if self._fs:
+            data = self._fs.read(filename)
+        else:
+            with open(filename, 'rb') as f:
+                data = f.read()
+        reference = hashlib.sha1(data).hexdigest()
+        ref_size = len(data)
+        ref_layout = read_elf_layout(filename, self._fs)
 
         filename = os.path.basename(filename)
 
-        for path in self._search_paths:
-            for dirpath, dirnames, filenames in os.walk(path):
-                for fn in filenames:
-                    if fn != filename:
-                        continue
-                    candidate = os.path.join(dirpath, fn)
-                    if self._check_file_match(candidate, reference):
-                        return dirpath
-                    elif self._verbose:
-                        e =_("File does not match: {0}")
-                        print(e.format(candidate), file=sys.stderr)
+        pending = deque()
+        with tempfile.TemporaryDirectory(prefix='grissom-origin-') as tmpdir:
+            try:
+                candidates = self._iter_candidates(filename,
+                                                   ref_size,
+                                                   ref_layout)
+                candidates = profiling.iter_timed('origin.candidates',
+                                                  candidates)
+                for i, candidate in enumerate(candidates):
+                    tmpname = os.path.join(tmpdir, str(i))
+                    args = self._strip_args + [candidate, '-o', tmpname]
+                    future = self._executor.submit(args)
+                    pending.append((candidate, tmpname, future))
+                    # Keep a bounded window of strips in flight.
+                    while len(pending) >= self._executor.max_workers:
+                        candidate, tmpname, future = pending.popleft()
+                        if self._check_file_match(future, tmpname, reference):
+                            return os.path.dirname(candidate)
+                        self._report_mismatch(candidate)
+                while pending:
+                    candidate, tmpname, future = pending.popleft()
+                    if self._check_file_match(future, tmpname, reference):
+                        return os.path.dirname(candidate)
+                    self._report_mismatch(candidate)
+            finally:
+                # The strips still running write to the directory.
+                for candidate, tmpname, future in pending:
+                    future.cancel()
+                wait([future for c, t, future in pending])
 
         raise NoMatchError
 
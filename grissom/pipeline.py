@@ -0,0 +1,443 @@
+# -*- coding: utf-8 -*-
+#
+# grissom - FOSS compliance tools
+#
+# Copyright (c) 2013 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Streaming audit of the binary executable files of an image
+"""
+
+import os
+import queue
+import threading
+from collections import namedtuple
+from . import profiling
+from .common import CommandExecutor, NoMatchError
+from .binfmt.core import BinfmtFinder, is_binfmt_file
+from .binfmt.elf import ElfInspector
+from .extractors.recursive import RecursiveExtractor, NESTED_SUFFIX
+from .misc import SourceCodeFinder
+from .vfs import ImageFileSystem
+from .extractors import create_extractor
+
+# Names of the stages of an audit, in order.
+AUDIT_STAGES = ('extract', 'scan', 'deps', 'origin', 'license')
+
+AuditResult = namedtuple('AuditResult',
+                         ['filename', 'dependencies', 'origin', 'package',
+                          'license', 'error'])
+
+# Marker of the end of the items, passed from stage to stage.
+_DONE = object()
+
+# Delay between two checks of the cancellation of a blocked worker.
+_POLL_INTERVAL = 0.1
+
+class Pipeline(object):
+    """Process items through a chain of stages running concurrently.
+
+    Each stage has its own workers, taking the items from a bounded queue
+    filled by the previous stage, so an item is processed by a stage as soon
+    as it leaves the previous one. When a stage is slower than the previous
+    one, its queue fills up and the previous stage waits: the number of
+    items in flight, hence the memory used, is bounded.
+
+    :param queue_size: maximum number of items waiting between two stages.
+    :type queue_size: int
+    """
+    def __init__(self, queue_size=64):
+        self._queue_size = max(1, queue_size)
+        self._stages = []
+
+    def add_stage(self, func, jobs=1, name=None):
+        """Add a stage at the end of the pipeline.
+
+        When profiling, the time spent by the workers of a named stage on
+        the items is measured by the 'stage.NAME' timer, and the time spent
+        waiting for the next stage to take them by the 'stage.NAME.wait'
+        timer.
+
+        :param func: callable processing an item, returning the item to pass
+                     to the next stage, or None to drop it.
+        :type func: callable
+
+        :param jobs: number of workers of the stage.
+        :type jobs: int
+
+        :param name: name of the stage or None.
+        :type name: str
+        """
+        name = name or str(len(self._stages))
+        self._stages.append((func, max(1, jobs), name))
+
+    def process(self, items):
+        """Process items through the stages.
+
+        If a stage raises an exception, the pipeline is stopped and the
+        exception is raised again once the workers are done.
+
+        :param items: the items to process.
+        :type items: iterable
+
+        :returns: the items leaving the last stage, in the order they are
+                  completed.
+        :rtype: iterator
+        """
+        queues = [queue.Queue(self._queue_size)
+                  for i in range(len(self._stages) + 1)]
+        stop = threading.Event()
+        errors = []
+
+        def put(q, item):
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=_POLL_INTERVAL)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def get(q):
+            while not stop.is_set():
+                try:
+                    return q.get(timeout=_POLL_INTERVAL)
+                except queue.Empty:
+                    pass
+            return _DONE
+
+        def fail(error):
+            errors.append(error)
+            stop.set()
+
+        def feed():
+            iterator = iter(items)
+            try:
+                for item in iterator:
+                    if not put(queues[0], item):
+                        break
+            except Exception as error:
+                fail(error)
+            finally:
+                if hasattr(iterator, 'close'):
+                    iterator.close()
+                put(queues[0], _DONE)
+
+        def work(func, name, q_in, q_out, running, lock):
+            while True:
+                item = get(q_in)
+                if item is _DONE:
+                    # Let the other workers of the stage see the end too.
+                    put(q_in, _DONE)
+                    with lock:
+                        running[0] -= 1
+                        last = running[0] == 0
+                    if last:
+                        put(q_out, _DONE)
+                    return
+                try:
+                    with profiling.timer('stage.' + name):
+                        item = func(item)
+                except Exception as error:
+                    fail(error)
+                    continue
+                if item is not None:
+                    with profiling.timer('stage.' + name + '.wait'):
+                        put(q_out, item)
+
+        threads = [threading.Thread(target=feed)]
+        for i, (func, jobs, name) in enumerate(self._stages):
+            running = [jobs]
+            lock = threading.Lock()
+            for j in range(jobs):
+                thread = threading.Thread(target=work,
+                                          args=(func,
+                                                name,
+                                                queues[i],
+                                                queues[i + 1],
+                                                running,
+                                                lock))
+                threads.append(thread)
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        try:
+            while True:
+                item = get(queues[-1])
+                if item is _DONE:
+                    break
+                yield item
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+        if errors:
+            raise errors[0]
+
+class Auditor(object):
+    """Audit the binary executable files held by a directory or an image.
+
+    The files flow through the stages of a :class:`Pipeline`:
+
+    - extract: the files are taken from the directory, from the image read
+      without being extracted, or from the images extracted recursively,
+      as soon as each image is extracted.
+    - scan: the binary executable files are identified.
+    - deps: the shared libraries they depend on are read.
+    - origin: the source code they originated from is searched, if search
+      paths were added.
+    - license: their license is looked up, if a scanner or an agent was
+      given. The scanner looks for notices in the files themselves. The
+      agent is queried for the major license of the package holding their
+      source code, that is the top directory of the source code within the
+      search path.
+
+    :param include_libs: if true, also audit shared libraries.
+    :type include_libs: bool
+
+    :param include_kmods: if true, also audit kernel modules.
+    :type include_kmods: bool
+
+    :param scanner: local license scanner or None.
+    :type scanner: :class:`grissom.legal.scanner.LicenseScanner`
+
+    :param agent: agent of a Fossology server, logged in, or None.
+    :type agent: :class:`grissom.legal.fossology.FossologyAgent`
+
+    :param jobs: number of workers of each stage, by name of stage, as
+                 listed in ``AUDIT_STAGES``. A stage not listed has one
+                 worker. The workers of the 'extract' stage are only used
+                 when extracting images recursively.
+    :type jobs: dict
+
+    :param queue_size: maximum number of files waiting between two stages.
+    :type queue_size: int
+
+    :param max_depth: maximum nesting level of the images to extract.
+    :type max_depth: int
+
+    :param cache: cache of extracted data or None.
+    :type cache: :class:`grissom.extractors.cache.ExtractionCache`
+    """
+    def __init__(self, include_libs=False, include_kmods=False, scanner=None,
+                 agent=None, jobs=None, queue_size=64, max_depth=8,
+                 cache=None):
+        self._finder = BinfmtFinder(include_libs, include_kmods)
+        self._scanner = scanner
+        self._agent = agent
+        self._jobs = dict.fromkeys(AUDIT_STAGES, 1)
+        self._jobs.update(jobs or {})
+        self._queue_size = queue_size
+        self._max_depth = max_depth
+        self._cache = cache
+        self._search_paths = []
+        self._strip_args = ['strip']
+        self._packages = {}
+        self._lock = threading.Lock()
+
+    def _set_strip_cmd(self, value):
+        self._strip_args = value.split()
+
+    def _get_strip_cmd(self):
+        return ' '.join(self._strip_args)
+
+    strip_command = property(_get_strip_cmd,
+                             _set_strip_cmd,
+                             None,
+                             'command for discarding symbols')
+
+    def add_search_path(self, path):
+        """Add new a search path for source code.
+
+        :param path: path to directory.
+        :type path: str
+        """
+        self._search_paths.append(path)
+
+    def _iter_host_files(self, top):
+        if not os.path.isdir(top):
+            yield top, os.lstat(top).st_mode
+            return
+        for dirpath, dirnames, filenames in os.walk(top):
+            # The nested images are walked once extracted.
+            dirnames[:] = sorted(d for d in dirnames
+                                 if not d.endswith(NESTED_SUFFIX))
+            for name in sorted(filenames):
+                filename = os.path.join(dirpath, name)
+                try:
+                    yield filename, os.lstat(filename).st_mode
+                except OSError:
+                    continue
+
+    def _iter_extracted_files(self, path, destination):
+        extractor = RecursiveExtractor(self._jobs['extract'],
+                                       self._max_depth,
+                                       cache=self._cache)
+        for image in extractor.iter_extract([path], destination):
+            if image.error:
+                yield AuditResult(image.filename, None, None, None, None,
+                                  image.error)
+                continue
+            for filename, mode in self._iter_host_files(image.destination):
+                yield filename, mode
+
+    def _iter_files(self, path, fs, destination):
+        if destination is not None:
+            files = self._iter_extracted_files(path, destination)
+        elif fs is not None:
+            files = ((e.path, e.mode) for e in fs.walk())
+        else:
+            files = self._iter_host_files(path)
+        for item in files:
+            if isinstance(item, AuditResult):
+                yield item
+                continue
+            filename, mode = item
+            if self._finder.is_candidate(filename, mode):
+                yield AuditResult(filename, None, None, None, None, None)
+
+    def _scan(self, fs, result):
+        if result.error:
+            return result
+        try:
+            if not is_binfmt_file(result.filename, fs):
+                return None
+        except Exception as error:
+            return result._replace(error=str(error))
+        return result
+
+    def _find_dependencies(self, fs, result):
+        if result.error:
+            return result
+        try:
+            inspector = ElfInspector(result.filename, fs)
+            (name, libs), = inspector.find_dependencies(False)
+        except Exception as error:
+            return result._replace(error=str(error))
+        return result._replace(dependencies=libs)
+
+    def _find_package(self, origin):
+        for path in self._search_paths:
+            relpath = os.path.relpath(origin, path)
+            if relpath == os.curdir:
+                return os.path.basename(origin)
+            if relpath != os.pardir and \
+               not relpath.startswith(os.pardir + os.sep):
+                return relpath.split(os.sep)[0]
+        return None
+
+    def _find_origin(self, finder, result):
+        if result.error:
+            return result
+        try:
+            origin = finder.find_origin_of(result.filename)
+        except NoMatchError:
+            return result
+        except Exception as error:
+            return result._replace(error=str(error))
+        return result._replace(origin=origin,
+                               package=self._find_package(origin))
+
+    def _query_package(self, package):
+        with self._lock:
+            if package in self._packages:
+                return self._packages[package]
+        # Several files of a package may be looked up at once: the result
+        # is the same.
+        license = self._agent.query_major(package)
+        with self._lock:
+            self._packages[package] = license
+        return license
+
+    def _find_license(self, fs, result):
+        if result.error:
+            return result
+        license = None
+        try:
+            if self._scanner:
+                if fs:
+                    f = fs.open(result.filename)
+                else:
+                    f = open(result.filename, 'rb')
+                with f:
+                    info = self._scanner.scan_stream(f)
+                if info is not None:
+                    license = info['License']
+            if license is None and self._agent and result.package:
+                license = self._query_package(result.package)
+        except Exception as error:
+            return result._replace(error=str(error))
+        return result._replace(license=license)
+
+    def audit(self, path, destination=None):
+        """Audit the binary executable files of a directory or an image.
+
+        :param path: path to the directory or the image.
+        :type path: str
+
+        :param destination: path to the directory the image and the images
+                            it holds are extracted to, or None to read the
+                            image without extracting it.
+        :type destination: str
+
+        :returns: the results, in the order they are completed. Files with
+                  no known origin or license are reported with None as
+                  origin or license. Images which can not be extracted
+                  are reported with an error.
+        :rtype: iterator of :class:`grissom.pipeline.AuditResult`
+        """
+        # The inspectors resolve the paths of libraries from the root of
+        # the file system, which must not depend on the current directory.
+        path = os.path.abspath(path)
+        if destination is not None:
+            destination = os.path.abspath(destination)
+        fs = None
+        if destination is None and not os.path.isdir(path):
+            fs = ImageFileSystem(create_extractor(path))
+
+        pipeline = Pipeline(self._queue_size)
+        pipeline.add_stage(lambda r: self._scan(fs, r),
+                           self._jobs['scan'],
+                           'scan')
+        pipeline.add_stage(lambda r: self._find_dependencies(fs, r),
+                           self._jobs['deps'],
+                           'deps')
+        executor = None
+        if self._search_paths:
+            executor = CommandExecutor(self._jobs['origin'])
+            finder = SourceCodeFinder(False, fs, executor)
+            finder.strip_command = self.strip_command
+            for search_path in self._search_paths:
+                finder.add_search_path(search_path)
+            pipeline.add_stage(lambda r: self._find_origin(finder, r),
+                               self._jobs['origin'],
+                               'origin')
+        if self._scanner or self._agent:
+            pipeline.add_stage(lambda r: self._find_license(fs, r),
+                               self._jobs['license'],
+                               'license')
+        try:
+            files = profiling.iter_timed('stage.extract',
+                                         self._iter_files(path,
+                                                          fs,
+                                                          destination))
+            yield from pipeline.process(files)
+        finally:
+            if executor:
+                executor.shutdown()
+
+# vim: ts=4 sts=4 sw=4 et ai
@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+#
+# grissom - FOSS compliance tools
+#
+# Copyright (c) 2013 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Timers and counters for finding where the time goes
+
+Profiling is disabled by default: timers and counters then cost a check of
+a flag. Once enabled, the time spent in each timer and the number of calls
+are accumulated, across all threads, until a report is made::
+
+  profiling.enable()
+
+  @profiling.timed('foo.parse')
+  def parse(filename):
+      ...
+
+  with profiling.timer('foo.write'):
+      ...
+
+  profiling.report(sys.stderr)
+
+A timer entered again by the same thread, such as the timer of a recursive
+function, is only accounted for once, by its outermost call.
+"""
+
+import sys
+import json
+import time
+import atexit
+import functools
+import threading
+from collections import namedtuple
+from gettext import gettext as _
+
+TimerStats = namedtuple('TimerStats', ['name', 'calls', 'total', 'max'])
+
+REPORT_FORMATS = ('text', 'json')
+
+_enabled = False
+_start = None
+_lock = threading.Lock()
+_timers = {}
+_counters = {}
+_local = threading.local()
+
+def enable():
+    """Enable profiling, starting the measurements from scratch."""
+    global _enabled, _start
+    reset()
+    _start = time.perf_counter()
+    _enabled = True
+
+def disable():
+    """Disable profiling, keeping the measurements made so far."""
+    global _enabled
+    _enabled = False
+
+def is_enabled():
+    """Check if profiling is enabled.
+
+    :returns: True or False.
+    :rtype: bool
+    """
+    return _enabled
+
+def reset():
+    """Discard the measurements."""
+    with _lock:
+        _timers.clear()
+        _counters.clear()
+
+def _add_time(name, elapsed):
+    with _lock:
+        stats = _timers.get(name)
+        if stats is None:
+            _timers[name] = [1, elapsed, elapsed]
+        else:
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
+
+class _Timer(object):
+    def __init__(self, name):
+        self._name = name
+        self._start = None
+
+    def __enter__(self):
+        active = getattr(_local, 'active', None)
+        if active is None:
+            active = _local.active = set()
+        if self._name not in active:
+            active.add(self._name)
+            self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if self._start is not None:
+            _add_time(self._name, time.perf_counter() - self._start)
+            _local.active.discard(self._name)
+
+class _NullTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        pass
+
+_NULL_TIMER = _NullTimer()
+
+def timer(name):
+    """Create a context manager measuring the time spent in a block.
+
+    :param name: name of the timer.
+    :type name: str
+
+    :returns: the context manager.
+    """
+    if not _enabled:
+        return _NULL_TIMER
+    return _Timer(name)
+
+def timed(name):
+    """Create a decorator measuring the time spent in a function.
+
+    :param name: name of the timer.
+    :type name: str
+
+    :returns: the decorator.
+    :rtype: callable
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Timer(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def _iter_timed(name, iterator):
+    try:
+        while True:
+            with _Timer(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+    finally:
+        if hasattr(iterator, 'close'):
+            iterator.close()
+
+def iter_timed(name, iterable):
+    """Measure the time spent producing the items of an iterable, such as
+    the walk of a directory, excluding the time spent by the caller on the
+    items.
+
+    :param name: name of the timer.
+    :type name: str
+
+    :param iterable: the iterable.
+    :type iterable: iterable
+
+    :returns: the items of the iterable.
+    :rtype: iterator
+    """
+    if not _enabled:
+        return iterable
+    return _iter_timed(name, iter(iterable))
+
+def count(name, n=1):
+    """Increase a counter.
+
+    :param name: name of the counter.
+    :type name: str
+
+    :param n: value to add to the counter.
+    :type n: int
+    """
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+def get_timers():
+    """Get the measurements of the timers.
+
+    :returns: the measurements, the longest first.
+    :rtype: list of :class:`grissom.profiling.TimerStats`
+    """
+    with _lock:
+        stats = [TimerStats(n, *v) for n, v in _timers.items()]
+    return sorted(stats, key=lambda s: (-s.total, s.name))
+
+def get_counters():
+    """Get the values of the counters.
+
+    :returns: the values, by name of counter.
+    :rtype: dict
+    """
+    with _lock:
+        return dict(_counters)
+
+def get_wall_time():
+    """Get the time elapsed since profiling was enabled.
+
+    :returns: the time, in seconds.
+    :rtype: float
+    """
+    if _start is None:
+        return 0.0
+    return time.perf_counter() - _start
+
+def report(stream, format='text'):
+    """Write the measurements.
+
+    The time of the timers is summed over the threads, so it can exceed
+    the time elapsed.
+
+    :param stream: text stream to write to.
+    :type stream: file-like object
+
+    :param format: format of the report, 'text' for a table or 'json'.
+    :type format: str
+    """
+    timers = get_timers()
+    counters = get_counters()
+    if format == 'json':
+        data = {
+            'wall_time': get_wall_time(),
+            'timers': dict((s.name, {'calls': s.calls,
+                                     'total': s.total,
+                                     'max': s.max}) for s in timers),
+            'counters': counters,
+        }
+        stream.write(json.dumps(data, indent=2, sort_keys=True) + '\n')
+        return
+    stream.write(_("Wall time: {0:.3f} s").format(get_wall_time()) + '\n')
+    if timers:
+        stream.write('{0:<32} {1:>8} {2:>12} {3:>10} {4:>10}\n'.format(
+            _("Timer"), _("Calls"), _("Total (s)"), _("Mean (ms)"),
+            _("Max (ms)")))
+        for s in timers:
+            stream.write('{0:<32} {1:>8} {2:>12.3f} {3:>10.3f} '
+                         '{4:>10.3f}\n'.format(s.name,
+                                               s.calls,
+                                               s.total,
+                                               1000 * s.total / s.calls,
+                                               1000 * s.max))
+    if counters:
+        stream.write('{0:<32} {1:>8}\n'.format(_("Counter"), _("Value")))
+        for name in sorted(counters):
+            stream.write('{0:<32} {1:>8}\n'.format(name, counters[name]))
+
+def add_arguments(parser):
+    """Add the options controlling profiling to a command line parser.
+
+    :param parser: the parser.
+    :type parser: :class:`argparse.ArgumentParser`
+    """
+    parser.add_argument('--profile',
+                        action='store_true',
+                        default=False,
+                        help=_('report where the time goes on exit'))
+    parser.add_argument('--profile-format',
+                        choices=REPORT_FORMATS,
+                        default='text',
+                        metavar='FMT',
+                        help=_('set format of the profiling report'))
+
+def setup(args):
+    """Enable profiling if requested on the command line, reporting the
+    measurements on the standard error when the program exits.
+
+    :param args: the parsed arguments, as added by :func:`add_arguments`.
+    :type args: :class:`argparse.Namespace`
+    """
+    if not args.profile:
+        return
+    enable()
+    atexit.register(lambda: report(sys.stderr, args.profile_format))
+
+# vim: ts=4 sts=4 sw=4 et ai
@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+#
+# grissom - FOSS compliance tools
+#
+# Copyright (c) 2013 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Virtual file systems, for reading files wherever they are stored
+"""
+
+import io
+import os
+import stat
+import posixpath
+import threading
+from collections import OrderedDict
+from gettext import gettext as _
+from . import profiling
+from .common import FileNotFoundError
+from .extractors import create_extractor
+from .extractors.core import ExtractorEntry
+
+# Maximum number of symbolic links followed when resolving a path.
+_MAX_SYMLINKS = 40
+
+def normalize_path(path):
+    """Normalize a path of a virtual file system.
+
+    The path is made absolute, '/' being the top of the file system, and can
+    not go above it.
+
+    :param path: the path.
+    :type path: str
+
+    :returns: the normalized path.
+    :rtype: str
+    """
+    path = posixpath.normpath(posixpath.join('/', path))
+    # POSIX allows a leading '//' to have a special meaning: not here.
+    return '/' + path.lstrip('/')
+
+class FileSystem(object):
+    """Base class for virtual file systems.
+
+    The paths are absolute, '/' being the top of the file system. Symbolic
+    links are resolved within the file system, as if it was the root file
+    system of the device it was taken from.
+    """
+    def lstat(self, path):
+        """Get the entry of a path, without following symbolic links.
+
+        :param path: the path.
+        :type path: str
+
+        :returns: the entry.
+        :rtype: :class:`grissom.extractors.core.ExtractorEntry`
+        """
+        raise NotImplementedError
+
+    def walk(self, top='/'):
+        """Iterate over the entries below a directory, parents first.
+
+        The directory itself is not included and symbolic links are not
+        followed.
+
+        :param top: path to the directory.
+        :type top: str
+
+        :returns: the entries, whose paths are absolute.
+        :rtype: iterator of :class:`grissom.extractors.core.ExtractorEntry`
+        """
+        raise NotImplementedError
+
+    def read(self, path, size=None):
+        """Read the contents of a regular file.
+
+        :param path: path to the file.
+        :type path: str
+
+        :param size: maximum number of bytes to read, or None to read all
+                     the contents.
+        :type size: int
+
+        :returns: the contents.
+        :rtype: bytes
+        """
+        raise NotImplementedError
+
+    def open(self, path):
+        """Open a regular file for reading.
+
+        :param path: path to the file.
+        :type path: str
+
+        :returns: a binary file object, supporting seek().
+        :rtype: file-like object
+        """
+        return io.BytesIO(self.read(path))
+
+    def realpath(self, path):
+        """Resolve the symbolic links of a path.
+
+        :param path: the path.
+        :type path: str
+
+        :returns: the canonical path.
+        :rtype: str
+        """
+        parts = [p for p in posixpath.join('/', path).split('/') if p]
+        resolved = '/'
+        n_links = 0
+        while parts:
+            name = parts.pop(0)
+            if name == '.':
+                continue
+            if name == '..':
+                resolved = posixpath.dirname(resolved)
+                continue
+            current = posixpath.join(resolved, name)
+            try:
+                entry = self.lstat(current)
+            except FileNotFoundError:
+                entry = None
+            if entry is None or not entry.issym():
+                resolved = current
+                continue
+            n_links += 1
+            if n_links > _MAX_SYMLINKS:
+                msg = _("too many levels of symbolic links in {fn}")
+                raise FileNotFoundError(msg.format(fn=path))
+            target = posixpath.join(resolved, entry.linkname)
+            parts = [p for p in target.split('/') if p] + parts
+            resolved = '/'
+        return normalize_path(resolved)
+
+    def stat(self, path):
+        """Get the entry of a path, following symbolic links.
+
+        :param path: the path.
+        :type path: str
+
+        :returns: the entry.
+        :rtype: :class:`grissom.extractors.core.ExtractorEntry`
+        """
+        return self.lstat(self.realpath(path))
+
+    def exists(self, path):
+        """Check if a path exists, following symbolic links.
+
+        :param path: the path.
+        :type path: str
+
+        :returns: True or False.
+        :rtype: bool
+        """
+        try:
+            self.stat(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def getsize(self, path):
+        """Get the size of a file, following symbolic links.
+
+        :param path: path to the file.
+        :type path: str
+
+        :returns: the size, in bytes.
+        :rtype: int
+        """
+        return self.stat(path).size
+
+class HostFileSystem(FileSystem):
+    """File system stored in a directory of the host.
+
+    :param root: path to the directory.
+    :type root: str
+    """
+    def __init__(self, root):
+        self._root = os.path.abspath(root)
+
+    def _to_host(self, path):
+        return os.path.join(self._root, normalize_path(path).lstrip('/'))
+
+    def _to_entry(self, path, st, host_path):
+        linkname = None
+        if stat.S_ISLNK(st.st_mode):
+            linkname = os.readlink(host_path)
+        return ExtractorEntry(path,
+                              st.st_mode,
+                              st.st_size,
+                              st.st_uid,
+                              st.st_gid,
+                              linkname,
+                              st.st_rdev)
+
+    def lstat(self, path):
+        path = normalize_path(path)
+        host_path = self._to_host(path)
+        try:
+            st = os.lstat(host_path)
+        except OSError:
+            raise FileNotFoundError(_("can not find {fn}").format(fn=path))
+        return self._to_entry(path, st, host_path)
+
+    def walk(self, top='/'):
+        top = normalize_path(top)
+        host_top = self._to_host(top)
+        for dirpath, dirnames, filenames in os.walk(host_top):
+            dirnames.sort()
+            relpath = os.path.relpath(dirpath, host_top)
+            base = top
+            if relpath != os.curdir:
+                base = posixpath.join(top, relpath)
+            for name in dirnames + sorted(filenames):
+                host_path = os.path.join(dirpath, name)
+                try:
+                    st = os.lstat(host_path)
+                except OSError:
+                    continue
+                yield self._to_entry(posixpath.join(base, name), st, host_path)
+
+    def read(self, path, size=None):
+        with self.open(path) as f:
+            return f.read(-1 if size is None else size)
+
+    def open(self, path):
+        # The host resolves the links from its own root: resolve them here.
+        path = self.realpath(path)
+        if not self.lstat(path).isreg():
+            msg = _("{fn} is not a regular file").format(fn=path)
+            raise FileNotFoundError(msg)
+        return open(self._to_host(path), 'rb')
+
+class ImageFileSystem(FileSystem):
+    """File system stored in an image, read through its extractor without
+    writing it to disk.
+
+    Only the entries of the image are kept in memory. The contents of the
+    most recently read files are cached, as a file is usually read several
+    times in a row when inspected.
+
+    :param extractor: extractor of the image.
+    :type extractor: :class:`grissom.extractors.core.Extractor`
+
+    :param cache_size: maximum number of bytes of contents to cache.
+    :type cache_size: int
+    """
+    def __init__(self, extractor, cache_size=32 * 1024 * 1024):
+        self._extractor = extractor
+        self._cache_size = cache_size
+        self._cached_bytes = 0
+        self._cache = OrderedDict()
+        self._entries = None
+        self._lock = threading.Lock()
+
+    @property
+    def extractor(self):
+        """Extractor of the image."""
+        return self._extractor
+
+    def _get_entries(self):
+        with self._lock:
+            if self._entries is None:
+                entries = OrderedDict()
+                entries['/'] = ExtractorEntry('/', stat.S_IFDIR | 0o755, 0)
+                for entry in self._extractor.iter_entries():
+                    entries[normalize_path(entry.path)] = entry
+                self._entries = entries
+            return self._entries
+
+    def _export(self, path, entry):
+        # The entries of the extractor have paths relative to the image.
+        return ExtractorEntry(path,
+                              entry.mode,
+                              entry.size,
+                              entry.uid,
+                              entry.gid,
+                              entry.linkname,
+                              entry.rdev)
+
+    def lstat(self, path):
+        path = normalize_path(path)
+        entry = self._get_entries().get(path)
+        if entry is None:
+            raise FileNotFoundError(_("can not find {fn}").format(fn=path))
+        return self._export(path, entry)
+
+    def walk(self, top='/'):
+        top = normalize_path(top)
+        prefix = top.rstrip('/') + '/'
+        for path, entry in self._get_entries().items():
+            if path != top and path.startswith(prefix):
+                yield self._export(path, entry)
+
+    def _find_file(self, path):
+        path = self.realpath(path)
+        entry = self._get_entries().get(path)
+        if entry is None:
+            raise FileNotFoundError(_("can not find {fn}").format(fn=path))
+        if not entry.isreg():
+            msg = _("{fn} is not a regular file").format(fn=path)
+            raise FileNotFoundError(msg)
+        return path, entry
+
+    def read(self, path, size=None):
+        path, entry = self._find_file(path)
+        with self._lock:
+            data = self._cache.get(path)
+            if data is not None:
+                self._cache.move_to_end(path)
+                profiling.count('vfs.cache_hits')
+                return data if size is None else data[:size]
+        profiling.count('vfs.cache_misses')
+        if size is not None and size < entry.size:
+            # Only the blocks holding the first bytes are decompressed.
+            return self._extractor.read(entry, size)
+        data = self._extractor.read(entry)
+        if len(data) <= self._cache_size:
+            with self._lock:
+                if path not in self._cache:
+                    self._cache[path] = data
+                    self._cached_bytes += len(data)
+                while self._cached_bytes > self._cache_size:
+                    key, value = self._cache.popitem(last=False)
+                    self._cached_bytes -= len(value)
+        return data if size is None else data[:size]
+
+def open_filesystem(path):
+    """Open a file system, stored in a directory or in an image.
+
+    :param path: path to the directory or the image.
+    :type path: str
+
+    :returns: the file system.
+    :rtype: :class:`grissom.vfs.FileSystem`
+    """
+    if os.path.isdir(path):
+        return HostFileSystem(path)
+    return ImageFileSystem(create_extractor(path))
+
+# vim: ts=4 sts=4 sw=4 et ai
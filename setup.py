@@ -42,7 +42,7 @@ setup(name='grissom',
       install_requires=[
           'pyelftools >=0.21',
           'filemagic >=1.6',
-          'beautifulsoup4 >=4.3.2',
+          'beautifulsoup4 >=4.4.0',
           'docutils >=0.11'
       ],
       packages=find_packages(),
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+#
+# grissom - FOSS compliance tools
+#
+# Copyright (c) 2013 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+The fixtures hold the same tree, with 4 KiB blocks:
+
+  mkfs.cramfs -b 4096 -n grissom rootfs rootfs.cramfs
+
+The SquashFS 4.0 image is gzip-compressed, with a fragment and a sparse
+block, and without export and xattr tables.
+"""
+
+import io
+import os
+import stat
+import tarfile
+import pytest
+from grissom.extractors import create_extractor
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+BUSYBOX = bytes((i * 7 + i // 256) % 256 for i in range(10000))
+
+# Path, mode, and contents or target of the entries.
+EXPECTED_TREE = [
+    ('bin', stat.S_IFDIR | 0o755, None),
+    ('bin/busybox', stat.S_IFREG | 0o755, BUSYBOX),
+    ('bin/sh', stat.S_IFLNK | 0o777, 'busybox'),
+    ('etc', stat.S_IFDIR | 0o755, None),
+    ('etc/hostname', stat.S_IFREG | 0o644, b'grissom\n'),
+    ('etc/init.d', stat.S_IFDIR | 0o755, None),
+    ('etc/init.d/rcS', stat.S_IFREG | 0o755, b'#!/bin/sh\nmount -a\n'),
+    ('tmp', stat.S_IFDIR | 0o1777, None),
+    ('usr', stat.S_IFDIR | 0o755, None),
+    ('usr/share', stat.S_IFDIR | 0o755, None),
+    ('usr/share/zeros', stat.S_IFREG | 0o644, bytes(8192) + b'end\n'),
+]
+
+IMAGES = ['rootfs.cramfs', 'rootfs.sqfs']
+
+@pytest.mark.parametrize('image', IMAGES)
+def test_iter_entries(image):
+    extractor = create_extractor(os.path.join(FIXTURES_DIR, image))
+    tree = []
+    for entry in extractor.iter_entries():
+        if entry.isreg():
+            value = extractor.read(entry)
+        elif entry.issym():
+            value = entry.linkname
+        else:
+            value = None
+        tree.append((entry.path, entry.mode, value))
+    assert tree == EXPECTED_TREE
+
+@pytest.mark.parametrize('image', IMAGES)
+def test_read_head(image):
+    extractor = create_extractor(os.path.join(FIXTURES_DIR, image))
+    for entry in extractor.iter_entries():
+        if entry.path == 'bin/busybox':
+            assert extractor.read(entry, 5000) == BUSYBOX[:5000]
+
+@pytest.mark.parametrize('image', IMAGES)
+def test_extract(image, tmp_path):
+    extractor = create_extractor(os.path.join(FIXTURES_DIR, image))
+    root = extractor.extract(str(tmp_path))
+    tree = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(dirnames + filenames):
+            path = os.path.join(dirpath, name)
+            st = os.lstat(path)
+            if stat.S_ISREG(st.st_mode):
+                with open(path, 'rb') as f:
+                    value = f.read()
+            elif stat.S_ISLNK(st.st_mode):
+                value = os.readlink(path)
+            else:
+                value = None
+            tree.append((os.path.relpath(path, root), st.st_mode, value))
+    assert sorted(tree) == EXPECTED_TREE
+
+def test_tar_hard_links(tmp_path, monkeypatch):
+    filename = str(tmp_path / 'links.tar.gz')
+    with tarfile.open(filename, 'w:gz') as archive:
+        info = tarfile.TarInfo('a.txt')
+        info.size = 6
+        archive.addfile(info, io.BytesIO(b'hello\n'))
+        for name, target in (('b.txt', 'missing'), ('c.txt', 'a.txt')):
+            info = tarfile.TarInfo(name)
+            info.type = tarfile.LNKTYPE
+            info.linkname = target
+            archive.addfile(info)
+    # Looking up the targets in the archive would read all of it.
+    monkeypatch.delattr(tarfile.TarFile, 'getmember')
+    extractor = create_extractor(filename)
+    tree = [(e.path, e.size, extractor.read(e))
+            for e in extractor.iter_entries()]
+    assert tree == [('a.txt', 6, b'hello\n'), ('c.txt', 6, b'hello\n')]
+
+# vim: ts=4 sts=4 sw=4 et ai
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+#
+# grissom - FOSS compliance tools
+#
+# Copyright (c) 2013 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import socket
+from grissom.legal.fossology import FossologyAgent, FossologyError
+from grissom.legal.fossology import JOB_COMPLETED, JOB_FAILED, JOB_RUNNING
+
+class _StubAgent(FossologyAgent):
+    """Agent whose uploads and jobs are simulated."""
+    def __init__(self, statuses):
+        FossologyAgent.__init__(self, 'localhost')
+        self._statuses = statuses
+        self.n_polls = 0
+
+    def _check_session(self):
+        pass
+
+    def submit(self, filename, force=False):
+        return len(filename)
+
+    def job_status(self, upid):
+        self.n_polls += 1
+        status = self._statuses(self.n_polls)
+        if isinstance(status, Exception):
+            raise status
+        return status
+
+def submit(agent, max_wait):
+    return list(agent.submit_many(['a', 'bb'],
+                                  poll_interval=0.01,
+                                  max_poll_interval=0.02,
+                                  max_wait=max_wait))
+
+def test_submit_many_completed():
+    agent = _StubAgent(lambda n: JOB_COMPLETED if n > 4 else JOB_RUNNING)
+    results = submit(agent, 10.0)
+    assert sorted((r.filename, r.status, r.error) for r in results) == [
+        ('a', JOB_COMPLETED, None), ('bb', JOB_COMPLETED, None)]
+
+def test_submit_many_timeout():
+    agent = _StubAgent(lambda n: JOB_RUNNING)
+    results = submit(agent, 0.1)
+    assert sorted(r.filename for r in results) == ['a', 'bb']
+    for r in results:
+        assert r.status == JOB_FAILED
+        assert isinstance(r.error, FossologyError)
+
+def test_submit_many_transient_errors_timeout():
+    agent = _StubAgent(lambda n: socket.timeout())
+    results = submit(agent, 0.1)
+    assert [r.status for r in results] == [JOB_FAILED, JOB_FAILED]
+
+# vim: ts=4 sts=4 sw=4 et ai
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+#
+# grissom - FOSS compliance tools
+#
+# Copyright (c) 2013 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import shutil
+import subprocess
+import pytest
+from grissom.misc import SourceCodeFinder
+
+pytestmark = pytest.mark.skipif(not (shutil.which('cc') and
+                                     shutil.which('strip')),
+                                reason='cc and strip are needed')
+
+SOURCE = b'#include <stdio.h>\nint main(void) { puts("%s"); return 0; }\n'
+
+def build(tmp_path, directory, message):
+    src = tmp_path / (directory + '.c')
+    src.write_bytes(SOURCE.replace(b'%s', message.encode('ascii')))
+    os.makedirs(str(tmp_path / 'src' / directory))
+    filename = str(tmp_path / 'src' / directory / 'hello')
+    subprocess.check_call(['cc', '-g', '-o', filename, str(src)])
+    return filename
+
+def find_origin(tmp_path, strip_command):
+    # A different program of the same name is searched first.
+    build(tmp_path, 'a-other', 'other')
+    origin = build(tmp_path, 'b-hello', 'hello')
+    stripped = str(tmp_path / 'hello')
+    subprocess.check_call(strip_command.split() + [origin, '-o', stripped])
+    finder = SourceCodeFinder()
+    finder.strip_command = strip_command
+    finder.add_search_path(str(tmp_path / 'src'))
+    return finder, finder.find_origin_of(stripped)
+
+def test_find_origin_default_strip(tmp_path):
+    finder, origin = find_origin(tmp_path, 'strip')
+    assert origin == str(tmp_path / 'src' / 'b-hello')
+
+def test_find_origin_strip_with_options(tmp_path):
+    # The layout of the stripped file differs from that of the candidates,
+    # which must not be discarded before being stripped.
+    command = 'strip --remove-section=.note.gnu.build-id --strip-all'
+    finder, origin = find_origin(tmp_path, command)
+    assert origin == str(tmp_path / 'src' / 'b-hello')
+
+# vim: ts=4 sts=4 sw=4 et ai
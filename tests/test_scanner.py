@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+#
+# grissom - FOSS compliance tools
+#
+# Copyright (c) 2013 Eric Le Bihan <eric.le.bihan.dev@free.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import io
+import pytest
+from grissom.legal.scanner import LicenseScanner
+
+def scan(data):
+    return LicenseScanner().scan_stream(io.BytesIO(data))
+
+@pytest.mark.parametrize('line, license', [
+    (b'/* SPDX-License-Identifier: MIT */', 'MIT'),
+    (b'// SPDX-License-Identifier: GPL-2.0-or-later', 'GPL-2.0-or-later'),
+    (b'# SPDX-License-Identifier: Apache-2.0\n', 'Apache-2.0'),
+    (b'<!-- SPDX-License-Identifier: MIT -->', 'MIT'),
+    (b'<!--SPDX-License-Identifier: ISC-->\n', 'ISC'),
+    (b'{- SPDX-License-Identifier: BSD-3-Clause -}', 'BSD-3-Clause'),
+    (b'-- SPDX-License-Identifier: BSD-2-Clause', 'BSD-2-Clause'),
+    (b'(* SPDX-License-Identifier: LGPL-2.1+ *)', 'LGPL-2.1+'),
+])
+def test_comment_terminators(line, license):
+    assert scan(b'int x;\n' + line + b'\nint y;\n')['License'] == license
+
+def test_copyright_comment_terminator():
+    info = scan(b'<!-- Copyright (c) 2013 Foo -->\n'
+                b'<!-- SPDX-License-Identifier: MIT -->\n')
+    assert info['Copyright'] == 'Copyright (c) 2013 Foo'
+
+def test_compound_expressions():
+    info = scan(b'// SPDX-License-Identifier: GPL-2.0-only OR MIT\n'
+                b'// SPDX-License-Identifier: MIT\n'
+                b'// SPDX-License-Identifier: (GPL-2.0-only OR MIT)\n')
+    assert info['License'] == '(GPL-2.0-only OR MIT) AND MIT'
+
+def test_single_compound_expression():
+    info = scan(b'// SPDX-License-Identifier: '
+                b'GPL-2.0 WITH Linux-syscall-note\n')
+    assert info['License'] == 'GPL-2.0 WITH Linux-syscall-note'
+
+# vim: ts=4 sts=4 sw=4 et ai